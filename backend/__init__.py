@@ -1,13 +1,15 @@
 from flask import Flask
 from flask_cors import CORS
 import os
-import google.generativeai as genai
 from dotenv import load_dotenv
 
 load_dotenv()
 
 
 def create_app():
+    from .utils.log_utils import setup_logging
+    setup_logging()
+
     app = Flask(__name__)
     CORS(app)
     from dotenv import load_dotenv
@@ -17,7 +19,11 @@ def create_app():
     api_key = os.getenv("GEMINI_KEY")
     if not api_key:
         raise EnvironmentError("❌ GEMINI_KEY not set.")
-    genai.configure(api_key=api_key)
+    # google.generativeai is imported and configured lazily on the first
+    # Gemini call (utils/model_registry.py) to keep cold starts short
+    from .utils.model_registry import GEMINI_PRELOAD, preload
+    if GEMINI_PRELOAD:
+        preload()
 
    
     # Blueprint imports
@@ -26,6 +32,8 @@ def create_app():
     from .routes.feature_routes import feature_bp
     from .routes.api_routes import api_bp
     from .routes.error_handlers import errors_bp
+    from .routes.metrics_routes import metrics_bp
+    from .routes.job_routes import jobs_bp
 
     # Register blueprints
     app.register_blueprint(auth_bp)
@@ -33,5 +41,12 @@ def create_app():
     app.register_blueprint(feature_bp)
     app.register_blueprint(api_bp)
     app.register_blueprint(errors_bp)
+    app.register_blueprint(metrics_bp)
+    app.register_blueprint(jobs_bp)
+
+    # Management commands (`flask monographs ...`, `flask cache warm`)
+    from .cli import cache_cli, monographs_cli
+    app.cli.add_command(monographs_cli)
+    app.cli.add_command(cache_cli)
 
     return app
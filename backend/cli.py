@@ -0,0 +1,389 @@
+import json
+import logging
+import os
+import statistics
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import click
+from flask.cli import AppGroup
+
+from .utils.drug_index import canonical_drug_id, canonical_drug_name
+from .utils.monograph_store import MONOGRAPH_DB, read_monographs, validate_monograph, write_monographs
+
+
+# ---------------------------
+# Management commands
+# ---------------------------
+#
+# Registered on the app in create_app, run with e.g.:
+#   flask --app app monographs build --drugs backend/static/data/drug_names.json
+#   flask --app app cache warm --drugs top_drugs.txt --pairs top_pairs.txt
+
+monographs_cli = AppGroup("monographs", help="Build and inspect the precomputed drug monograph store.")
+cache_cli = AppGroup("cache", help="Warm the shared response cache.")
+
+
+def read_drug_list(path):
+    """Read drug names from a JSON list or a text file with one name per line."""
+    with open(path, encoding="utf-8") as f:
+        content = f.read()
+    if path.endswith(".json"):
+        return json.loads(content)
+    return [line.strip() for line in content.splitlines() if line.strip() and not line.startswith("#")]
+
+
+def generate_monographs(drug_names, concurrency=4, attempts=2):
+    """Generate and validate monographs; returns ([(drug_id, name, sections)], failed names)."""
+    from .utils.gemini_utils import fetch_drug_information
+
+    unique = {}
+    for name in drug_names:
+        unique.setdefault(canonical_drug_id(name), canonical_drug_name(name))
+
+    def generate(drug_id, name):
+        problems = []
+        for _ in range(attempts):
+            sections, problems = validate_monograph(fetch_drug_information(name))
+            if not problems:
+                return drug_id, name, sections, []
+        return drug_id, name, None, problems
+
+    stored, failed = [], []
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [executor.submit(generate, drug_id, name) for drug_id, name in unique.items()]
+        with click.progressbar(length=len(futures), label="Generating monographs") as bar:
+            for future in as_completed(futures):
+                drug_id, name, sections, problems = future.result()
+                if sections:
+                    stored.append((drug_id, name, sections))
+                else:
+                    failed.append(name)
+                    logging.warning(f"⚠️ Skipping {name}: {', '.join(problems)}")
+                bar.update(1)
+    return stored, failed
+
+
+def new_version():
+    return time.strftime("%Y%m%d%H%M%S", time.gmtime())
+
+
+@monographs_cli.command("build")
+@click.option("--drugs", "drugs_file", default="backend/static/data/drug_names.json", show_default=True,
+              help="JSON list or text file (one name per line) of drugs to precompute.")
+@click.option("--output", default=MONOGRAPH_DB, show_default=True, help="SQLite file to write.")
+@click.option("--concurrency", default=4, show_default=True, help="Parallel Gemini calls.")
+@click.option("--max-failures", default=0.1, show_default=True,
+              help="Leave the store unchanged if more than this fraction of drugs fail.")
+def build_command(drugs_file, output, concurrency, max_failures):
+    """
+    Generate monographs for a list of drugs and atomically replace the store.
+    Drugs that fail keep their previous monograph; if too many fail (e.g.
+    while the circuit breaker is open) nothing is written.
+    """
+    stored, failed = generate_monographs(read_drug_list(drugs_file), concurrency)
+    if failed and (not stored or len(failed) > max_failures * (len(stored) + len(failed))):
+        click.echo(f"❌ {len(failed)} of {len(stored) + len(failed)} monographs failed; {output} left unchanged.")
+        raise SystemExit(1)
+
+    kept = []
+    if failed and os.path.exists(output):
+        generated = {drug_id for drug_id, _, _ in stored}
+        failed_ids = {canonical_drug_id(name) for name in failed}
+        previous, _ = read_monographs(output)
+        kept = [(drug_id, m["name"], m["sections"]) for drug_id, m in previous.items()
+                if drug_id in failed_ids and drug_id not in generated]
+    version = new_version()
+    write_monographs(output, stored + kept, version)
+    click.echo(f"✅ Stored {len(stored)} monographs in {output} (version {version}).")
+    if failed:
+        click.echo(f"⚠️ {len(failed)} failed validation ({len(kept)} kept their previous monograph): "
+                   f"{', '.join(sorted(failed))}")
+
+
+@monographs_cli.command("refresh")
+@click.option("--output", default=MONOGRAPH_DB, show_default=True, help="SQLite file to refresh.")
+@click.option("--concurrency", default=4, show_default=True, help="Parallel Gemini calls.")
+def refresh_command(output, concurrency):
+    """Regenerate every drug currently in the store. Drugs that fail keep their old monograph."""
+    monographs, old_version = read_monographs(output)
+    names = [m["name"] for m in monographs.values()]
+    stored, failed = generate_monographs(names, concurrency)
+    version = new_version()
+    refreshed = {drug_id for drug_id, _, _ in stored}
+    kept = [(drug_id, m["name"], m["sections"]) for drug_id, m in monographs.items() if drug_id not in refreshed]
+    write_monographs(output, stored + kept, version)
+    click.echo(f"✅ Refreshed {len(stored)} monographs ({old_version} -> {version}); kept {len(kept)} unchanged.")
+
+
+@monographs_cli.command("info")
+@click.option("--path", default=MONOGRAPH_DB, show_default=True)
+def info_command(path):
+    """Show the version and size of the monograph store."""
+    monographs, version = read_monographs(path)
+    click.echo(f"{path}: version {version}, {len(monographs)} monographs")
+
+
+# ---------------------------
+# Cache warm-up
+# ---------------------------
+#
+# Run after a deploy, before traffic is switched over: popular drugs and
+# pairs are fetched through the normal request path, which writes them to
+# the SQLite L2 cache that every worker on the host reads. Items that are
+# already cached (or precomputed as monographs) are skipped without calling
+# Gemini. Finished items go into a checkpoint file after each one, so an
+# interrupted warm-up resumes where it stopped; failures are retried on the
+# next run.
+
+def read_pair_list(path):
+    """Read drug pairs from a JSON list of [a, b] or a text file with "a, b" per line."""
+    with open(path, encoding="utf-8") as f:
+        content = f.read()
+    if path.endswith(".json"):
+        return [tuple(pair) for pair in json.loads(content)]
+    pairs = []
+    for line in content.splitlines():
+        names = [name.strip() for name in line.replace("|", ",").split(",")]
+        if len(names) == 2 and all(names) and not line.startswith("#"):
+            pairs.append(tuple(names))
+    return pairs
+
+
+def read_access_log(path):
+    """
+    Count drug and pair requests in a log of request bodies: JSON lines with
+    `drug_name`, `drug_names`, `drug1`/`drug2` or `drugs`, or plain lines
+    holding one drug or a comma-separated pair.
+    """
+    drugs, pairs = Counter(), Counter()
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            try:
+                body = json.loads(line)
+            except ValueError:
+                body = None
+            if not isinstance(body, dict):
+                names = [name.strip() for name in line.split(",") if name.strip()]
+                if len(names) == 1:
+                    drugs[canonical_drug_name(names[0])] += 1
+                elif len(names) == 2:
+                    pairs[_pair(*names)] += 1
+                continue
+            if body.get("drug_name"):
+                drugs[canonical_drug_name(body["drug_name"])] += 1
+            for name in body.get("drug_names") or ():
+                drugs[canonical_drug_name(name)] += 1
+            if body.get("drug1") and body.get("drug2"):
+                pairs[_pair(body["drug1"], body["drug2"])] += 1
+            names = body.get("drugs") or ()
+            for i, first in enumerate(names):
+                for second in names[i + 1:]:
+                    pairs[_pair(first, second)] += 1
+    return drugs, pairs
+
+
+def _pair(drug1, drug2):
+    # Same canonical order as the pair cache, so (A, B) and (B, A) count once
+    return tuple(sorted((canonical_drug_name(drug1), canonical_drug_name(drug2)), key=canonical_drug_id))
+
+
+def _top(names, top):
+    """Deduplicate by canonical ID, keeping the first (most frequent) spelling."""
+    unique = {}
+    for name in names:
+        unique.setdefault(canonical_drug_id(name), canonical_drug_name(name))
+    return list(unique.values())[:top]
+
+
+def _top_pairs(pairs, top):
+    unique = {}
+    for drug1, drug2 in pairs:
+        pair = _pair(drug1, drug2)
+        unique.setdefault(pair_id(*pair), pair)
+    return list(unique.values())[:top]
+
+
+def pair_id(drug1, drug2):
+    return "|".join(sorted((canonical_drug_id(drug1), canonical_drug_id(drug2))))
+
+
+class Pacer:
+    """Spaces upstream calls at most `rate` per second across threads, and waits out an open breaker."""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate > 0 else 0
+        self.next_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        from .utils.circuit_breaker import gemini_breaker
+
+        while gemini_breaker.is_open():
+            remaining = gemini_breaker.reset_timeout - (time.monotonic() - gemini_breaker.opened_at)
+            time.sleep(min(max(remaining, 0.5), 5))
+        with self.lock:
+            now = time.monotonic()
+            delay = self.next_at - now
+            self.next_at = max(now, self.next_at) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+class Checkpoint:
+    """
+    Finished items and their timings, rewritten atomically after each item.
+    Entries older than `max_age` seconds are dropped on load: the cache
+    entries they stand for have expired by then.
+    """
+
+    def __init__(self, path, restart=False, max_age=None):
+        self.path = path
+        self.done = {"drugs": {}, "pairs": {}}
+        self.lock = threading.Lock()
+        if path and not restart and os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                self.done.update(json.load(f))
+        if max_age is not None:
+            cutoff = time.time() - max_age
+            for kind, entries in self.done.items():
+                self.done[kind] = {key: entry for key, entry in entries.items() if entry.get("at", 0) >= cutoff}
+
+    def __contains__(self, item):
+        kind, key = item
+        return key in self.done[kind]
+
+    def record(self, kind, key, status, elapsed_ms):
+        with self.lock:
+            self.done[kind][key] = {"status": status, "ms": elapsed_ms, "at": time.time()}
+            if self.path:
+                tmp = self.path + ".tmp"
+                with open(tmp, "w", encoding="utf-8") as f:
+                    json.dump(self.done, f, indent=1)
+                os.replace(tmp, self.path)
+
+
+def warm_items(items, concurrency, pacer, checkpoint):
+    """Fetch (kind, key, label, fn) items; returns [(kind, label, status, elapsed_ms)]."""
+    results = []
+
+    def run(kind, key, label, fetch):
+        started = time.perf_counter()
+        try:
+            status = fetch(pacer)
+        except Exception as e:
+            logging.warning(f"⚠️ Warm-up failed for {label}: {e}")
+            status = "failed"
+        elapsed_ms = round((time.perf_counter() - started) * 1000, 1)
+        if status != "failed":
+            checkpoint.record(kind, key, status, elapsed_ms)
+        return kind, label, status, elapsed_ms
+
+    icons = {"generated": "✅", "cached": "📦", "monograph": "📚", "failed": "❌"}
+    with ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="cache-warm") as executor:
+        futures = [executor.submit(run, *item) for item in items]
+        for i, future in enumerate(as_completed(futures), 1):
+            kind, label, status, elapsed_ms = future.result()
+            results.append((kind, label, status, elapsed_ms))
+            click.echo(f"[{i:>4}/{len(futures)}] {icons[status]} {kind[:-1]:<5} {label:<45} {elapsed_ms:>9.1f} ms  {status}")
+    return results
+
+
+def _drug_warm_status(name):
+    """"monograph" or "cached" when the drug needs no upstream call, else None."""
+    from .utils.gemini_utils import get_cached_drug_entry
+    from .utils.monograph_store import get_monograph
+
+    if get_monograph(canonical_drug_id(name)):
+        return "monograph"
+    if get_cached_drug_entry(name):
+        return "cached"
+    return None
+
+
+def _fetch_drug(name):
+    from .utils.gemini_utils import get_drug_information
+
+    def fetch(pacer):
+        status = _drug_warm_status(name)
+        if status:
+            return status
+        pacer.wait()
+        return "failed" if get_drug_information(name).startswith("❌") else "generated"
+    return fetch
+
+
+def _fetch_pair(drug1, drug2):
+    from .utils.gemini_utils import get_cached_pair, get_drug_comparison_summary
+
+    def fetch(pacer):
+        if get_cached_pair(drug1, drug2):
+            return "cached"
+        pacer.wait()
+        return "failed" if get_drug_comparison_summary(drug1, drug2).startswith("❌") else "generated"
+    return fetch
+
+
+@cache_cli.command("warm")
+@click.option("--drugs", "drugs_file", help="JSON list or text file (one name per line) of top drugs, most popular first.")
+@click.option("--pairs", "pairs_file", help='JSON list of [a, b] or text file ("a, b" per line) of top drug pairs.')
+@click.option("--access-log", "access_log", help="Request-body log to rank drugs and pairs by frequency instead.")
+@click.option("--top", default=200, show_default=True, help="Warm at most this many drugs and this many pairs.")
+@click.option("--concurrency", default=4, show_default=True, help="Parallel requests.")
+@click.option("--rate", default=2.0, show_default=True, help="Max upstream Gemini calls per second (0 = unlimited).")
+@click.option("--checkpoint", "checkpoint_file", default=".cache_warm_checkpoint.json", show_default=True,
+              help="Progress file; finished items are skipped when the command is re-run.")
+@click.option("--restart", is_flag=True, help="Ignore the checkpoint and start over.")
+def warm_command(drugs_file, pairs_file, access_log, top, concurrency, rate, checkpoint_file, restart):
+    """Prefetch top drugs and drug pairs into the shared cache before taking traffic."""
+    drugs, pairs = [], []
+    if drugs_file:
+        drugs += read_drug_list(drugs_file)
+    if pairs_file:
+        pairs += read_pair_list(pairs_file)
+    if access_log:
+        drug_counts, pair_counts = read_access_log(access_log)
+        drugs += [name for name, _ in drug_counts.most_common()]
+        pairs += [pair for pair, _ in pair_counts.most_common()]
+    if not drugs and not pairs:
+        raise click.UsageError("Give --drugs, --pairs and/or --access-log.")
+
+    from .utils.gemini_utils import DRUG_CACHE_HARD_TTL, get_cached_pair
+
+    # Drug and pair entries live for the hard TTL; older checkpoint entries are warmed again
+    checkpoint = Checkpoint(checkpoint_file, restart, max_age=DRUG_CACHE_HARD_TTL)
+    items = []
+    skipped = 0
+    for name in _top(drugs, top):
+        key = canonical_drug_id(name)
+        # The checkpoint only says an item was warmed; it may since have been evicted
+        if ("drugs", key) in checkpoint and _drug_warm_status(name):
+            skipped += 1
+        else:
+            items.append(("drugs", key, name, _fetch_drug(name)))
+    for drug1, drug2 in _top_pairs(pairs, top):
+        key = pair_id(drug1, drug2)
+        if ("pairs", key) in checkpoint and get_cached_pair(drug1, drug2):
+            skipped += 1
+        else:
+            items.append(("pairs", key, f"{drug1} / {drug2}", _fetch_pair(drug1, drug2)))
+    click.echo(f"🔥 Warming {len(items)} items ({skipped} already done per {checkpoint_file} and still cached).")
+
+    started = time.perf_counter()
+    results = warm_items(items, concurrency, Pacer(rate), checkpoint)
+    elapsed = time.perf_counter() - started
+
+    counts = Counter(status for _, _, status, _ in results)
+    generated = sorted(ms for _, _, status, ms in results if status == "generated")
+    click.echo(f"\nDone in {elapsed:.1f}s: " + ", ".join(f"{n} {status}" for status, n in sorted(counts.items())))
+    if generated:
+        p95 = generated[min(len(generated) - 1, int(len(generated) * 0.95))]
+        click.echo(f"Generated items: median {statistics.median(generated):.0f} ms, p95 {p95:.0f} ms")
+    if counts["failed"]:
+        click.echo(f"⚠️ {counts['failed']} items failed; re-run to retry them.")
+        raise SystemExit(1)
@@ -1,28 +1,76 @@
 
-from flask import Blueprint, request, jsonify
-from ..utils.gemini_utils import get_drug_information, get_symptom_recommendation, analyze_image_with_gemini, analyze_prescription_with_gemini, analyze_allergies, get_drug_comparison_summary
+from flask import Blueprint, Response, after_this_request, request, jsonify, stream_with_context, url_for
+import json
+import time
+from ..utils.gemini_utils import get_drug_information, get_symptom_recommendation, analyze_image_with_gemini, analyze_prescription_with_gemini, analyze_allergies, get_drug_comparison_summary, drug_cache, stream_drug_information, stream_symptom_recommendation, get_drug_information_batch, DRUG_BATCH_MAX, get_interaction_matrix, MAX_INTERACTION_DRUGS, pair_cache, drug_extra_cache
+from ..utils.gemini_engine import get_engine_stats
+from ..utils.generation import get_generation_config
+from ..utils.single_flight import get_single_flight_stats
+from ..utils.markdown_render import get_render_stats
+from ..utils.image_dedupe import get_image_cache_stats
+from ..utils.image_pipeline import ImageRejected, spool_upload, upload_bytes
+from ..utils.job_queue import QueueFull, get_job_stats, submit_job
+from ..utils.admission import admission_control, get_admission_stats, list_cost, pair_cost
+from ..utils.monograph_store import monograph_store
+from ..utils.symptom_cache import symptom_cache
+from ..utils.log_utils import describe_payload, log_event, redact_text
 import logging
-logging.basicConfig(level=logging.INFO,format="%(asctime)s [%(levelname)s] %(message)s")
 
 api_bp = Blueprint('api', __name__)
 
+def interaction_flag(pair):
+    """Matrix flag for one pair, from the severity line of its comparison."""
+    if pair['status'] == 'error':
+        return 'error'
+    if pair['severity'] in ('moderate', 'major'):
+        return 'warning'
+    if pair['severity'] in ('none', 'minor'):
+        return 'ok'
+    return 'unknown'
+
+
 @api_bp.route('/check_drug_interactions', methods=['POST'])
+@admission_control("compare", cost=pair_cost("drugs"))
 def check_drug_interactions():
-    logging.info("API /check_drug_interactions called")
+    """
+    Pairwise interaction check for 2..MAX_INTERACTION_DRUGS drugs.
+    Returns the combined `summary` and `warning` as before, plus `pairs`
+    (one result per unordered pair, with its interaction `severity`) and a
+    `matrix` of per-pair flags indexed like `drugs`: "warning" for moderate
+    or major interactions, "ok" for none or minor, "unknown" when the
+    severity couldn't be read, and "error".
+    """
+    log_event("api.call", "API /check_drug_interactions called")
     try:
         data = request.get_json()
         drugs = data.get('drugs')
         if not drugs or not isinstance(drugs, list) or len(drugs) < 2:
             return api_response('At least two drugs must be selected.', 400)
-        # Use Gemini or other logic to check interactions
-        summary = get_drug_comparison_summary(drugs[0], drugs[1])
-        # Simple logic: if 'interaction' or 'warning' found in summary, return warning
+        if len(drugs) > MAX_INTERACTION_DRUGS:
+            return api_response(f'At most {MAX_INTERACTION_DRUGS} drugs can be checked at once.', 400)
+
+        names, pairs = get_interaction_matrix(drugs)
+        if len(names) < 2:
+            return api_response('At least two different drugs must be selected.', 400)
+
+        index = {name: i for i, name in enumerate(names)}
+        matrix = [[None] * len(names) for _ in names]
+        for pair in pairs:
+            flag = interaction_flag(pair)
+            pair['warning'] = flag == 'warning'
+            i, j = index[pair['drugs'][0]], index[pair['drugs'][1]]
+            matrix[i][j] = matrix[j][i] = flag
+
+        if len(pairs) == 1:
+            summary = pairs[0]['summary']
+        else:
+            summary = "\n\n".join(f"### {p['drugs'][0]} + {p['drugs'][1]}\n\n{p['summary']}" for p in pairs)
         warning = None
-        if 'interaction' in summary.lower() or 'warning' in summary.lower():
+        if any(p['warning'] for p in pairs):
             warning = 'Potential drug interaction detected. Please review the summary.'
-        return jsonify({'summary': summary, 'warning': warning})
+        return jsonify({'summary': summary, 'warning': warning, 'drugs': names, 'pairs': pairs, 'matrix': matrix})
     except Exception as e:
-        logging.exception("Exception in /check_drug_interactions")
+        log_event("api.error", "Exception in /check_drug_interactions", level=logging.ERROR, exc_info=True)
         return api_response(f"Internal error: {str(e)}", 500)
 
 
@@ -34,58 +82,168 @@ def api_response(message, status=200):
     return jsonify({'response': message}), status
 
 
+def wants_stream(data):
+    """Streaming is opt-in: `"stream": true` in the body, `?stream=1`, or an SSE/NDJSON Accept header."""
+    if data.get('stream') or request.args.get('stream') in ('1', 'true'):
+        return True
+    accept = request.headers.get('Accept', '')
+    return 'text/event-stream' in accept or 'application/x-ndjson' in accept
+
+
+def get_image_upload():
+    """
+    The uploaded image, without base64: a multipart `image` file part or a raw
+    `image/*` body as a seekable file; otherwise the legacy `image_data` data URL.
+    """
+    upload = request.files.get('image')
+    if upload:
+        return upload.stream
+    if request.mimetype.startswith('image/'):
+        spool = spool_upload(request.stream, request.content_length)
+        after_this_request(lambda response: spool.close() or response)
+        return spool
+    return request.form.get('image_data')
+
+
+def wants_async():
+    """Background job mode is opt-in: `?async=1` or a `Prefer: respond-async` header."""
+    return request.args.get('async') in ('1', 'true') or 'respond-async' in request.headers.get('Prefer', '')
+
+
+def image_job_response(task, image_data):
+    """Queue an image analysis and answer 202 with its job (429 when the queue is full)."""
+    try:
+        job = submit_job(task, upload_bytes(image_data))
+    except ImageRejected as e:
+        return jsonify({'result': f'❌ {str(e)}'}), 400
+    except QueueFull:
+        log_event("job.rejected", "⚠️ Job queue full, rejecting %s job", task, level=logging.WARNING)
+        response = jsonify({'result': '❌ Too many analyses in progress. Please try again shortly.'})
+        response.headers['Retry-After'] = '5'
+        return response, 429
+    job['status_url'] = url_for('jobs.job_status', job_id=job['id'])
+    response = jsonify(job)
+    response.headers['Location'] = job['status_url']
+    return response, 202
+
+
+def stream_response(events):
+    """
+    Send (event, payload) tuples as Server-Sent Events, or as JSON lines when
+    the client asks for application/x-ndjson.
+    """
+    ndjson = 'application/x-ndjson' in request.headers.get('Accept', '')
+
+    def generate():
+        for event, payload in events:
+            if ndjson:
+                yield json.dumps({'event': event, **payload}) + '\n'
+            else:
+                yield f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='application/x-ndjson' if ndjson else 'text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
+
 
 @api_bp.route('/get_drug_info', methods=['POST'])
+@admission_control("drug_info")
 def get_drug_info():
-    logging.info("API /get_drug_info called")
+    log_event("api.call", "API /get_drug_info called")
     try:
         data = request.get_json()
-        logging.info(f"Request JSON: {data}")
+        log_event("api.request", "Request body", level=logging.DEBUG, body=describe_payload(data))
         drug_name = data.get('drug_name')
         if not drug_name:
-            logging.warning("No drug name provided in request")
+            log_event("api.bad_request", "No drug name provided in request", level=logging.WARNING)
             return api_response('❌ No drug name provided.', 400)
-        logging.info(f"Calling get_drug_information with drug_name: {drug_name}")
+        if wants_stream(data):
+            log_event("api.call", "Streaming drug information for: %s", drug_name)
+            return stream_response(stream_drug_information(drug_name))
         response = get_drug_information(drug_name)
         return api_response(response)
     except Exception as e:
-        logging.error(f"Exception in /get_drug_info: {str(e)}")
+        log_event("api.error", "Exception in /get_drug_info: %s", e, level=logging.ERROR)
         return api_response(f"❌ Error: {str(e)}", 500)
 
 
 
+@api_bp.route('/get_drug_info/batch', methods=['POST'])
+@admission_control("drug_info", cost=list_cost("drug_names"))
+def get_drug_info_batch():
+    """
+    Batch drug lookup. Input: {"drug_names": [...]}. Streams one JSON line per
+    unique drug ({"drug_name", "status", "cached", "elapsed_ms", "response"})
+    followed by a {"summary": {...}} line.
+    """
+    log_event("api.call", "API /get_drug_info/batch called")
+    data = request.get_json(silent=True) or {}
+    drug_names = data.get('drug_names')
+    if not drug_names or not isinstance(drug_names, list):
+        return api_response('❌ drug_names must be a non-empty list.', 400)
+    if len(drug_names) > DRUG_BATCH_MAX:
+        return api_response(f'❌ At most {DRUG_BATCH_MAX} drug names per batch.', 400)
+
+    def generate():
+        started = time.perf_counter()
+        counts = {'total': 0, 'ok': 0, 'error': 0, 'cached': 0}
+        for item in get_drug_information_batch(drug_names):
+            counts['total'] += 1
+            counts[item['status']] += 1
+            counts['cached'] += item['cached']
+            yield json.dumps(item) + '\n'
+        counts['elapsed_ms'] = round((time.perf_counter() - started) * 1000, 1)
+        log_event("api.batch_done", "✅ Batch of %d drugs done", counts['total'], **counts)
+        yield json.dumps({'summary': counts}) + '\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+
 @api_bp.route('/symptom_checker', methods=['POST'])
+@admission_control("symptoms")
 def symptom_check():
-    logging.info("API /symptom_checker called")
+    log_event("api.call", "API /symptom_checker called")
     try:
         data = request.get_json()
-        logging.info(f"Request JSON: {data}")
+        log_event("api.request", "Request body", level=logging.DEBUG, body=describe_payload(data))
         symptoms = data.get('symptoms')
         if not symptoms:
-            logging.warning("❌ No symptoms provided.")
+            log_event("api.bad_request", "❌ No symptoms provided.", level=logging.WARNING)
             return api_response('❌ No symptoms provided.', 400)
-        logging.info(f"Calling get_symptom_recommendation with symptoms: {symptoms}")
+        if wants_stream(data):
+            log_event("api.call", "Streaming symptom recommendation", symptoms=redact_text(symptoms))
+            return stream_response(stream_symptom_recommendation(symptoms))
         result = get_symptom_recommendation(symptoms)
         return api_response(result)
     except Exception as e:
-        logging.error(f"❌ Exception in /symptom_checker: {str(e)}")
+        log_event("api.error", "❌ Exception in /symptom_checker: %s", e, level=logging.ERROR)
         return api_response(f'❌ Error during analysis: {str(e)}', 500)
 
 @api_bp.route('/process-upload', methods=['POST'])
+@admission_control("vision", cost=2)
 def process_upload():
-    logging.info("API /process-upload called")
-    image_data = request.form.get("image_data")
+    log_event("api.call", "API /process-upload called")
+    try:
+        image_data = get_image_upload()
+    except ImageRejected as e:
+        return jsonify({'result': f'❌ {str(e)}'})
     if image_data:
-        logging.info("Image data received for analysis")
+        log_event("api.request", "Image data received for analysis", level=logging.DEBUG, content_type=request.mimetype)
+        if wants_async():
+            return image_job_response("packaging_image", image_data)
         result = analyze_image_with_gemini(image_data)
         return jsonify({'result': result})
     else:
-        logging.warning("❌ No image data received in request")
+        log_event("api.bad_request", "❌ No image data received in request", level=logging.WARNING)
     return jsonify({'result': '❌ No image received from camera.'})
 
 @api_bp.route('/compare_drugs_summary', methods=['POST'])
+@admission_control("compare")
 def compare_drugs_summary():
-    logging.info("API /compare_drugs_summary called")
+    log_event("api.call", "API /compare_drugs_summary called")
     try:
         data = request.get_json()
         drug1 = data.get('drug1')
@@ -98,51 +256,80 @@ def compare_drugs_summary():
         return jsonify({'summary': summary})
 
     except Exception as e:
-        logging.exception("❌ Exception in /compare_drugs_summary")
+        log_event("api.error", "❌ Exception in /compare_drugs_summary", level=logging.ERROR, exc_info=True)
         return api_response(f"❌ Internal error: {str(e)}", 500)
 
 @api_bp.route('/validate-prescription', methods=['POST'])
+@admission_control("vision", cost=2)
 def validate_prescription():
-    logging.info("📩 API /validate-prescription called")
+    log_event("api.call", "📩 API /validate-prescription called")
 
-    image_data = request.form.get("image_data")
+    try:
+        image_data = get_image_upload()
+    except ImageRejected as e:
+        return jsonify({'result': f'❌ {str(e)}'})
     if image_data:
-        logging.info("📷 Prescription image data received for validation")
+        log_event("api.request", "📷 Prescription image data received for validation", level=logging.DEBUG,
+                  content_type=request.mimetype)
+
+        if wants_async():
+            return image_job_response("prescription", image_data)
 
         # Process the image with Gemini (replace with your validator logic)
         result = analyze_prescription_with_gemini(image_data)
 
-        logging.info(f"✅ Gemini result: {result}")
+        log_event("api.result", "✅ Prescription validated", level=logging.DEBUG, result_chars=len(result or ""))
         return jsonify({'result': result})
     else:
-        logging.warning("❌ No image data received in /validate-prescription")
+        log_event("api.bad_request", "❌ No image data received in /validate-prescription", level=logging.WARNING)
         return jsonify({'result': '❌ No image received for validation.'})
 
 
 @api_bp.route('/allergy_checker', methods=['POST'])
+@admission_control("allergy")
 def allergy_checker():
     """
     Endpoint to analyze allergies vs medicines using Gemini.
     """
-    logging.info("📩 API allergy-checker called")
+    log_event("api.call", "📩 API allergy-checker called")
 
     try:
         data = request.get_json()
-        logging.info(f"Request JSON: {data}")
+        log_event("api.request", "Request body", level=logging.DEBUG, body=describe_payload(data))
         allergies = data.get('allergies', '')
         medicines = data.get('medicines', '')
 
         if not allergies:
-            logging.warning("❌ No allergies provided.")
+            log_event("api.bad_request", "❌ No allergies provided.", level=logging.WARNING)
             return api_response('❌ No allergies provided.', 400)
         if not medicines:
-            logging.warning("❌ No Medicines provided.")
+            log_event("api.bad_request", "❌ No Medicines provided.", level=logging.WARNING)
             return api_response('❌ No Medicines provided.', 400)
 
         result = analyze_allergies(allergies, medicines)
         return api_response(result)
 
     except Exception as e:
-        logging.error(f"❌ Exception in /allergy_checker: {str(e)}")
+        log_event("api.error", "❌ Exception in /allergy_checker: %s", e, level=logging.ERROR)
         return api_response(f'❌ Error during allergy checking: {str(e)}', 500)
 
+
+@api_bp.route('/status/gemini', methods=['GET'])
+def gemini_status():
+    """
+    Upstream health for alerting: circuit breaker state and transitions,
+    rejected calls, retry budget, coalescing and cache counters.
+    """
+    stats = get_engine_stats()
+    stats['single_flight'] = get_single_flight_stats()
+    stats['drug_cache'] = drug_cache.stats()
+    stats['pair_cache'] = pair_cache.stats()
+    stats['drug_extra_cache'] = drug_extra_cache.stats()
+    stats['render_cache'] = get_render_stats()
+    stats['image_caches'] = get_image_cache_stats()
+    stats['monographs'] = monograph_store.stats()
+    stats['symptom_cache'] = symptom_cache.stats()
+    stats['jobs'] = get_job_stats()
+    stats['admission'] = get_admission_stats()
+    stats['generation'] = get_generation_config()
+    return jsonify(stats)
@@ -0,0 +1,21 @@
+from flask import Blueprint, jsonify, request
+
+from ..utils.job_queue import get_job
+
+jobs_bp = Blueprint('jobs', __name__)
+
+
+@jobs_bp.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """
+    Status of a background analysis (`?async=1` on the image endpoints).
+    `?wait=N` long-polls up to N seconds (capped by JOB_WAIT_MAX) for it to finish.
+    """
+    try:
+        wait = float(request.args.get('wait', 0))
+    except ValueError:
+        wait = 0
+    job = get_job(job_id, wait=wait)
+    if job is None:
+        return jsonify({'result': '❌ Job not found or expired.'}), 404
+    return jsonify(job)
@@ -0,0 +1,32 @@
+from flask import Blueprint, Response, g, request
+import time
+
+from ..utils.metrics import finish_request, render_metrics, server_timing, start_request
+
+metrics_bp = Blueprint('metrics', __name__)
+
+
+@metrics_bp.before_app_request
+def start_request_timer():
+    g.metrics_endpoint = request.endpoint or 'unmatched'
+    g.metrics_started = time.perf_counter()
+    start_request(g.metrics_endpoint, request.headers.get('X-Trace'))
+
+
+@metrics_bp.after_app_request
+def record_request(response):
+    started = g.get('metrics_started')
+    if started is None:
+        return response
+    elapsed = time.perf_counter() - started
+    finish_request(g.metrics_endpoint, response.status_code, elapsed)
+    timing = server_timing(elapsed)
+    if timing:
+        response.headers['Server-Timing'] = timing
+    return response
+
+
+@metrics_bp.route('/metrics', methods=['GET'])
+def metrics():
+    """Counters and latency histograms in the Prometheus text format."""
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,318 @@
+import hashlib
+import logging
+import math
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from functools import wraps
+
+from cachetools import TTLCache
+from flask import jsonify, make_response, request, session
+
+from .log_utils import log_event
+from .metrics import count_admission
+
+
+# ---------------------------
+# Admission control & rate limiting
+# ---------------------------
+#
+# Every Gemini-backed API route passes through `admission_control(feature)`:
+# 1. a token bucket per client (API key, else IP) refills at the rate of the
+#    client's priority lane; an empty bucket gets 429 + Retry-After
+# 2. a cap on in-flight requests per upstream feature, shared by all
+#    workers; a full feature sheds load with 503 + Retry-After
+#
+# Lanes come from the same roles `role_required` checks: doctors and
+# pharmacists are "clinical", patients (and anonymous visitors) "standard",
+# students "low". Lower lanes get slower buckets and may only fill part of
+# each feature's slots, so a burst of student traffic always leaves headroom
+# for clinicians.
+#
+# RATE_LIMIT_BACKEND=sqlite keeps buckets and in-flight leases in
+# RATE_LIMIT_DB so every gunicorn worker on the host sees the same state.
+# Leases expire after ADMISSION_LEASE seconds in case a worker dies mid-request.
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")
+RATE_LIMIT_DB = os.getenv("RATE_LIMIT_DB", os.path.join(tempfile.gettempdir(), "medimate_admission.sqlite3"))
+RATE_LIMIT_TRUST_PROXY = os.getenv("RATE_LIMIT_TRUST_PROXY", "false").lower() == "true"
+ADMISSION_LEASE = float(os.getenv("ADMISSION_LEASE", "120"))
+ADMISSION_RETRY_AFTER = int(os.getenv("ADMISSION_RETRY_AFTER", "2"))
+
+# "key1:doctor,key2:student" -> API clients get the lane of their role
+API_KEY_ROLES = dict(
+    item.strip().split(":", 1) for item in os.getenv("API_KEY_ROLES", "").split(",") if ":" in item
+)
+
+ROLE_LANES = {"doctor": "clinical", "pharmacist": "clinical", "patient": "standard", "student": "low"}
+
+
+class Lane:
+    def __init__(self, name, per_minute, burst, share):
+        prefix = f"RATE_LIMIT_{name.upper()}_"
+        self.name = name
+        self.rate = float(os.getenv(prefix + "PER_MINUTE", per_minute)) / 60.0
+        self.burst = float(os.getenv(prefix + "BURST", burst))
+        # Fraction of each feature's in-flight slots this lane may use
+        self.share = share
+
+
+LANES = {
+    "clinical": Lane("clinical", per_minute=120, burst=30, share=1.0),
+    "standard": Lane("standard", per_minute=30, burst=10, share=0.75),
+    "low": Lane("low", per_minute=15, burst=5, share=0.5),
+}
+
+
+def _limit(feature, default):
+    return int(os.getenv(f"ADMISSION_{feature.upper()}_LIMIT", default))
+
+
+FEATURE_LIMITS = {
+    "drug_info": _limit("drug_info", 32),
+    "symptoms": _limit("symptoms", 16),
+    "compare": _limit("compare", 16),
+    "allergy": _limit("allergy", 16),
+    "vision": _limit("vision", 8),
+}
+
+
+class MemoryAdmissionBackend:
+    """Per-process buckets and in-flight counts."""
+
+    def __init__(self):
+        # Idle buckets are full again after an hour anyway
+        self.buckets = TTLCache(maxsize=100000, ttl=3600)
+        self.inflight = {}
+        self.lock = threading.Lock()
+
+    def take(self, key, rate, burst, cost):
+        """Spend `cost` tokens; returns 0 if allowed, else seconds until enough tokens refill."""
+        now = time.monotonic()
+        with self.lock:
+            tokens, updated = self.buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            if tokens >= cost:
+                self.buckets[key] = (tokens - cost, now)
+                return 0
+            self.buckets[key] = (tokens, now)
+        return (cost - tokens) / rate
+
+    def acquire(self, feature, limit):
+        with self.lock:
+            count = self.inflight.get(feature, 0)
+            if count >= limit:
+                return None
+            self.inflight[feature] = count + 1
+            return feature
+
+    def release(self, lease):
+        with self.lock:
+            self.inflight[lease] -= 1
+
+    def stats(self):
+        with self.lock:
+            return {"backend": "memory", "clients": len(self.buckets), "inflight": dict(self.inflight)}
+
+
+class SQLiteAdmissionBackend:
+    """Buckets and in-flight leases in a SQLite file shared by every worker on the host."""
+
+    def __init__(self, path, lease=120):
+        self.path = path
+        self.lease = lease
+        self._local = threading.local()
+        self._init_db()
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _init_db(self):
+        conn = self._connect()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS leases ("
+            " id TEXT PRIMARY KEY, feature TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS leases_feature ON leases (feature, expires_at)")
+
+    def _transaction(self, fn):
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = fn(conn)
+            conn.execute("COMMIT")
+            return result
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def take(self, key, rate, burst, cost):
+        now = time.time()
+
+        def update(conn):
+            row = conn.execute("SELECT tokens, updated FROM buckets WHERE key = ?", (key,)).fetchone()
+            tokens = burst if row is None else min(burst, row[0] + (now - row[1]) * rate)
+            allowed = tokens >= cost
+            conn.execute(
+                "INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)",
+                (key, tokens - cost if allowed else tokens, now),
+            )
+            if random.random() < 0.01:
+                conn.execute("DELETE FROM buckets WHERE updated < ?", (now - 3600,))
+            return 0 if allowed else (cost - tokens) / rate
+
+        return self._transaction(update)
+
+    def acquire(self, feature, limit):
+        now = time.time()
+        lease = uuid.uuid4().hex
+
+        def claim(conn):
+            conn.execute("DELETE FROM leases WHERE expires_at < ?", (now,))
+            count = conn.execute("SELECT COUNT(*) FROM leases WHERE feature = ?", (feature,)).fetchone()[0]
+            if count >= limit:
+                return None
+            conn.execute(
+                "INSERT INTO leases (id, feature, expires_at) VALUES (?, ?, ?)", (lease, feature, now + self.lease)
+            )
+            return lease
+
+        return self._transaction(claim)
+
+    def release(self, lease):
+        self._connect().execute("DELETE FROM leases WHERE id = ?", (lease,))
+
+    def stats(self):
+        conn = self._connect()
+        clients = conn.execute("SELECT COUNT(*) FROM buckets").fetchone()[0]
+        rows = conn.execute(
+            "SELECT feature, COUNT(*) FROM leases WHERE expires_at >= ? GROUP BY feature", (time.time(),)
+        ).fetchall()
+        return {"backend": "sqlite", "path": self.path, "clients": clients, "inflight": dict(rows)}
+
+
+if RATE_LIMIT_BACKEND == "sqlite":
+    admission_backend = SQLiteAdmissionBackend(RATE_LIMIT_DB, ADMISSION_LEASE)
+else:
+    admission_backend = MemoryAdmissionBackend()
+
+rejections = {"rate_limited": 0, "shed": 0}
+_rejections_lock = threading.Lock()
+
+
+def request_lane():
+    """Priority lane for the current request, from its API key or session role."""
+    api_key = request.headers.get("X-API-Key")
+    role = API_KEY_ROLES.get(api_key) if api_key else session.get("role")
+    return ROLE_LANES.get(role, "standard")
+
+
+def client_id():
+    api_key = request.headers.get("X-API-Key")
+    # Only configured keys get their own bucket; otherwise a client could send
+    # a new made-up key with every request and never run out of tokens
+    if api_key and api_key in API_KEY_ROLES:
+        return "key:" + hashlib.blake2b(api_key.encode("utf-8"), digest_size=8).hexdigest()
+    if RATE_LIMIT_TRUST_PROXY and request.access_route:
+        return "ip:" + request.access_route[0]
+    return "ip:" + (request.remote_addr or "unknown")
+
+
+def _reject(status, message, retry_after, reason):
+    with _rejections_lock:
+        rejections[reason] += 1
+    response = jsonify({"response": message})
+    response.status_code = status
+    response.headers["Retry-After"] = str(max(1, math.ceil(retry_after)))
+    return response
+
+
+def pair_cost(field="drugs"):
+    """Cost of a pairwise request: one token per unordered pair of the list in `field`."""
+    def cost():
+        data = request.get_json(silent=True) or {}
+        items = data.get(field)
+        n = len(items) if isinstance(items, list) else 0
+        return max(1, n * (n - 1) // 2)
+    return cost
+
+
+def list_cost(field):
+    """Cost of a batch request: one token per item of the list in `field`."""
+    def cost():
+        data = request.get_json(silent=True) or {}
+        items = data.get(field)
+        return max(1, len(items) if isinstance(items, list) else 0)
+    return cost
+
+
+def admission_control(feature, cost=1):
+    """
+    Rate-limit the client and cap in-flight requests for `feature` before
+    running the view. `cost` is a token count, or a function of the current
+    request returning one.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if not RATE_LIMIT_ENABLED:
+                return f(*args, **kwargs)
+            lane = LANES[request_lane()]
+            client = client_id()
+            # A request costing more than a full bucket could never be admitted; it drains the bucket instead
+            tokens = min(cost() if callable(cost) else cost, lane.burst)
+
+            wait = admission_backend.take(f"{lane.name}:{client}", lane.rate, lane.burst, tokens)
+            if wait:
+                count_admission(feature, lane.name, "rate_limited")
+                log_event("api.rate_limited", "⛔ Rate limit hit", level=logging.WARNING,
+                          feature=feature, lane=lane.name, retry_after=round(wait, 1))
+                return _reject(429, "❌ Too many requests. Please slow down and try again shortly.", wait, "rate_limited")
+
+            lease = admission_backend.acquire(feature, max(1, int(FEATURE_LIMITS[feature] * lane.share)))
+            if lease is None:
+                count_admission(feature, lane.name, "shed")
+                log_event("api.shed", "⛔ %s at capacity, shedding request", feature, level=logging.WARNING,
+                          feature=feature, lane=lane.name)
+                return _reject(503, "❌ The service is busy. Please try again shortly.", ADMISSION_RETRY_AFTER, "shed")
+
+            count_admission(feature, lane.name, "admitted")
+            try:
+                response = make_response(f(*args, **kwargs))
+            except BaseException:
+                admission_backend.release(lease)
+                raise
+            if response.is_streamed:
+                # Streaming bodies run after we return; hold the slot until the stream closes
+                response.call_on_close(lambda: admission_backend.release(lease))
+            else:
+                admission_backend.release(lease)
+            return response
+        return decorated_function
+    return decorator
+
+
+def get_admission_stats():
+    stats = admission_backend.stats()
+    stats.update(
+        enabled=RATE_LIMIT_ENABLED,
+        limits=FEATURE_LIMITS,
+        lanes={name: {"per_minute": lane.rate * 60, "burst": lane.burst, "share": lane.share}
+               for name, lane in LANES.items()},
+        rejections=dict(rejections),
+    )
+    return stats
@@ -0,0 +1,167 @@
+import json
+import os
+import threading
+
+from .drug_index import DATA_DIR, canonical_drug_id, normalize_name
+
+
+# ---------------------------
+# Rule-based allergy pre-screen
+# ---------------------------
+#
+# Obvious cases (penicillin allergy vs amoxicillin, sulfa vs Bactrim) don't
+# need Gemini. Each drug class in the bundled table gets one bit; a drug's
+# mask has the bits of every class it belongs to, and each class also has a
+# mask of classes it cross-reacts with. A pair (allergy, medicine) is then:
+# - "unsafe"   same drug, or masks overlap (same class)
+# - "caution"  the medicine is in a cross-reactive class
+# - "safe"     both are in classes of the table and share no class or
+#              cross-reactivity
+# - "unknown"  either side has no class data (even a known drug name) ->
+#              left for Gemini
+
+DRUG_CLASSES_FILE = os.path.join(DATA_DIR, "drug_classes.json")
+
+UNSAFE = "unsafe"
+CAUTION = "caution"
+SAFE = "safe"
+UNKNOWN = "unknown"
+
+
+class AllergyRules:
+    def __init__(self, table):
+        self.labels = []         # bit -> class label
+        self.class_masks = {}    # class alias / drug name -> class mask
+        self.cross_masks = []    # bit -> mask of cross-reactive classes
+        self.cross_notes = {}    # (bit, bit) -> note
+        # Classes only used for cross-reactivity: sharing one isn't "same class"
+        # (thiazide vs loop diuretic), and membership alone proves nothing safe
+        self.cross_only = 0
+
+        bits = {}
+        for bit, (class_id, info) in enumerate(table["classes"].items()):
+            bits[class_id] = bit
+            self.labels.append(info["label"])
+            self.cross_masks.append(0)
+            if info.get("cross_reactivity_only"):
+                self.cross_only |= 1 << bit
+            for alias in info.get("aliases", []) + [info["label"]]:
+                self._add(normalize_name(alias), 1 << bit)
+            for member in info["members"]:
+                self._add(normalize_name(member), 1 << bit)
+                self._add(canonical_drug_id(member), 1 << bit)
+
+        # Umbrella names ("beta-lactam") cover several classes at once
+        for group in table.get("groups", {}).values():
+            mask = 0
+            for class_id in group["classes"]:
+                mask |= 1 << bits[class_id]
+            for alias in group["aliases"]:
+                self._add(normalize_name(alias), mask)
+
+        for rule in table.get("cross_reactivity", []):
+            a, b = (bits[c] for c in rule["classes"])
+            self.cross_masks[a] |= 1 << b
+            self.cross_masks[b] |= 1 << a
+            self.cross_notes[(a, b)] = self.cross_notes[(b, a)] = rule["note"]
+
+    def _add(self, key, mask):
+        self.class_masks[key] = self.class_masks.get(key, 0) | mask
+
+    def mask_for(self, name):
+        """Class mask for a drug or class name (0 if it belongs to no known class)."""
+        return self.class_masks.get(normalize_name(name)) or self.class_masks.get(canonical_drug_id(name), 0)
+
+    def cross_mask(self, mask):
+        result = 0
+        bit = 0
+        while mask:
+            if mask & 1:
+                result |= self.cross_masks[bit]
+            mask >>= 1
+            bit += 1
+        return result
+
+    def class_names(self, mask):
+        return [label for bit, label in enumerate(self.labels) if mask >> bit & 1]
+
+    def notes(self, allergy_mask, medicine_mask):
+        return [
+            note for (a, b), note in self.cross_notes.items()
+            if allergy_mask >> a & 1 and medicine_mask >> b & 1
+        ]
+
+    def check_pair(self, allergy, medicine):
+        """Return (verdict, reason) for one allergy against one medicine."""
+        allergy_mask = self.mask_for(allergy)
+        medicine_mask = self.mask_for(medicine)
+
+        if canonical_drug_id(allergy) == canonical_drug_id(medicine):
+            return UNSAFE, f"same drug as the reported **{allergy}** allergy"
+        shared = allergy_mask & medicine_mask & ~self.cross_only
+        if shared:
+            classes = ", ".join(self.class_names(shared))
+            return UNSAFE, f"belongs to the same class as **{allergy}** ({classes})"
+        if self.cross_mask(allergy_mask) & medicine_mask:
+            notes = " ".join(self.notes(allergy_mask, medicine_mask))
+            return CAUTION, f"possible cross-reactivity with **{allergy}**. {notes}".strip()
+
+        # Only a verdict when the table knows the classes of both sides; a
+        # known name without class data (vancomycin, losartan) goes to Gemini
+        if allergy_mask & ~self.cross_only and medicine_mask & ~self.cross_only:
+            return SAFE, f"no shared class or known cross-reactivity with **{allergy}**"
+        return UNKNOWN, None
+
+
+_rules = None
+_rules_lock = threading.Lock()
+
+
+def load_rules():
+    global _rules
+    with _rules_lock:
+        if _rules is None:
+            with open(DRUG_CLASSES_FILE, encoding="utf-8") as f:
+                _rules = AllergyRules(json.load(f))
+    return _rules
+
+
+def screen_allergies(allergies, medicines):
+    """
+    Check every (allergy, medicine) pair against the class table.
+    Returns (results, ambiguous) where results maps each medicine to its worst
+    clear-cut verdict and reasons, and ambiguous lists the (allergy, medicine)
+    pairs that need Gemini.
+    """
+    rules = load_rules()
+    severity = {UNSAFE: 3, CAUTION: 2, SAFE: 1}
+    results = {}
+    ambiguous = []
+    for medicine in medicines:
+        verdict, reasons = SAFE, []
+        for allergy in allergies:
+            pair_verdict, reason = rules.check_pair(allergy, medicine)
+            if pair_verdict == UNKNOWN:
+                ambiguous.append((allergy, medicine))
+                continue
+            if pair_verdict != SAFE:
+                reasons.append(reason)
+            if severity[pair_verdict] > severity[verdict]:
+                verdict = pair_verdict
+        results[medicine] = {"verdict": verdict, "reasons": reasons}
+    return results, ambiguous
+
+
+def render_screen(results, ambiguous_medicines=()):
+    """Markdown for the rule-based part of the answer."""
+    icons = {UNSAFE: "⛔ **Not safe**", CAUTION: "⚠️ **Use with caution**", SAFE: "✅ **No known conflict**"}
+    lines = ["## Rule-based Allergy Screen"]
+    for medicine, result in results.items():
+        if result["verdict"] == SAFE and medicine in ambiguous_medicines:
+            # Nothing clear-cut to say; the AI review below covers it
+            continue
+        line = f"- **{medicine.title()}**: {icons[result['verdict']]}"
+        if result["reasons"]:
+            line += " — " + "; ".join(result["reasons"])
+        lines.append(line)
+    return "\n".join(lines)
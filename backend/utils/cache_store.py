@@ -0,0 +1,275 @@
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+from cachetools import TTLCache
+
+from .metrics import count_cache, span
+
+
+# ---------------------------
+# Shared cache tiers
+# ---------------------------
+#
+# L1 is the per-worker in-memory TTLCache (fast, wiped on restart).
+# L2 is a SQLite file on local disk that every gunicorn worker on the host
+# shares, so a fresh worker can serve popular entries without calling Gemini.
+
+DEFAULT_CACHE_DB = os.path.join(tempfile.gettempdir(), "medimate_cache.sqlite3")
+
+
+def _env_int(name, default):
+    try:
+        return int(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+class SQLiteCache:
+    """Durable key/value store with TTL and LRU eviction, shared across processes."""
+
+    def __init__(self, path, namespace, maxsize=5000, ttl=86400):
+        self.path = path
+        self.namespace = namespace
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
+        self._init_db()
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _init_db(self):
+        conn = self._connect()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            " namespace TEXT NOT NULL,"
+            " key TEXT NOT NULL,"
+            " value TEXT NOT NULL,"
+            " expires_at REAL NOT NULL,"
+            " accessed_at REAL NOT NULL,"
+            " PRIMARY KEY (namespace, key))"
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS cache_lru ON cache (namespace, accessed_at)"
+        )
+
+    def _count(self, hit):
+        with self._stats_lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def get(self, key, allow_expired=False):
+        """Return the stored value, or None. Expired rows are only returned when allow_expired is set."""
+        entry = self.get_entry(key, allow_expired)
+        return None if entry is None else entry[0]
+
+    def get_entry(self, key, allow_expired=False):
+        """Like get(), but returns (value, expires_at) so callers can respect the remaining lifetime."""
+        now = time.time()
+        conn = self._connect()
+        row = conn.execute(
+            "SELECT value, expires_at FROM cache WHERE namespace = ? AND key = ?",
+            (self.namespace, key),
+        ).fetchone()
+        if row is None or (row[1] < now and not allow_expired):
+            self._count(False)
+            return None
+        conn.execute(
+            "UPDATE cache SET accessed_at = ? WHERE namespace = ? AND key = ?",
+            (now, self.namespace, key),
+        )
+        self._count(True)
+        return json.loads(row[0]), row[1]
+
+    def set(self, key, value, ttl=None):
+        now = time.time()
+        expires_at = now + (self.ttl if ttl is None else ttl)
+        conn = self._connect()
+        conn.execute(
+            "INSERT OR REPLACE INTO cache (namespace, key, value, expires_at, accessed_at)"
+            " VALUES (?, ?, ?, ?, ?)",
+            (self.namespace, key, json.dumps(value), expires_at, now),
+        )
+        self._evict(conn)
+
+    def delete(self, key):
+        self._connect().execute(
+            "DELETE FROM cache WHERE namespace = ? AND key = ?", (self.namespace, key)
+        )
+
+    def clear(self):
+        self._connect().execute("DELETE FROM cache WHERE namespace = ?", (self.namespace,))
+
+    def _evict(self, conn):
+        # Least-recently-used rows beyond maxsize go first
+        cur = conn.execute(
+            "DELETE FROM cache WHERE namespace = ? AND key IN ("
+            " SELECT key FROM cache WHERE namespace = ?"
+            " ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+            (self.namespace, self.namespace, self.maxsize),
+        )
+        if cur.rowcount > 0:
+            with self._stats_lock:
+                self.evictions += cur.rowcount
+
+    def purge_expired(self, grace=0):
+        """Drop rows that expired more than `grace` seconds ago."""
+        cur = self._connect().execute(
+            "DELETE FROM cache WHERE namespace = ? AND expires_at < ?",
+            (self.namespace, time.time() - grace),
+        )
+        return cur.rowcount
+
+    def __len__(self):
+        row = self._connect().execute(
+            "SELECT COUNT(*) FROM cache WHERE namespace = ?", (self.namespace,)
+        ).fetchone()
+        return row[0]
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                "backend": "sqlite",
+                "path": self.path,
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+class TieredCache:
+    """
+    In-memory L1 in front of an optional shared L2, with hit/miss counters per tier.
+    L1 stores (value, expires_at) pairs: entries promoted from L2 keep the L2 row's
+    expiry instead of starting a fresh L1 TTL, so promotion never extends a lifetime.
+    """
+
+    def __init__(self, name, maxsize=100, ttl=600, l2=None):
+        self.name = name
+        self.l1 = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.l2 = l2
+        self.lock = threading.Lock()
+        self.l1_hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with span("cache_lookup"):
+            value = self._get(key)
+        count_cache(self.name, value is not None)
+        return value
+
+    def _get(self, key):
+        with self.lock:
+            item = self.l1.get(key)
+            if item is not None:
+                value, expires_at = item
+                if expires_at is None or expires_at > time.time():
+                    self.l1_hits += 1
+                    return value
+                self.l1.pop(key, None)
+
+        if self.l2 is not None:
+            try:
+                entry = self.l2.get_entry(key)
+            except sqlite3.Error as e:
+                logging.warning(f"⚠️ L2 cache read failed ({self.name}): {e}")
+                entry = None
+            if entry is not None:
+                # Promote into L1 so the next lookup stays in-process, but only for
+                # the row's remaining lifetime
+                with self.lock:
+                    self.l1[key] = entry
+                return entry[0]
+
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def get_stale(self, key):
+        """Return an entry even if its L2 TTL has passed (used as a fallback when Gemini is down)."""
+        value = self.get(key)
+        if value is not None or self.l2 is None:
+            return value
+        try:
+            return self.l2.get(key, allow_expired=True)
+        except sqlite3.Error:
+            return None
+
+    def set(self, key, value):
+        with self.lock:
+            self.l1[key] = (value, None)
+        if self.l2 is not None:
+            try:
+                self.l2.set(key, value)
+            except (sqlite3.Error, TypeError, ValueError) as e:
+                logging.warning(f"⚠️ L2 cache write failed ({self.name}): {e}")
+
+    def delete(self, key):
+        with self.lock:
+            self.l1.pop(key, None)
+        if self.l2 is not None:
+            self.l2.delete(key)
+
+    def clear(self):
+        with self.lock:
+            self.l1.clear()
+        if self.l2 is not None:
+            self.l2.clear()
+
+    def stats(self):
+        with self.lock:
+            data = {
+                "name": self.name,
+                "l1_size": len(self.l1),
+                "l1_maxsize": self.l1.maxsize,
+                "l1_ttl": self.l1.ttl,
+                "l1_hits": self.l1_hits,
+                "misses": self.misses,
+            }
+        if self.l2 is not None:
+            data["l2"] = self.l2.stats()
+        return data
+
+
+def build_cache(name, maxsize=100, ttl=600, l2_maxsize=5000, l2_ttl=86400):
+    """
+    Build a TieredCache configured from environment variables.
+    - CACHE_BACKEND: "sqlite" (default) or "memory" to disable the shared tier
+    - CACHE_DB_PATH: SQLite file shared by all workers on the host
+    - <NAME>_CACHE_MAXSIZE / _TTL / _L2_MAXSIZE / _L2_TTL override the defaults
+    """
+    prefix = name.upper()
+    maxsize = _env_int(f"{prefix}_CACHE_MAXSIZE", maxsize)
+    ttl = _env_int(f"{prefix}_CACHE_TTL", ttl)
+    l2_maxsize = _env_int(f"{prefix}_CACHE_L2_MAXSIZE", l2_maxsize)
+    l2_ttl = _env_int(f"{prefix}_CACHE_L2_TTL", l2_ttl)
+
+    l2 = None
+    if os.getenv("CACHE_BACKEND", "sqlite").lower() == "sqlite":
+        path = os.getenv("CACHE_DB_PATH", DEFAULT_CACHE_DB)
+        try:
+            l2 = SQLiteCache(path, namespace=name, maxsize=l2_maxsize, ttl=l2_ttl)
+        except sqlite3.Error as e:
+            # Read-only filesystems (e.g. some serverless hosts) fall back to L1 only
+            logging.warning(f"⚠️ Shared cache unavailable at {path}: {e}")
+
+    return TieredCache(name, maxsize=maxsize, ttl=ttl, l2=l2)
@@ -0,0 +1,161 @@
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+
+
+# ---------------------------
+# Circuit breaker & retry budget
+# ---------------------------
+#
+# When Gemini is degraded we want to stop hammering it: after enough
+# consecutive failures the breaker opens and calls fail fast; after a cooldown
+# a few probe calls are let through (half-open) to decide whether to close it.
+# Retries are additionally capped to a fraction of recent calls.
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    def __init__(self, name, failure_threshold=5, reset_timeout=30, half_open_max_calls=1):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.half_open_inflight = 0
+        self.rejected = 0
+        self.transitions = {CLOSED: 0, OPEN: 0, HALF_OPEN: 0}
+        self.last_transition = None
+        self._lock = threading.Lock()
+
+    def _transition(self, state):
+        # Caller holds the lock
+        if state == self.state:
+            return
+        logging.warning(f"🔌 Circuit '{self.name}' {self.state} -> {state}")
+        self.state = state
+        self.transitions[state] += 1
+        self.last_transition = time.time()
+        if state == OPEN:
+            self.opened_at = time.monotonic()
+        if state != HALF_OPEN:
+            self.half_open_inflight = 0
+
+    def allow(self):
+        """Return True if a call may go upstream right now."""
+        with self._lock:
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self._transition(HALF_OPEN)
+
+            if self.state == CLOSED:
+                return True
+            if self.state == HALF_OPEN and self.half_open_inflight < self.half_open_max_calls:
+                self.half_open_inflight += 1
+                return True
+
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.consecutive_failures = 0
+            self._transition(CLOSED)
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            if self.state == HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                self._transition(OPEN)
+
+    def release(self):
+        """Give back a half-open probe slot for a call that was cancelled, without counting a failure."""
+        with self._lock:
+            if self.state == HALF_OPEN and self.half_open_inflight > 0:
+                self.half_open_inflight -= 1
+
+    def is_open(self):
+        with self._lock:
+            return self.state == OPEN
+
+    def stats(self):
+        with self._lock:
+            return {
+                "name": self.name,
+                "state": self.state,
+                "consecutive_failures": self.consecutive_failures,
+                "rejected_calls": self.rejected,
+                "transitions": dict(self.transitions),
+                "last_transition": self.last_transition,
+            }
+
+
+class RetryBudget:
+    """Allow retries only while they stay below `ratio` of calls in the last `window` seconds."""
+
+    def __init__(self, ratio=0.2, min_retries_per_window=3, window=60):
+        self.ratio = ratio
+        self.min_retries = min_retries_per_window
+        self.window = window
+        self.calls = deque()
+        self.retries = deque()
+        self.exhausted = 0
+        self.total_calls = 0
+        self.total_retries = 0
+        self._lock = threading.Lock()
+
+    def _trim(self, now):
+        cutoff = now - self.window
+        for events in (self.calls, self.retries):
+            while events and events[0] < cutoff:
+                events.popleft()
+
+    def record_call(self):
+        with self._lock:
+            now = time.monotonic()
+            self._trim(now)
+            self.calls.append(now)
+            self.total_calls += 1
+
+    def try_acquire_retry(self):
+        with self._lock:
+            now = time.monotonic()
+            self._trim(now)
+            if len(self.retries) < self.min_retries + self.ratio * len(self.calls):
+                self.retries.append(now)
+                self.total_retries += 1
+                return True
+            self.exhausted += 1
+            return False
+
+    def stats(self):
+        with self._lock:
+            self._trim(time.monotonic())
+            return {
+                "ratio": self.ratio,
+                "window": self.window,
+                "calls": len(self.calls),
+                "retries": len(self.retries),
+                "exhausted": self.exhausted,
+                "total_calls": self.total_calls,
+                "total_retries": self.total_retries,
+            }
+
+
+def jittered_backoff(attempt, delay, max_delay=10):
+    """Full-jitter exponential backoff: uniform in [0, min(max_delay, delay * 2**attempt)]."""
+    return random.uniform(0, min(max_delay, delay * (2 ** attempt)))
+
+
+gemini_breaker = CircuitBreaker(
+    "gemini",
+    failure_threshold=int(os.getenv("GEMINI_BREAKER_THRESHOLD", "5")),
+    reset_timeout=float(os.getenv("GEMINI_BREAKER_RESET", "30")),
+)
+gemini_retry_budget = RetryBudget(ratio=float(os.getenv("GEMINI_RETRY_BUDGET", "0.2")))
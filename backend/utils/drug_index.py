@@ -0,0 +1,175 @@
+import functools
+import json
+import os
+import threading
+
+
+# ---------------------------
+# Drug name normalization index
+# ---------------------------
+#
+# Maps brand, generic and misspelled drug names to one canonical ID so that
+# "Tylenol", "paracetamol" and "acetaminophen" share a cache entry. Built
+# from the bundled name lists; typos are resolved with a SymSpell-style
+# index of deletions (each term is stored under every string obtained by
+# deleting up to N characters), so a lookup only generates the deletions of
+# the query instead of comparing it against every known name.
+#
+# Fuzzy correction is deliberately narrow: many different drugs are two edits
+# apart (prednisone/prednisolone, nifedipine/nimodipine, omeprazole/
+# esomeprazole), so only a single-edit typo of a name we know is corrected,
+# and only when exactly one known name is that close. Anything else keeps its
+# own ID. The canonical ID is only a cache key: prompts use the name the user
+# typed.
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "static", "data")
+DRUG_NAMES_FILE = os.path.join(DATA_DIR, "drug_names.json")
+DRUG_SYNONYMS_FILE = os.path.join(DATA_DIR, "drug_synonyms.json")
+
+# Names shorter than this are only matched exactly
+MIN_FUZZY_LENGTH = 5
+# Typos corrected; two edits already turns many drug names into other drugs
+MAX_EDIT_DISTANCE = 1
+# Only the first PREFIX_LENGTH characters are indexed by deletion (SymSpell's
+# prefix trick); candidates are then verified against the full name
+PREFIX_LENGTH = 7
+
+
+def normalize_name(name):
+    return " ".join(name.lower().replace("-", " ").split())
+
+
+def max_edit_distance(term):
+    return 0 if len(term) < MIN_FUZZY_LENGTH else MAX_EDIT_DISTANCE
+
+
+def _deletes(term, distance):
+    results = {term}
+    frontier = {term}
+    for _ in range(distance):
+        frontier = {w[:i] + w[i + 1:] for w in frontier for i in range(len(w))}
+        results |= frontier
+    return results
+
+
+def damerau_levenshtein(a, b, limit):
+    """Optimal string alignment distance, returning limit + 1 as soon as it is exceeded."""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    # Typos leave most of the name intact: only compare the part that differs
+    start = 0
+    while start < len(a) and start < len(b) and a[start] == b[start]:
+        start += 1
+    end = 0
+    while end < len(a) - start and end < len(b) - start and a[-1 - end] == b[-1 - end]:
+        end += 1
+    a, b = a[start:len(a) - end], b[start:len(b) - end]
+    if not a or not b:
+        return len(a) or len(b)
+    # Only cells within `limit` of the diagonal can stay under the limit
+    over = limit + 1
+    prev2 = None
+    prev = [j if j <= limit else over for j in range(len(b) + 1)]
+    for i in range(1, len(a) + 1):
+        cur = [over] * (len(b) + 1)
+        if i <= limit:
+            cur[0] = i
+        row_min = over
+        for j in range(max(1, i - limit), min(len(b), i + limit) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            value = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                value = min(value, prev2[j - 2] + 1)
+            cur[j] = value
+            if value < row_min:
+                row_min = value
+        if row_min > limit:
+            return over
+        prev2, prev = prev, cur
+    return min(prev[-1], over)
+
+
+class DrugNameIndex:
+    def __init__(self):
+        self.exact = {}       # normalized name -> canonical ID
+        self.display = {}     # canonical ID -> display name
+        self.deletes = {}     # deletion variant -> set of normalized names
+
+    def add(self, canonical, name):
+        canonical_id = normalize_name(canonical)
+        self.display.setdefault(canonical_id, canonical)
+        term = normalize_name(name)
+        if not term or term in self.exact:
+            return
+        self.exact[term] = canonical_id
+        for variant in _deletes(term[:PREFIX_LENGTH], max_edit_distance(term)):
+            self.deletes.setdefault(variant, set()).add(term)
+
+    def lookup(self, name):
+        """Return the canonical ID for `name`, or None if nothing is close enough."""
+        query = normalize_name(name)
+        if query in self.exact:
+            return self.exact[query]
+        distance = max_edit_distance(query)
+        if distance == 0:
+            return None
+
+        candidates = set()
+        for variant in _deletes(query[:PREFIX_LENGTH], distance):
+            candidates.update(self.deletes.get(variant, ()))
+
+        matches = {
+            self.exact[term] for term in candidates if damerau_levenshtein(query, term, distance) <= distance
+        }
+        # Ambiguous typos (close to two different drugs) are not guessed
+        return matches.pop() if len(matches) == 1 else None
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def load_index():
+    """Build the index from the bundled name files on first use."""
+    global _index
+    with _index_lock:
+        if _index is None:
+            index = DrugNameIndex()
+            with open(DRUG_SYNONYMS_FILE, encoding="utf-8") as f:
+                synonyms = json.load(f)
+            for canonical, names in synonyms.items():
+                index.add(canonical, canonical)
+                for name in names:
+                    index.add(canonical, name)
+            with open(DRUG_NAMES_FILE, encoding="utf-8") as f:
+                for name in json.load(f):
+                    index.add(name, name)
+            _index = index
+    return _index
+
+
+@functools.lru_cache(maxsize=4096)
+def _lookup(drug_name):
+    return load_index().lookup(drug_name)
+
+
+def canonical_drug_id(drug_name):
+    """Canonical cache key for a drug name; unknown names fall back to their normalized form."""
+    return _lookup(drug_name) or normalize_name(drug_name)
+
+
+def canonical_drug_name(drug_name):
+    """
+    Display name of the canonical drug (e.g. "Tylenol" -> "Acetaminophen"), or
+    the input as typed. For grouping and display only; prompts get the user's name.
+    """
+    index = load_index()
+    canonical_id = _lookup(drug_name)
+    if canonical_id is None:
+        return drug_name.strip()
+    return index.display[canonical_id]
+
+
+def is_known_drug(drug_name):
+    """True if the name (or a close misspelling) is in the bundled drug lists."""
+    return _lookup(drug_name) is not None
@@ -0,0 +1,110 @@
+import re
+
+
+# ---------------------------
+# Drug summary sections
+# ---------------------------
+#
+# The drug info prompt asks Gemini for a fixed set of `## ` headings. These
+# helpers split a summary into those sections (and join them back), so the
+# content can be stored and reused in structured form.
+
+# (key, heading used in the drug info prompt)
+DRUG_SECTIONS = [
+    ("uses", "Therapeutic Uses"),
+    ("dosage", "Standard Dosage"),
+    ("common_side_effects", "Common Side Effects"),
+    ("serious_side_effects", "Serious Side Effects"),
+    ("contraindications", "Contraindications"),
+    ("interactions", "Important Drug Interactions"),
+]
+
+# Comparison rows the drug info prompt doesn't cover; generated once per drug
+EXTRA_SECTIONS = [
+    ("drug_class", "Drug Class"),
+    ("cost", "Cost/Availability"),
+]
+
+# (key, row label) of the drug comparison table, in order
+COMPARISON_ROWS = [
+    ("uses", "Therapeutic Uses"),
+    ("dosage", "Dosage"),
+    ("common_side_effects", "Common Side Effects"),
+    ("serious_side_effects", "Serious Side Effects"),
+    ("contraindications", "Contraindications"),
+    ("interactions", "Drug Interactions"),
+    ("drug_class", "Drug Class"),
+    ("cost", "Cost/Availability"),
+]
+
+_HEADING = re.compile(r"^#{1,4}\s+(.+?)\s*#*\s*$", re.MULTILINE)
+
+
+# Keywords that identify a heading even when Gemini rewords it slightly
+# ("Drug Interactions", "Dosage"); checked in order
+_KEYWORDS = [
+    ("class", "drug_class"),
+    ("cost", "cost"),
+    ("availab", "cost"),
+    ("serious", "serious_side_effects"),
+    ("side effect", "common_side_effects"),
+    ("contraindication", "contraindications"),
+    ("interaction", "interactions"),
+    ("dos", "dosage"),
+    ("use", "uses"),
+]
+
+
+def _heading_key(title):
+    title = title.strip("*_ ").lower()
+    for keyword, key in _KEYWORDS:
+        if keyword in title:
+            return key
+    return None
+
+
+def parse_drug_sections(markdown_text):
+    """Split a drug summary into {section key: markdown body}. Unknown headings are ignored."""
+    sections = {}
+    matches = list(_HEADING.finditer(markdown_text))
+    for i, match in enumerate(matches):
+        key = _heading_key(match.group(1))
+        if key is None or key in sections:
+            continue
+        end = matches[i + 1].start() if i + 1 < len(matches) else len(markdown_text)
+        body = markdown_text[match.end():end].strip()
+        if body:
+            sections[key] = body
+    return sections
+
+
+def missing_sections(sections):
+    return [key for key, _ in DRUG_SECTIONS if not sections.get(key)]
+
+
+def render_drug_sections(sections):
+    """Join sections back into markdown using the drug info prompt's headings."""
+    parts = []
+    for key, heading in DRUG_SECTIONS:
+        if sections.get(key):
+            parts.append(f"## {heading}\n{sections[key]}")
+    return "\n\n".join(parts)
+
+
+_BULLET = re.compile(r"^\s*(?:[-*+]|\d+[.)])\s+")
+
+
+def table_cell(body):
+    """Flatten a section's bullet list into one Markdown table cell."""
+    items = [_BULLET.sub("", line).strip() for line in body.splitlines()]
+    return "<br>".join(item for item in items if item).replace("|", "\\|")
+
+
+def render_comparison_table(drug1, sections1, drug2, sections2):
+    """Side-by-side Markdown table in the same layout the comparison prompt asks Gemini for."""
+    lines = [f"| Aspect | {drug1} | {drug2} |", "| --- | --- | --- |"]
+    for key, label in COMPARISON_ROWS:
+        lines.append(
+            f"| **{label}** | {table_cell(sections1.get(key, '-'))} | {table_cell(sections2.get(key, '-'))} |"
+        )
+    return "\n".join(lines)
@@ -0,0 +1,254 @@
+import asyncio
+import contextvars
+import logging
+import os
+import queue
+import threading
+import time
+
+from .circuit_breaker import gemini_breaker, gemini_retry_budget, jittered_backoff
+from .log_utils import log_event
+from .metrics import count_upstream, record_stage, span
+
+
+# ---------------------------
+# Async Gemini generation engine
+# ---------------------------
+#
+# All upstream calls run on one background event loop per process. A shared
+# semaphore caps how many Gemini calls are in flight, timeouts cancel the
+# pending call, and retry backoff uses asyncio.sleep so no thread is parked.
+# Flask request handlers reach it through the sync bridge `run_sync`.
+
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "8"))
+
+_loop = None
+_loop_pid = None
+_semaphore = None
+_limiters = {}
+_loop_lock = threading.Lock()
+
+
+def _get_loop():
+    """Start the engine loop on first use (and again in a forked worker)."""
+    global _loop, _loop_pid, _semaphore
+    with _loop_lock:
+        if _loop is None or _loop_pid != os.getpid():
+            _loop = asyncio.new_event_loop()
+            _loop_pid = os.getpid()
+            _semaphore = asyncio.Semaphore(GEMINI_MAX_CONCURRENCY)
+            _limiters.clear()
+            thread = threading.Thread(target=_loop.run_forever, name="gemini-engine", daemon=True)
+            thread.start()
+        return _loop
+
+
+def feature_limiter(name, limit):
+    """A per-feature cap on in-flight calls, applied on top of GEMINI_MAX_CONCURRENCY."""
+    _get_loop()
+    with _loop_lock:
+        limiter = _limiters.get(name)
+        if limiter is None:
+            limiter = _limiters[name] = asyncio.Semaphore(limit)
+        return limiter
+
+
+class _NoLimit:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+_no_limit = _NoLimit()
+
+# time.monotonic() deadline for everything the current caller runs through
+# run_sync (set by background jobs); past it the upstream call is cancelled
+call_deadline = contextvars.ContextVar("call_deadline", default=None)
+
+
+def run_sync(coro, timeout=None):
+    """Run a coroutine on the engine loop and wait for its result from a sync caller."""
+    deadline = call_deadline.get()
+    if deadline is not None:
+        remaining = max(0.0, deadline - time.monotonic())
+        timeout = remaining if timeout is None else min(timeout, remaining)
+    future = asyncio.run_coroutine_threadsafe(coro, _get_loop())
+    try:
+        return future.result(timeout=timeout)
+    except BaseException:
+        future.cancel()
+        raise
+
+
+async def _call_model(model, prompt):
+    if hasattr(model, "generate_content_async"):
+        return await model.generate_content_async(prompt)
+    # Models without an async API run on the loop's default executor
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, model.generate_content, prompt)
+
+
+def _has_text(response):
+    try:
+        return bool(response and response.text.strip())
+    except (AttributeError, ValueError):
+        # .text raises ValueError when the candidate was blocked or empty
+        return False
+
+
+async def generate_async(model, prompt, max_retries=3, delay=2, timeout=10):
+    """
+    Calls Gemini with timeout and retry logic without blocking a thread.
+    - At most GEMINI_MAX_CONCURRENCY calls are in flight per process
+    - Timed-out calls are cancelled
+    - Fails fast while the circuit breaker is open
+    - Retries are limited by the retry budget and use jittered, non-blocking backoff
+    """
+    response, _, _ = await generate_detailed_async(model, prompt, max_retries, delay, timeout)
+    return response
+
+
+async def generate_detailed_async(model, prompt, max_retries=3, delay=2, timeout=10, limiter=None):
+    """
+    Like generate_async, but returns (response or None, failure reason or None, attempts).
+    Reasons: "breaker_open", "timeout", "empty", "error", "retry_budget".
+    `limiter` is an extra semaphore (see feature_limiter) held during each attempt.
+    """
+    gemini_retry_budget.record_call()
+    reason = None
+    attempts = 0
+    for attempt in range(max_retries):
+        if attempt > 0 and not gemini_retry_budget.try_acquire_retry():
+            log_event("gemini.retry_budget", "🪫 Retry budget exhausted, giving up early.", level=logging.WARNING)
+            count_upstream("budget_exhausted")
+            reason = reason or "retry_budget"
+            break
+        if not gemini_breaker.allow():
+            log_event("gemini.breaker_open", "🔌 Gemini circuit open, failing fast.", level=logging.WARNING)
+            count_upstream("breaker_open")
+            return None, "breaker_open", attempts
+
+        attempts += 1
+        try:
+            log_event("gemini.attempt", "🌐 Gemini API Call Attempt %d", attempt + 1, level=logging.DEBUG)
+            async with limiter or _no_limit, _semaphore:
+                with span("upstream_attempt"):
+                    response = await asyncio.wait_for(_call_model(model, prompt), timeout=timeout)
+
+            if _has_text(response):
+                gemini_breaker.record_success()
+                count_upstream("ok")
+                log_event("gemini.success", "✅ Gemini API call successful.", level=logging.DEBUG)
+                return response, None, attempts
+            count_upstream("empty")
+            reason = "empty"
+            log_event("gemini.empty", "⚠️ Empty or malformed response. Retrying...", level=logging.WARNING)
+
+        except asyncio.TimeoutError:
+            count_upstream("timeout")
+            reason = "timeout"
+            log_event("gemini.timeout", "⏰ Gemini API call timed out after %s seconds.", timeout, level=logging.ERROR)
+        except asyncio.CancelledError:
+            # The caller gave up on us (client disconnect, timeout upstream of
+            # us): not Gemini's fault, so only release a half-open probe slot
+            gemini_breaker.release()
+            count_upstream("cancelled")
+            raise
+        except Exception as e:
+            count_upstream("error")
+            reason = "error"
+            log_event("gemini.error", "❌ Gemini API error: %s", e, level=logging.ERROR)
+
+        gemini_breaker.record_failure()
+        if attempt + 1 < max_retries:
+            wait_time = jittered_backoff(attempt, delay)
+            log_event("gemini.backoff", "⏳ Waiting %.1fs before retry attempt %d", wait_time, attempt + 2)
+            with span("backoff"):
+                await asyncio.sleep(wait_time)
+
+    log_event("gemini.failed", "❌ All Gemini API retry attempts failed.", level=logging.CRITICAL)
+    return None, reason, attempts
+
+
+class StreamError(Exception):
+    """Raised by stream_sync when the upstream stream fails; `started` tells whether chunks were sent."""
+
+    def __init__(self, message, started=False):
+        super().__init__(message)
+        self.started = started
+
+
+async def _pump_stream(model, prompt, out, timeout, limiter=None):
+    """Push ("chunk", text) items into `out`, then ("done", None) or ("error", message)."""
+    if not gemini_breaker.allow():
+        out.put(("error", "Gemini circuit open"))
+        return
+    gemini_retry_budget.record_call()
+    started = time.perf_counter()
+    try:
+        async with limiter or _no_limit, _semaphore:
+            if hasattr(model, "generate_content_async"):
+                response = await asyncio.wait_for(
+                    model.generate_content_async(prompt, stream=True), timeout=timeout
+                )
+                chunks = response.__aiter__()
+                while True:
+                    try:
+                        # The timeout applies to the gap between chunks, not the whole answer
+                        chunk = await asyncio.wait_for(chunks.__anext__(), timeout=timeout)
+                    except StopAsyncIteration:
+                        break
+                    if chunk.text:
+                        out.put(("chunk", chunk.text))
+            else:
+                response = await asyncio.wait_for(_call_model(model, prompt), timeout=timeout)
+                out.put(("chunk", response.text))
+        gemini_breaker.record_success()
+        count_upstream("ok")
+        out.put(("done", None))
+    except asyncio.CancelledError:
+        # The consumer went away; not an upstream failure
+        gemini_breaker.release()
+        count_upstream("cancelled")
+        raise
+    except asyncio.TimeoutError:
+        gemini_breaker.record_failure()
+        count_upstream("timeout")
+        log_event("gemini.timeout", "⏰ Gemini stream stalled for %s seconds.", timeout, level=logging.ERROR)
+        out.put(("error", f"Gemini stream timed out after {timeout} seconds"))
+    except Exception as e:
+        gemini_breaker.record_failure()
+        count_upstream("error")
+        log_event("gemini.error", "❌ Gemini stream error: %s", e, level=logging.ERROR)
+        out.put(("error", str(e)))
+    finally:
+        record_stage("upstream_stream", time.perf_counter() - started)
+
+
+def stream_sync(model, prompt, timeout=10, limiter=None):
+    """Yield text chunks from a streamed Gemini call. Stops the upstream call if the consumer goes away."""
+    out = queue.Queue()
+    future = asyncio.run_coroutine_threadsafe(_pump_stream(model, prompt, out, timeout, limiter), _get_loop())
+    started = False
+    try:
+        while True:
+            kind, value = out.get()
+            if kind == "chunk":
+                started = True
+                yield value
+            elif kind == "error":
+                raise StreamError(value, started=started)
+            else:
+                return
+    finally:
+        future.cancel()
+
+
+def get_engine_stats():
+    return {
+        "max_concurrency": GEMINI_MAX_CONCURRENCY,
+        "breaker": gemini_breaker.stats(),
+        "retry_budget": gemini_retry_budget.stats(),
+    }
@@ -1,37 +1,118 @@
 
-import base64
+import contextvars
 import os
-import io
-from PIL import Image
-from io import BytesIO
-import google.generativeai as genai
-from google.generativeai.types import content_types
-import markdown
 import logging
+import itertools
+import re
+import threading
 import time
-from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeout
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 
 
 # recent feature of cache
-from cachetools import TTLCache
-import threading
-
-# A cache with maxsize 100 items, and TTL of 600 seconds (10 minutes)
-drug_cache = TTLCache(maxsize=100, ttl=600)
-
-# Lock to prevent race conditions in threaded environments (e.g., Flask)
-cache_lock = threading.Lock()
+from .cache_store import build_cache
+from .single_flight import coalesce
+from .gemini_engine import StreamError, generate_async, run_sync
+from .generation import GenerationResult, generate, stream
+from .markdown_render import render_markdown, render_partial_markdown
+from .image_pipeline import ImageRejected, prepare_image
+from .image_dedupe import content_hash, dhash, packaging_image_cache, prescription_image_cache
+from .drug_index import canonical_drug_id
+from .drug_sections import (
+    COMPARISON_ROWS,
+    DRUG_SECTIONS,
+    EXTRA_SECTIONS,
+    parse_drug_sections,
+    render_comparison_table,
+    render_drug_sections,
+)
+from .monograph_store import get_monograph
+from .allergy_rules import render_screen, screen_allergies
+from .symptom_cache import symptom_cache
+from .metrics import span
+from .log_utils import log_event, redact_text
+from .model_registry import get_model
+
+# Two-tier cache: in-memory L1 (100 items) in front of a SQLite L2 shared by
+# every worker on the host, so restarts and new workers start warm.
+# Entries are served fresh until the soft TTL, then served stale while a
+# background refresh runs; only entries past the hard TTL block on Gemini.
+DRUG_CACHE_SOFT_TTL = int(os.getenv("DRUG_CACHE_SOFT_TTL", "600"))
+DRUG_CACHE_HARD_TTL = int(os.getenv("DRUG_CACHE_HARD_TTL", "86400"))
+drug_cache = build_cache("drug", maxsize=100, ttl=DRUG_CACHE_HARD_TTL, l2_ttl=DRUG_CACHE_HARD_TTL)
+
+# Small pool for stale-while-revalidate refreshes (upstream concurrency is
+# still bounded by the Gemini engine)
+refresh_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="drug-refresh")
+refreshing = set()
+refresh_lock = threading.Lock()
+
+def _drug_key(drug_name):
+    # "Tylenol", "paracetamol" and "acetaminofen" all share one entry
+    return canonical_drug_id(drug_name)
+
+def _entry_text(entry):
+    # Entries written before soft/hard TTLs were plain strings
+    return entry["text"] if isinstance(entry, dict) else entry
+
+def get_cached_drug_entry(drug_name):
+    entry = drug_cache.get(_drug_key(drug_name))
+    if entry is None:
+        return None
+    if not isinstance(entry, dict):
+        entry = {"text": entry, "created": 0}
+    if is_drug_entry_expired(entry):
+        # A worker's L1 can outlive the hard TTL; get_stale_drug still serves it during outages
+        return None
+    return entry
 
 def get_cached_drug(drug_name):
-    key = drug_name.strip().lower()
-    with cache_lock:
-        return drug_cache.get(key)
+    entry = get_cached_drug_entry(drug_name)
+    return entry["text"] if entry else None
 
 def set_cached_drug(drug_name, response):
-    key = drug_name.strip().lower()
-    with cache_lock:
-        drug_cache[key] = response
+    # Sections are parsed once here so comparisons can reuse them without re-parsing
+    drug_cache.set(_drug_key(drug_name), {
+        "text": response,
+        "created": time.time(),
+        "sections": parse_drug_sections(response),
+    })
+
+def get_stale_drug(drug_name):
+    entry = drug_cache.get_stale(_drug_key(drug_name))
+    return _entry_text(entry) if entry else None
+
+def is_drug_entry_stale(entry):
+    return time.time() - entry.get("created", 0) > DRUG_CACHE_SOFT_TTL
+
+def is_drug_entry_expired(entry):
+    # Legacy string entries carry no timestamp; their L2 row TTL still bounds them
+    created = entry.get("created")
+    return bool(created) and time.time() - created > DRUG_CACHE_HARD_TTL
+
+def schedule_drug_refresh(drug_name):
+    """Refresh a stale entry in the background; at most one refresh per drug at a time."""
+    key = _drug_key(drug_name)
+    with refresh_lock:
+        if key in refreshing:
+            return False
+        refreshing.add(key)
+
+    def refresh():
+        try:
+            text = fetch_drug_information(drug_name)
+            if text:
+                set_cached_drug(drug_name, text)
+                log_event("cache.refresh", "🔄 Refreshed stale cache entry for drug: %s", drug_name)
+        except Exception as e:
+            log_event("cache.refresh_failed", "❌ Background refresh failed for %s: %s", drug_name, e, level=logging.ERROR)
+        finally:
+            with refresh_lock:
+                refreshing.discard(key)
+
+    refresh_executor.submit(refresh)
+    return True
 
 
 
@@ -40,53 +121,20 @@ def format_markdown_response(text):
     """Convert Markdown text to HTML for consistent, readable output"""
     if not text or text.startswith("❌"):
         return text  # Return error messages as-is
-    # Convert Markdown to HTML
-    html = markdown.markdown(text, extensions=['extra', 'fenced_code'])
-    # Wrap in a styled div for better presentation
-    return f'<div class="markdown-content">{html}</div>'
+    # Convert Markdown to HTML (cached by content hash)
+    return render_markdown(text)
 
 
-# Load API key from environment variable (recommended) or hardcoded (less secure)
-genai.configure(api_key=os.getenv("GEMINI_KEY"))
-model = genai.GenerativeModel("gemini-2.5-flash")
-
 # Retry logic for Gemini calls
 def gemini_generate_with_retry(prompt, max_retries=3, delay=2, timeout=10):
     """
     Calls Gemini API with timeout and retry logic.
-    - Retries failed calls (with exponential backoff)
-    - Aborts slow responses gracefully
+    Thin sync bridge over the async engine (bounded concurrency, cancellable
+    timeouts and non-blocking exponential backoff). The functions below use
+    generation.generate instead, which adds per-feature settings and returns
+    a GenerationResult.
     """
-    attempt = 0
-    while attempt < max_retries:
-        try:
-            logging.info(f"🌐 Gemini API Call Attempt {attempt + 1}")
-            
-            # Set up timeout using ThreadPoolExecutor
-            with ThreadPoolExecutor(max_workers=1) as executor:
-                future = executor.submit(model.generate_content, prompt)
-                response = future.result(timeout=timeout)  # Timeout in seconds
-
-            # Check if response is valid
-            if response and hasattr(response, 'text') and response.text.strip():
-                logging.info("✅ Gemini API call successful.")
-                return response
-            else:
-                logging.warning("⚠️ Empty or malformed response. Retrying...")
-
-        except FuturesTimeout:
-            logging.error(f"⏰ Gemini API call timed out after {timeout} seconds.")
-        except Exception as e:
-            logging.error(f"❌ Gemini API error: {str(e)}")
-
-        # Backoff delay before retry
-        wait_time = delay * (2 ** attempt)  # 2s, 4s, 8s...
-        logging.info(f"⏳ Waiting {wait_time}s before retry attempt {attempt + 2}")
-        time.sleep(wait_time)
-        attempt += 1
-
-    logging.critical("❌ All Gemini API retry attempts failed.")
-    return None
+    return run_sync(generate_async(get_model(), prompt, max_retries=max_retries, delay=delay, timeout=timeout))
 
 
 
@@ -95,8 +143,8 @@ def gemini_generate_with_retry(prompt, max_retries=3, delay=2, timeout=10):
 # AI Functions
 # ---------------------------
 
-def get_drug_information(drug_name):
-    prompt = (
+def drug_information_prompt(drug_name):
+    return (
         f"Provide a brief clinical summary for pharmacists on the drug **{drug_name}** in Markdown format:\n"
         "## Therapeutic Uses\n"
         "- List primary therapeutic uses\n"
@@ -113,33 +161,120 @@ def get_drug_information(drug_name):
         "Use concise bullet points. Ensure clarity and professional tone."
     )
 
-    logging.info(f"Prompt to Gemini: {prompt}")
 
-    cached = get_cached_drug(drug_name)
-    if cached:
-        logging.info(f"📦 Cache hit for drug: {drug_name}")
-        return cached
+def generate_drug_information(drug_name):
+    """Generate a drug summary upstream; returns a GenerationResult with the raw markdown."""
+    with span("prompt_build"):
+        prompt = drug_information_prompt(drug_name)
+    log_event("gemini.prompt", "Prompt to Gemini", level=logging.DEBUG, feature="drug_info", prompt=redact_text(prompt))
+    return generate("drug_info", prompt)
+
+
+def fetch_drug_information(drug_name):
+    """Generate a drug summary upstream. Returns the raw markdown, or None on failure."""
+    return generate_drug_information(drug_name).text
+
+
+def get_drug_information(drug_name):
+    # Brand names and typos share the canonical drug's cache entry, but the
+    # prompt always names the drug the user asked about
+    return _get_drug_information(drug_name.strip())
+
+
+@coalesce
+def _get_drug_information(drug_name):
+    # Precomputed monographs for the most requested drugs skip Gemini entirely
+    monograph = get_monograph(canonical_drug_id(drug_name))
+    if monograph:
+        log_event("cache.hit", "📚 Monograph hit for drug: %s", drug_name, cache="monograph")
+        return format_markdown_response(render_drug_sections(monograph["sections"]))
+
+    entry = get_cached_drug_entry(drug_name)
+    if entry:
+        if is_drug_entry_stale(entry):
+            log_event("cache.stale_hit", "📦 Stale cache hit for drug: %s, refreshing in background", drug_name)
+            schedule_drug_refresh(drug_name)
+        else:
+            log_event("cache.hit", "📦 Cache hit for drug: %s", drug_name, cache="drug")
+        return format_markdown_response(entry["text"])
 
     try:
-        response = gemini_generate_with_retry(prompt)
-        if response and hasattr(response, 'text'):
-            text = response.text.strip()
-            set_cached_drug(drug_name, text) # <--- Store raw text in cache
-            logging.info("✅ Cached new drug info response.")
-            return format_markdown_response(text) # <--- Still return formatted for display
+        result = generate_drug_information(drug_name)
+        if result.ok:
+            set_cached_drug(drug_name, result.text) # <--- Store raw text in cache
+            log_event("gemini.response", "✅ Cached new drug info response.", feature="drug_info")
+            return format_markdown_response(result.text)
     
         else:
-            logging.warning("No text in AI response.")
-            return "❌ No response from AI."
+            stale = get_stale_drug(drug_name)
+            if stale:
+                # Gemini is down or the breaker is open: an old answer beats no answer
+                log_event("cache.stale_fallback", "📦 Serving stale cache entry for drug: %s", drug_name, level=logging.WARNING)
+                return format_markdown_response(stale)
+            log_event("gemini.empty", "No text in AI response (%s).", result.error, level=logging.WARNING, feature="drug_info")
+            return result.error_message
     except Exception as e:
-        logging.error(f"Exception in get_drug_information: {str(e)}")
+        log_event("gemini.error", "Exception in get_drug_information: %s", e, level=logging.ERROR)
         return f"❌ Error: {str(e)}"
     
 
 
+DRUG_BATCH_MAX = int(os.getenv("DRUG_BATCH_MAX", "500"))
+DRUG_BATCH_CONCURRENCY = int(os.getenv("DRUG_BATCH_CONCURRENCY", "8"))
+
+
+def get_drug_information_batch(drug_names, concurrency=DRUG_BATCH_CONCURRENCY):
+    """
+    Look up many drugs at once. Names are deduplicated by canonical drug ID,
+    cache hits are yielded immediately and misses are fetched with bounded
+    parallelism. Yields one dict per unique drug, in completion order.
+    """
+    unique = {}
+    for name in drug_names:
+        if isinstance(name, str) and name.strip():
+            unique.setdefault(canonical_drug_id(name), name.strip())
+
+    def result(name, response, cached, started):
+        return {
+            "drug_name": name,
+            "status": "error" if response.startswith("❌") else "ok",
+            "cached": cached,
+            "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+            "response": response,
+        }
+
+    misses = []
+    for name in unique.values():
+        started = time.perf_counter()
+        if get_cached_drug_entry(name):
+            yield result(name, get_drug_information(name), True, started)
+        else:
+            misses.append(name)
+
+    if not misses:
+        return
+
+    def fetch(name):
+        started = time.perf_counter()
+        try:
+            return result(name, get_drug_information(name), False, started)
+        except Exception as e:
+            return result(name, f"❌ Error: {str(e)}", False, started)
+
+    executor = ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="drug-batch")
+    try:
+        # Each lookup keeps the request's metrics labels
+        futures = [executor.submit(contextvars.copy_context().run, fetch, name) for name in misses]
+        for future in as_completed(futures):
+            yield future.result()
+    finally:
+        # If the client disconnects, don't start lookups nobody will read
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
 # Function to get recommendations based on symptoms
-def get_symptom_recommendation(symptoms):
-    prompt = (
+def symptom_prompt(symptoms):
+    return (
         f"Given the symptoms: **{symptoms}**, recommend over-the-counter treatment options in Markdown format:\n"
         "## Recommended Over-the-Counter Treatments\n"
         "- List appropriate OTC medications or treatments\n"
@@ -153,150 +288,508 @@ def get_symptom_recommendation(symptoms):
         "Use concise bullet points in Markdown format. Avoid disclaimers."
     )
 
-    logging.info(f"Prompt to Gemini for symptom check: {prompt}")
+
+@coalesce
+def get_symptom_recommendation(symptoms):
+    # "fever, headache" and "I have a headache and fever" share one entry
+    cached = symptom_cache.get(symptoms)
+    if cached:
+        log_event("cache.hit", "📦 Cache hit for symptoms.", cache="symptom")
+        return format_markdown_response(cached)
+
+    with span("prompt_build"):
+        prompt = symptom_prompt(symptoms)
+
+    log_event("gemini.prompt", "Prompt to Gemini", level=logging.DEBUG, feature="symptoms", prompt=redact_text(prompt))
     try:
-        response = gemini_generate_with_retry(prompt)
-        if response and hasattr(response, 'text'):
-            text = response.text.strip()
-            logging.info("Received response from Gemini for symptoms.")
-            return format_markdown_response(text)
+        result = generate("symptoms", prompt)
+        if result.ok:
+            log_event("gemini.response", "Received response from Gemini for symptoms.", feature="symptoms")
+            symptom_cache.set(symptoms, result.text)
+            return format_markdown_response(result.text)
         else:
-            logging.warning("❌ No text in AI response for symptoms.")
-            return "❌ No response from AI."
+            log_event("gemini.empty", "❌ No text in AI response for symptoms (%s).", result.error, level=logging.WARNING, feature="symptoms")
+            return result.error_message
     except Exception as e:
-        logging.error(f"❌ Exception in get_symptom_recommendation: {str(e)}")
+        log_event("gemini.error", "❌ Exception in get_symptom_recommendation: %s", e, level=logging.ERROR)
         return f"❌ Error: {str(e)}"
 
 
-def analyze_image_with_gemini(image_data):
+# ---------------------------
+# Streaming variants
+# ---------------------------
+#
+# These yield (event, payload) tuples:
+# - ("chunk", {"delta": text, "html": completed blocks rendered so far or None})
+# - ("done", {"response": final HTML, identical to the non-streaming function})
+# - ("error", {"response": "❌ ..."})
+
+def stream_markdown(feature, prompt, fallback, on_complete=None):
+    text = ""
+    rendered_upto = -1
     try:
-        if not image_data.startswith("data:image/"):
-            logging.warning("❌ Invalid image format received.")
-            return "❌ Invalid image format uploaded."
+        for delta in stream(feature, prompt):
+            text += delta
+            html = None
+            # Only re-render when another block has been completed
+            cut = text.rfind("\n\n")
+            if cut > rendered_upto:
+                html = render_partial_markdown(text)
+                if html is not None:
+                    rendered_upto = cut
+            yield "chunk", {"delta": delta, "html": html}
+    except StreamError as e:
+        if not e.started:
+            # Nothing reached the client yet, so fall back to the retrying path
+            log_event("gemini.stream_fallback", "⚠️ Streaming failed before first chunk (%s), falling back.", e, level=logging.WARNING)
+            result = fallback()
+            yield ("error" if result.startswith("❌") else "done"), {"response": result}
+            return
+        log_event("gemini.stream_error", "❌ Stream interrupted: %s", e, level=logging.ERROR)
+        yield "error", {"response": f"❌ Error: {str(e)}"}
+        return
+
+    text = text.strip()
+    if not text:
+        yield "error", {"response": "❌ No response from AI."}
+        return
+    if on_complete:
+        on_complete(text)
+    yield "done", {"response": format_markdown_response(text)}
+
+
+def stream_drug_information(drug_name):
+    drug_name = drug_name.strip()
+    if get_monograph(canonical_drug_id(drug_name)) or get_cached_drug_entry(drug_name):
+        # Monographs and cached answers are sent in one go (stale ones are still refreshed)
+        yield "done", {"response": get_drug_information(drug_name)}
+        return
+    yield from stream_markdown(
+        "drug_info",
+        drug_information_prompt(drug_name),
+        fallback=lambda: get_drug_information(drug_name),
+        on_complete=lambda text: set_cached_drug(drug_name, text),
+    )
 
-        logging.info("Decoding and processing image for AI analysis...")
-        image_base64 = image_data.split(',')[1]
-        image_bytes = base64.b64decode(image_base64)
-        image = Image.open(BytesIO(image_bytes))
 
-        prompt = (
-            "Analyze this image of a medicine or drug packaging. Provide the response in Markdown format:\n"
-            "## Drug Information\n"
-            "- **Drug Name**: Identify the drug name (if visible)\n"
-            "- **Manufacturer**: Identify the manufacturer (if visible)\n"
-            "## Clinical Summary\n"
-            "- **Therapeutic Uses**: List primary uses\n"
-            "- **Standard Dosage**: Provide standard dosage\n"
-            "- **Common Side Effects**: List common side effects\n"
-            "- **Serious Side Effects**: List serious side effects\n"
-            "- **Contraindications**: List contraindications\n"
-            "- **Important Interactions**: List significant interactions\n"
-            "If the image is blurry or unclear, respond with: **'Please retake the image for better clarity.'**"
-        )
+def stream_symptom_recommendation(symptoms):
+    cached = symptom_cache.get(symptoms)
+    if cached:
+        yield "done", {"response": format_markdown_response(cached)}
+        return
+    yield from stream_markdown(
+        "symptoms",
+        symptom_prompt(symptoms),
+        fallback=lambda: get_symptom_recommendation(symptoms),
+        on_complete=lambda text: symptom_cache.set(symptoms, text),
+    )
+
 
-        logging.info("Sending prompt and image to Gemini AI.")
-        response = gemini_generate_with_retry([prompt, image])
+def analyze_image_with_gemini(image_data):
+    try:
+        log_event("image.received", "Decoding and processing image for AI analysis...", level=logging.DEBUG)
+        image = prepare_image(image_data)
+        with span("image_hash"):
+            image_hash = dhash(image.image)
+        cached = packaging_image_cache.get(image_hash)
+        if cached:
+            log_event("cache.hit", "📦 Near-duplicate packaging image, serving cached analysis.", cache="image_packaging")
+            return format_markdown_response(cached)
+
+        with span("prompt_build"):
+            prompt = (
+                "Analyze this image of a medicine or drug packaging. Provide the response in Markdown format:\n"
+                "## Drug Information\n"
+                "- **Drug Name**: Identify the drug name (if visible)\n"
+                "- **Manufacturer**: Identify the manufacturer (if visible)\n"
+                "## Clinical Summary\n"
+                "- **Therapeutic Uses**: List primary uses\n"
+                "- **Standard Dosage**: Provide standard dosage\n"
+                "- **Common Side Effects**: List common side effects\n"
+                "- **Serious Side Effects**: List serious side effects\n"
+                "- **Contraindications**: List contraindications\n"
+                "- **Important Interactions**: List significant interactions\n"
+                "If the image is blurry or unclear, respond with: **'Please retake the image for better clarity.'**"
+            )
+
+        log_event("gemini.prompt", "Sending prompt and image to Gemini AI.", level=logging.DEBUG, feature="packaging_image", image_bytes=len(image.data))
+        result = generate("packaging_image", [prompt, image.as_part()])
         
-        if response and hasattr(response, 'text'):
-            text = response.text.strip()
-            logging.info("AI analysis complete.")
-            return format_markdown_response(text)
+        if result.ok:
+            packaging_image_cache.set(image_hash, result.text)
+            log_event("gemini.response", "AI analysis complete.", feature="packaging_image")
+            return format_markdown_response(result.text)
         else:
-            logging.warning("❌ Analysis failed or empty AI response.")
+            log_event("gemini.empty", "❌ Analysis failed or empty AI response (%s).", result.error, level=logging.WARNING, feature="packaging_image")
             return "❌ Analysis failed or empty response from AI."
 
+    except ImageRejected as e:
+        log_event("image.rejected", "❌ Image rejected: %s", e, level=logging.WARNING)
+        return f"❌ {str(e)}"
     except Exception as e:
-        logging.error(f"❌ Error during image analysis: {str(e)}")
+        log_event("image.error", "❌ Error during image analysis: %s", e, level=logging.ERROR)
         return f"❌ Error during image analysis: {str(e)}"
 
       
-def get_drug_comparison_summary(drug1, drug2):
-    prompt = (
-        f"Compare the drugs **{drug1}** and **{drug2}** side by side in a Markdown table.\n"
-        "\nInclude the following aspects as rows:\n"
-        "- Therapeutic Uses\n"
-        "- Dosage\n"
-        "- Common Side Effects\n"
-        "- Serious Side Effects\n"
-        "- Contraindications\n"
-        "- Drug Interactions\n"
-        "- Drug Class\n"
-        "- Cost/Availability\n"
-        "\nUse column headers: `Aspect`, `" + drug1 + "`, `" + drug2 + "`.\n"
-        "Keep the output clean and do not include explanations outside the table."
+# Comparisons are cached per unordered pair: (A, B) and (B, A) share one entry
+pair_cache = build_cache("drug_pair", maxsize=500, ttl=DRUG_CACHE_HARD_TTL, l2_ttl=DRUG_CACHE_HARD_TTL)
+MAX_INTERACTION_DRUGS = int(os.getenv("MAX_INTERACTION_DRUGS", "15"))
+
+
+def pair_key(drug1, drug2):
+    return "|".join(sorted((canonical_drug_id(drug1), canonical_drug_id(drug2))))
+
+
+# Every comparison ends with one pair-specific line, e.g.
+#   **Interaction severity:** Moderate - Ibuprofen may reduce ...
+# The table's "Drug Interactions" row lists each drug's interactions in
+# general, so the interaction matrix flags pairs from this line instead.
+INTERACTION_SEVERITIES = ("none", "minor", "moderate", "major")
+INTERACTION_LINE = re.compile(r"interaction severity\W*(none|minor|moderate|major)\b", re.IGNORECASE)
+
+
+def severity_instruction(drug1, drug2):
+    return (
+        "**Interaction severity:** <None|Minor|Moderate|Major> - "
+        f"<one sentence on whether and how {drug1} and {drug2} interact with each other>"
     )
 
-    logging.info(f"Prompt to Gemini (summary compare): {prompt}")
-    response = gemini_generate_with_retry(prompt)
-    if response and hasattr(response, 'text'):
-        return response.text.strip()
-    return "❌ Failed to generate comparison summary."
-  
-  
-def analyze_prescription_with_gemini(image_data):
-    try:
-        if not image_data.startswith("data:image/"):
-            logging.warning("❌ Invalid image format received.")
-            return "❌ Invalid image format uploaded."
 
-        logging.info("Decoding and processing prescription image for validation...")
-        
-        # Clean base64 string
-        if "," in image_data:
-            image_data = image_data.split(",")[1]
+def interaction_severity(summary):
+    """"none", "minor", "moderate" or "major" from a comparison's severity line, or None if it has none."""
+    match = INTERACTION_LINE.search(summary or "")
+    return match.group(1).lower() if match else None
+
 
-        # Decode base64 to binary
-        image_bytes = base64.b64decode(image_data)
+def get_cached_pair(drug1, drug2):
+    cached = pair_cache.get(pair_key(drug1, drug2))
+    # Entries cached before the severity line was added are rebuilt
+    return cached if interaction_severity(cached) else None
+
+
+def get_drug_comparison_summary(drug1, drug2):
+    result = compare_drugs(drug1, drug2)
+    return result.text if result.ok else "❌ Failed to generate comparison summary."
 
-        # Convert to PIL Image
-        image = Image.open(io.BytesIO(image_bytes)) 
 
+def compare_drugs(drug1, drug2):
+    """Markdown comparison table for a pair of drugs, as a GenerationResult (cached=True on a cache hit)."""
+    # Generate in a canonical order so both orders coalesce and cache together
+    drug1, drug2 = drug1.strip(), drug2.strip()
+    if canonical_drug_id(drug2) < canonical_drug_id(drug1):
+        drug1, drug2 = drug2, drug1
+    cached = get_cached_pair(drug1, drug2)
+    if cached:
+        log_event("cache.hit", "📦 Cache hit for drug pair: %s / %s", drug1, drug2, cache="drug_pair")
+        return GenerationResult("compare", text=cached, cached=True)
+    if COMPARE_FROM_SECTIONS:
+        result = _assemble_drug_comparison(drug1, drug2)
+        if result is not None:
+            return result
+    return _generate_drug_comparison(drug1, drug2)
+
+
+@coalesce
+def _generate_drug_comparison(drug1, drug2):
+    with span("prompt_build"):
         prompt = (
-            "You are a medical assistant AI.\n"
-            "Given an image of a *prescription*, extract and analyze:\n\n"
-            "### Step 1: Extract Prescription Details\n"
-            "- List all *medications/drugs* mentioned.\n"
-            "- Include *dosage, **frequency, and **duration* if visible.\n\n"
-            "### Step 2: Validation\n"
-            "- Check for *duplicate drugs* or overlapping medicines.\n"
-            "- Check for *drug-drug interactions*.\n"
-            "- Flag any *potentially harmful combinations*.\n"
-            "- If dosage looks too high or low, *flag it*.\n\n"
-            "### Output Format (Markdown)\n"
-            "## Extracted Prescription\n"
-            "- Drug 1: [Name], [Dosage], [Frequency], [Duration]\n"
-            "- ...\n\n"
-            "## AI-Powered Feedback\n"
-            "- Safety Warnings:\n"
-            "- Interaction Notes:\n"
-            "- Suggestions:\n\n"
-            "If the image is unclear or handwriting is illegible, reply with:\n"
-            "'⚠ The prescription image is too unclear to read. Please retake it in good lighting.'"
+            f"Compare the drugs **{drug1}** and **{drug2}** side by side in a Markdown table.\n"
+            "\nInclude the following aspects as rows:\n"
+            "- Therapeutic Uses\n"
+            "- Dosage\n"
+            "- Common Side Effects\n"
+            "- Serious Side Effects\n"
+            "- Contraindications\n"
+            "- Drug Interactions\n"
+            "- Drug Class\n"
+            "- Cost/Availability\n"
+            "\nUse column headers: `Aspect`, `" + drug1 + "`, `" + drug2 + "`.\n"
+            "After the table, add exactly one line in this format:\n"
+            + severity_instruction(drug1, drug2) + "\n"
+            "Do not include any other explanations outside the table."
         )
 
-        logging.info("Sending prescription image to Gemini for validation...")
-        model = genai.GenerativeModel("gemini-1.5-flash")
-        response = model.generate_content([prompt, image])
-        if response is not None:
-            logging.info(f"Gemini Raw Response: {response}")
-        else:
-            logging.warning("⚠ Gemini response is None.")
+    log_event("gemini.prompt", "Prompt to Gemini", level=logging.DEBUG, feature="compare", prompt=redact_text(prompt))
+    result = generate("compare", prompt)
+    if result.ok and interaction_severity(result.text):
+        pair_cache.set(pair_key(drug1, drug2), result.text)
+    return result
 
-        if response and hasattr(response, 'text'):
-            text = response.text.strip()
-            logging.info("✅ Prescription validation complete.")
-            return format_markdown_response(text)
+
+# ---------------------------
+# Comparisons from cached drug sections
+# ---------------------------
+#
+# Most comparison rows (uses, dosage, side effects, contraindications,
+# interactions) are already in each drug's cached summary or monograph. When
+# both drugs have been looked up, the table is assembled from their sections
+# and only the cells a summary doesn't cover (Drug Class, Cost/Availability,
+# and any section Gemini left out) are generated, once per drug, into
+# drug_extra_cache. The pair-specific severity line is one short generation
+# per pair. With M drugs cached, a new pair costs that line plus at most two
+# small per-drug generations the first time, and nothing after that.
+# COMPARE_FROM_SECTIONS=false always generates the full table instead.
+
+COMPARE_FROM_SECTIONS = os.getenv("COMPARE_FROM_SECTIONS", "true").lower() == "true"
+drug_extra_cache = build_cache("drug_extra", maxsize=500, ttl=DRUG_CACHE_HARD_TTL, l2_ttl=DRUG_CACHE_HARD_TTL)
+CELL_HEADINGS = dict(DRUG_SECTIONS + EXTRA_SECTIONS)
+
+
+def get_drug_sections(drug_name):
+    """Sections of a drug's monograph or cached summary, or None if it hasn't been looked up."""
+    monograph = get_monograph(canonical_drug_id(drug_name))
+    if monograph:
+        return monograph["sections"]
+    entry = get_cached_drug_entry(drug_name)
+    if entry is None:
+        return None
+    # Entries cached before sections were stored with the text
+    return entry.get("sections") or parse_drug_sections(entry["text"])
+
+
+def comparison_cells(drug_name, sections):
+    """
+    Fill every comparison row for one drug from its sections plus generated
+    extras. Returns (cells, status) with status "cached", "generated" or
+    "failed" (upstream error; the missing cells are left out).
+    """
+    wanted = [key for key, _ in COMPARISON_ROWS if not sections.get(key)]
+    if not wanted:
+        return sections, "cached"
+    key = canonical_drug_id(drug_name)
+    extras = drug_extra_cache.get(key) or {}
+    missing = tuple(k for k in wanted if k not in extras)
+    status = "cached"
+    if missing:
+        generated = _generate_comparison_cells(drug_name, missing)
+        if generated is None:
+            status = "failed"
         else:
-            logging.warning("❌ No response or empty output from Gemini.")
-            return "❌ No useful output received from Gemini."
+            extras = {**extras, **generated}
+            drug_extra_cache.set(key, extras)
+            status = "generated"
+    return {**sections, **extras}, status
 
+
+@coalesce
+def _generate_comparison_cells(drug_name, keys):
+    with span("prompt_build"):
+        prompt = (
+            f"For the drug **{drug_name}**, give one to three concise bullet points under each of these Markdown headings:\n"
+            + "".join(f"## {CELL_HEADINGS[key]}\n" for key in keys)
+            + "Do not include any other headings or explanations."
+        )
+    log_event("gemini.prompt", "Prompt to Gemini", level=logging.DEBUG, feature="compare", prompt=redact_text(prompt))
+    result = generate("compare", prompt)
+    if not result.ok:
+        log_event("gemini.empty", "❌ Comparison cells failed for %s (%s).", drug_name, result.error,
+                  level=logging.WARNING, feature="compare")
+        return None
+    parsed = parse_drug_sections(result.text)
+    # Headings Gemini skipped are cached as "-" so they aren't asked for again
+    return {key: parsed.get(key) or "-" for key in keys}
+
+
+@coalesce
+def _generate_interaction_line(drug1, drug2):
+    """The pair's "Interaction severity" line, or None if generation failed."""
+    with span("prompt_build"):
+        prompt = (
+            f"Do the drugs **{drug1}** and **{drug2}** interact with each other? "
+            "Reply with exactly one line in this format:\n" + severity_instruction(drug1, drug2)
+        )
+    result = generate("compare", prompt)
+    if not interaction_severity(result.text):
+        log_event("gemini.empty", "❌ Interaction severity failed for %s / %s (%s).", drug1, drug2,
+                  result.error or "unparsed", level=logging.WARNING, feature="compare")
+        return None
+    return next(line.strip() for line in result.text.splitlines() if INTERACTION_LINE.search(line))
+
+
+@coalesce
+def _assemble_drug_comparison(drug1, drug2):
+    """Comparison table from both drugs' cached sections; None if either drug isn't cached."""
+    sections1, sections2 = get_drug_sections(drug1), get_drug_sections(drug2)
+    if not sections1 or not sections2:
+        return None
+    cells1, status1 = comparison_cells(drug1, sections1)
+    cells2, status2 = comparison_cells(drug2, sections2)
+    text = render_comparison_table(drug1, cells1, drug2, cells2)
+    line = _generate_interaction_line(drug1, drug2)
+    if line:
+        text += "\n\n" + line
+        if "failed" not in (status1, status2):
+            pair_cache.set(pair_key(drug1, drug2), text)
+    log_event("compare.assembled", "🧩 Assembled comparison for %s / %s from cached sections", drug1, drug2,
+              feature="compare", cells=[status1, status2], severity=interaction_severity(line))
+    return GenerationResult("compare", text=text)
+
+
+def get_interaction_matrix(drugs, concurrency=DRUG_BATCH_CONCURRENCY):
+    """
+    Compare every unordered pair of drugs. Cached pairs are reused; missing
+    pairs are fetched concurrently, so adding one drug to a regimen of N only
+    costs N new lookups. Returns (drug names, list of pair results).
+    """
+    unique = {}
+    for name in drugs:
+        if isinstance(name, str) and name.strip():
+            unique.setdefault(canonical_drug_id(name), name.strip())
+    names = list(unique.values())
+
+    results = {}
+    misses = []
+    for drug1, drug2 in itertools.combinations(names, 2):
+        cached = get_cached_pair(drug1, drug2)
+        if cached:
+            results[(drug1, drug2)] = GenerationResult("compare", text=cached, cached=True)
+        else:
+            misses.append((drug1, drug2))
+
+    if misses:
+        with ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="drug-pairs") as executor:
+            futures = {
+                executor.submit(contextvars.copy_context().run, compare_drugs, d1, d2): (d1, d2)
+                for d1, d2 in misses
+            }
+            for future in as_completed(futures):
+                try:
+                    result = future.result()
+                except Exception as e:
+                    log_event("gemini.error", "❌ Comparison failed: %s", e, level=logging.ERROR)
+                    result = GenerationResult("compare", error="error")
+                results[futures[future]] = result
+
+    pairs = []
+    for drug1, drug2 in itertools.combinations(names, 2):
+        result = results[(drug1, drug2)]
+        pairs.append({
+            "drugs": [drug1, drug2],
+            "summary": result.text if result.ok else "❌ Failed to generate comparison summary.",
+            "severity": interaction_severity(result.text) if result.ok else None,
+            "cached": result.cached,
+            "status": "ok" if result.ok else "error",
+        })
+    return names, pairs
+  
+  
+def analyze_prescription_with_gemini(image_data):
+    try:
+        log_event("image.received", "Decoding and processing prescription image for validation...", level=logging.DEBUG)
+        image = prepare_image(image_data)
+        with span("image_hash"):
+            image_hash = content_hash(image.data)
+        cached = prescription_image_cache.get(image_hash)
+        if cached:
+            log_event("cache.hit", "📦 Identical prescription image, serving cached validation.", cache="image_prescription")
+            return format_markdown_response(cached)
+
+        with span("prompt_build"):
+            prompt = (
+                "You are a medical assistant AI.\n"
+                "Given an image of a *prescription*, extract and analyze:\n\n"
+                "### Step 1: Extract Prescription Details\n"
+                "- List all *medications/drugs* mentioned.\n"
+                "- Include *dosage, **frequency, and **duration* if visible.\n\n"
+                "### Step 2: Validation\n"
+                "- Check for *duplicate drugs* or overlapping medicines.\n"
+                "- Check for *drug-drug interactions*.\n"
+                "- Flag any *potentially harmful combinations*.\n"
+                "- If dosage looks too high or low, *flag it*.\n\n"
+                "### Output Format (Markdown)\n"
+                "## Extracted Prescription\n"
+                "- Drug 1: [Name], [Dosage], [Frequency], [Duration]\n"
+                "- ...\n\n"
+                "## AI-Powered Feedback\n"
+                "- Safety Warnings:\n"
+                "- Interaction Notes:\n"
+                "- Suggestions:\n\n"
+                "If the image is unclear or handwriting is illegible, reply with:\n"
+                "'⚠ The prescription image is too unclear to read. Please retake it in good lighting.'"
+            )
+
+        log_event("gemini.prompt", "Sending prescription image to Gemini for validation...", level=logging.DEBUG, feature="prescription", image_bytes=len(image.data))
+        result = generate("prescription", [prompt, image.as_part()])
+
+        if result.ok:
+            prescription_image_cache.set(image_hash, result.text)
+            log_event("gemini.response", "✅ Prescription validation complete.", feature="prescription")
+            return format_markdown_response(result.text)
+        else:
+            log_event("gemini.empty", "❌ No response or empty output from Gemini (%s).", result.error, level=logging.WARNING, feature="prescription")
+            if result.error == "empty":
+                return "❌ No useful output received from Gemini."
+            return result.error_message
+
+    except ImageRejected as e:
+        log_event("image.rejected", "❌ Image rejected: %s", e, level=logging.WARNING)
+        return f"❌ {str(e)}"
     except Exception as e:
-        logging.error(f"❌ Error during image analysis: {str(e)}")
+        log_event("image.error", "❌ Error during image analysis: %s", e, level=logging.ERROR)
         return f"❌ Error during image analysis: {str(e)}"
     
 
+# Allergy checks are cached on the normalized allergy list and the canonical
+# IDs of the medicines, so "Tylenol, Advil" and "ibuprofen, paracetamol" match
+allergy_cache = build_cache("allergy", maxsize=200, ttl=DRUG_CACHE_HARD_TTL, l2_ttl=DRUG_CACHE_HARD_TTL)
+
+
+def split_list(text):
+    """Split free-text lists ("a, b and c") into normalized items."""
+    if isinstance(text, (list, tuple)):
+        text = ",".join(text)
+    items = re.split(r"[,;\n+]|\band\b", text.lower())
+    return [" ".join(item.split()) for item in items if item.strip()]
+
+
+def allergy_key(allergies, medicines):
+    allergy_ids = sorted({canonical_drug_id(a) for a in split_list(allergies)})
+    medicine_ids = sorted({canonical_drug_id(m) for m in split_list(medicines)})
+    return ",".join(allergy_ids) + "|" + ",".join(medicine_ids)
+
+
 def analyze_allergies(allergies, medicines):
-    prompt = f"""
+    key = allergy_key(allergies, medicines)
+    cached = allergy_cache.get(key)
+    if cached:
+        log_event("cache.hit", "📦 Cache hit for allergy check.", cache="allergy")
+        return format_markdown_response(cached)
+
+    # Clear-cut pairs are decided locally; only ambiguous ones go to Gemini
+    allergy_items, medicine_items = split_list(allergies), split_list(medicines)
+    results, ambiguous = screen_allergies(allergy_items, medicine_items)
+    ambiguous_allergies = sorted({a for a, _ in ambiguous})
+    ambiguous_medicines = sorted({m for _, m in ambiguous})
+    screen = render_screen(results, ambiguous_medicines)
+
+    if not ambiguous:
+        log_event("allergy.rules_only", "✅ Allergy check fully resolved by rules, no Gemini call.")
+        allergy_cache.set(key, screen)
+        return format_markdown_response(screen)
+
+    log_event("allergy.ambiguous", "Allergy check: %d ambiguous pair(s) sent to Gemini.", len(ambiguous))
+    try:
+        review = _analyze_allergies(", ".join(ambiguous_allergies), ", ".join(ambiguous_medicines))
+    except Exception as e:
+        log_event("gemini.error", "❌ Exception in analyze_allergies: %s", e, level=logging.ERROR)
+        review = None
+
+    if review is None:
+        if len(results) == len(ambiguous_medicines) and all(r["verdict"] == "safe" for r in results.values()):
+            return "❌ No response from AI."
+        # Still worth showing the clear-cut findings
+        return format_markdown_response(screen + "\n\n## AI Review\n- ⚠️ AI review is unavailable right now; please verify the remaining medicines manually.")
+
+    text = screen + "\n\n## AI Review\n" + review
+    allergy_cache.set(key, text)
+    return format_markdown_response(text)
+
+
+@coalesce
+def _analyze_allergies(allergies, medicines):
+    """Ask Gemini about the pairs the rules couldn't decide. Returns raw markdown or None."""
+    with span("prompt_build"):
+        prompt = f"""
     You are an AI medical assistant.
     Check the following medicines against these allergies:
 
@@ -308,17 +801,11 @@ def analyze_allergies(allergies, medicines):
     - Possible allergic reactions or warnings
     Answer in bullet points.
     """
-    logging.info(f"Prompt to Gemini for allergy check: {prompt}")
+    log_event("gemini.prompt", "Prompt to Gemini", level=logging.DEBUG, feature="allergy", prompt=redact_text(prompt))
 
-    try:
-        response = gemini_generate_with_retry(prompt)
-        if response and hasattr(response, 'text'):
-            text = response.text.strip()
-            logging.info("Received response from Gemini for symptoms.")
-            return format_markdown_response(text)
-        else:
-            logging.warning("❌ No text in AI response for symptoms.")
-            return "❌ No response from AI."
-    except Exception as e:
-        logging.error(f"❌ Exception in get_symptom_recommendation: {str(e)}")
-        return f"❌ Error: {str(e)}"
+    result = generate("allergy", prompt)
+    if result.ok:
+        log_event("gemini.response", "Received response from Gemini for allergies.", feature="allergy")
+        return result.text
+    log_event("gemini.empty", "❌ No text in AI response for allergies (%s).", result.error, level=logging.WARNING, feature="allergy")
+    return None
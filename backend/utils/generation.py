@@ -0,0 +1,143 @@
+import os
+import time
+
+from .gemini_engine import (
+    GEMINI_MAX_CONCURRENCY,
+    feature_limiter,
+    generate_detailed_async,
+    run_sync,
+    stream_sync,
+)
+from .model_registry import DEFAULT_MODEL, get_model
+
+
+# ---------------------------
+# Generation service
+# ---------------------------
+#
+# Every AI feature in gemini_utils generates through here. Each feature has
+# its own model, timeout, retry count and in-flight cap (on top of the
+# engine-wide GEMINI_MAX_CONCURRENCY), overridable per feature with
+#   GEMINI_<FEATURE>_MODEL / _TIMEOUT / _RETRIES / _CONCURRENCY
+# e.g. GEMINI_PRESCRIPTION_TIMEOUT=30. Calls return a GenerationResult, so
+# callers and caches check `result.ok` instead of looking for "❌" strings.
+
+
+class FeatureConfig:
+    def __init__(self, model, timeout=10, max_retries=3, concurrency=GEMINI_MAX_CONCURRENCY, delay=2):
+        self.model = model
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.concurrency = concurrency
+        self.delay = delay
+
+    def as_dict(self):
+        return {
+            "model": self.model,
+            "timeout": self.timeout,
+            "max_retries": self.max_retries,
+            "concurrency": self.concurrency,
+        }
+
+
+def _feature(name, model=DEFAULT_MODEL, timeout=10, max_retries=3, concurrency=GEMINI_MAX_CONCURRENCY):
+    prefix = f"GEMINI_{name.upper()}_"
+    return FeatureConfig(
+        model=os.getenv(prefix + "MODEL", model),
+        timeout=float(os.getenv(prefix + "TIMEOUT", timeout)),
+        max_retries=int(os.getenv(prefix + "RETRIES", max_retries)),
+        concurrency=int(os.getenv(prefix + "CONCURRENCY", concurrency)),
+    )
+
+
+FEATURES = {
+    "drug_info": _feature("drug_info"),
+    "symptoms": _feature("symptoms"),
+    "compare": _feature("compare"),
+    "allergy": _feature("allergy"),
+    # Image requests are larger and slower; keep a few slots free for text features
+    "packaging_image": _feature("packaging_image", timeout=20, concurrency=4),
+    "prescription": _feature("prescription", model="gemini-1.5-flash", timeout=20, max_retries=2, concurrency=4),
+}
+
+ERROR_MESSAGES = {
+    "breaker_open": "AI service is temporarily unavailable. Please try again shortly.",
+    "timeout": "AI service timed out.",
+    "empty": "No response from AI.",
+    "error": "AI service error.",
+    "retry_budget": "AI service is busy. Please try again shortly.",
+}
+
+
+class GenerationResult:
+    """Outcome of one generation: `text` (stripped) when ok, otherwise an `error` code."""
+
+    __slots__ = ("feature", "text", "error", "model", "attempts", "elapsed_ms", "cached")
+
+    def __init__(self, feature, text=None, error=None, model=None, attempts=0, elapsed_ms=0.0, cached=False):
+        self.feature = feature
+        self.text = text
+        self.error = error
+        self.model = model
+        self.attempts = attempts
+        self.elapsed_ms = elapsed_ms
+        self.cached = cached
+
+    @property
+    def ok(self):
+        return self.text is not None
+
+    def __bool__(self):
+        return self.ok
+
+    @property
+    def error_message(self):
+        """User-facing message for a failed result (the API still returns "❌ ..." strings)."""
+        return "❌ " + ERROR_MESSAGES.get(self.error, "No response from AI.")
+
+    def __repr__(self):
+        status = "ok" if self.ok else f"error={self.error}"
+        return f"<GenerationResult {self.feature} {status} attempts={self.attempts} {self.elapsed_ms}ms>"
+
+
+def get_feature_config(feature):
+    return FEATURES[feature]
+
+
+async def generate_feature_async(feature, prompt, model=None):
+    config = FEATURES[feature]
+    started = time.perf_counter()
+    response, reason, attempts = await generate_detailed_async(
+        model or get_model(config.model),
+        prompt,
+        max_retries=config.max_retries,
+        delay=config.delay,
+        timeout=config.timeout,
+        limiter=feature_limiter(feature, config.concurrency),
+    )
+    elapsed_ms = round((time.perf_counter() - started) * 1000, 1)
+    text = response.text.strip() if response is not None else None
+    return GenerationResult(
+        feature, text=text or None, error=None if text else (reason or "empty"),
+        model=config.model, attempts=attempts, elapsed_ms=elapsed_ms,
+    )
+
+
+def generate(feature, prompt):
+    """Generate for `feature` from a sync caller. Never raises for upstream failures."""
+    # Build the model here, not on the engine loop: the first call imports the SDK
+    model = get_model(FEATURES[feature].model)
+    return run_sync(generate_feature_async(feature, prompt, model))
+
+
+def stream(feature, prompt):
+    """Yield text chunks for `feature` (raises gemini_engine.StreamError on failure)."""
+    config = FEATURES[feature]
+    return stream_sync(
+        get_model(config.model), prompt, timeout=config.timeout,
+        limiter=feature_limiter(feature, config.concurrency),
+    )
+
+
+def get_generation_config():
+    return {name: config.as_dict() for name, config in FEATURES.items()}
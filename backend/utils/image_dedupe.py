@@ -0,0 +1,160 @@
+import hashlib
+import itertools
+import os
+import threading
+from collections import OrderedDict
+
+from PIL import Image
+
+from .metrics import count_cache, span
+
+
+# ---------------------------
+# Perceptual-hash image cache
+# ---------------------------
+#
+# Pharmacists rescan the same box or prescription many times. Each image is
+# reduced to a 64-bit dHash; two scans of the same thing differ in only a few
+# bits, so a lookup finds any stored hash within IMAGE_DEDUPE_DISTANCE bits.
+#
+# Nearest-hash lookup uses multi-index hashing: the hash is split into 4
+# 16-bit segments, each with its own table. If two hashes are within d bits,
+# at least one segment is within d // 4 bits (pigeonhole), so we only probe
+# those few neighbouring segment values instead of scanning every entry.
+#
+# Prescriptions are different: two patients' prescriptions on the same
+# printed pad can be a few bits apart, and the cache is shared by all users.
+# They are keyed by an exact content hash with max_distance 0, so only a
+# byte-identical upload reuses a stored analysis.
+
+HASH_BITS = 64
+SEGMENTS = 4
+SEGMENT_BITS = HASH_BITS // SEGMENTS
+SEGMENT_MASK = (1 << SEGMENT_BITS) - 1
+
+
+def dhash(image, hash_size=8):
+    """Difference hash: compare each pixel with its right neighbour on a 9x8 grayscale thumbnail."""
+    small = image.convert("L").resize((hash_size + 1, hash_size), Image.BILINEAR)
+    pixels = small.tobytes()
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def content_hash(data):
+    """Exact 64-bit content hash, in the same key space as dhash."""
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), "big")
+
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+
+def _segments(value):
+    return [(value >> (i * SEGMENT_BITS)) & SEGMENT_MASK for i in range(SEGMENTS)]
+
+
+def _flip_masks(radius):
+    masks = [0]
+    for r in range(1, radius + 1):
+        for bits in itertools.combinations(range(SEGMENT_BITS), r):
+            mask = 0
+            for bit in bits:
+                mask |= 1 << bit
+            masks.append(mask)
+    return masks
+
+
+class PerceptualHashCache:
+    """Bounded LRU cache keyed by image hash, matching near-duplicates within max_distance bits."""
+
+    def __init__(self, name, maxsize=20000, max_distance=6):
+        self.name = name
+        self.maxsize = maxsize
+        self.max_distance = max_distance
+        self.entries = OrderedDict()
+        self.tables = [dict() for _ in range(SEGMENTS)]
+        self.flip_masks = _flip_masks(max_distance // SEGMENTS)
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def _nearest(self, value):
+        if value in self.entries:
+            return value
+        best, best_distance = None, self.max_distance + 1
+        for i, segment in enumerate(_segments(value)):
+            table = self.tables[i]
+            for mask in self.flip_masks:
+                for candidate in table.get(segment ^ mask, ()):
+                    distance = hamming(value, candidate)
+                    if distance < best_distance:
+                        best, best_distance = candidate, distance
+        return best
+
+    def get(self, value):
+        with span("cache_lookup"), self.lock:
+            match = self._nearest(value)
+            if match is None:
+                self.misses += 1
+                result = None
+            else:
+                self.entries.move_to_end(match)
+                self.hits += 1
+                result = self.entries[match]
+        count_cache(f"image_{self.name}", result is not None)
+        return result
+
+    def set(self, value, result):
+        with self.lock:
+            if value in self.entries:
+                self.entries[value] = result
+                self.entries.move_to_end(value)
+                return
+            self.entries[value] = result
+            for i, segment in enumerate(_segments(value)):
+                self.tables[i].setdefault(segment, set()).add(value)
+            while len(self.entries) > self.maxsize:
+                self._evict_oldest()
+
+    def _evict_oldest(self):
+        value, _ = self.entries.popitem(last=False)
+        for i, segment in enumerate(_segments(value)):
+            bucket = self.tables[i].get(segment)
+            if bucket is not None:
+                bucket.discard(value)
+                if not bucket:
+                    del self.tables[i][segment]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            for table in self.tables:
+                table.clear()
+
+    def stats(self):
+        with self.lock:
+            return {
+                "name": self.name,
+                "size": len(self.entries),
+                "maxsize": self.maxsize,
+                "max_distance": self.max_distance,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+IMAGE_DEDUPE_MAXSIZE = int(os.getenv("IMAGE_DEDUPE_MAXSIZE", "20000"))
+IMAGE_DEDUPE_DISTANCE = int(os.getenv("IMAGE_DEDUPE_DISTANCE", "6"))
+
+packaging_image_cache = PerceptualHashCache("packaging", IMAGE_DEDUPE_MAXSIZE, IMAGE_DEDUPE_DISTANCE)
+# Exact matches only: a near-duplicate could be another patient's prescription
+prescription_image_cache = PerceptualHashCache("prescription", IMAGE_DEDUPE_MAXSIZE, max_distance=0)
+
+
+def get_image_cache_stats():
+    return [packaging_image_cache.stats(), prescription_image_cache.stats()]
@@ -0,0 +1,232 @@
+import base64
+import binascii
+import os
+import tempfile
+import time
+from io import BytesIO
+
+from PIL import Image, ImageOps
+
+from .log_utils import log_event
+from .metrics import span
+
+
+# ---------------------------
+# Image preprocessing
+# ---------------------------
+#
+# Phone photos are often 12 MP+, which is far more than Gemini needs to read
+# a label or a prescription. Before an image goes upstream we:
+# - check the format from its header bytes (no full decode)
+# - reject payloads that are too large before decoding them
+# - downscale to IMAGE_MAX_EDGE, fix EXIF orientation and re-encode as JPEG
+#
+# Uploads can arrive as a base64 data URL (the original form field), a
+# multipart file part or a raw `image/*` body. Files and raw bodies are never
+# base64'd or copied into one big string: they are read in chunks into a
+# spooled temp file (in memory up to IMAGE_SPOOL_BYTES, then on disk) that
+# PIL reads from directly.
+
+IMAGE_MAX_EDGE = int(os.getenv("IMAGE_MAX_EDGE", "1600"))
+IMAGE_MAX_BYTES = int(os.getenv("IMAGE_MAX_BYTES", str(10 * 1024 * 1024)))
+IMAGE_MAX_PIXELS = int(os.getenv("IMAGE_MAX_PIXELS", str(50_000_000)))
+IMAGE_JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", "85"))
+IMAGE_SPOOL_BYTES = int(os.getenv("IMAGE_SPOOL_BYTES", str(1024 * 1024)))
+READ_CHUNK = 64 * 1024
+
+SIGNATURES = [
+    (b"\xff\xd8\xff", "JPEG"),
+    (b"\x89PNG\r\n\x1a\n", "PNG"),
+    (b"GIF87a", "GIF"),
+    (b"GIF89a", "GIF"),
+    (b"BM", "BMP"),
+]
+
+
+class ImageRejected(ValueError):
+    """Raised when an upload is not a supported image or is too large."""
+
+
+class PreparedImage:
+    """A downscaled, re-encoded image ready to send to Gemini."""
+
+    def __init__(self, image, data, mime_type, stats):
+        self.image = image
+        self.data = data
+        self.mime_type = mime_type
+        self.stats = stats
+
+    def as_part(self):
+        return {"mime_type": self.mime_type, "data": self.data}
+
+
+def sniff_format(header):
+    """Identify the image format from its first bytes, or return None."""
+    header = bytes(header[:16])
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return "WEBP"
+    for signature, fmt in SIGNATURES:
+        if header.startswith(signature):
+            return fmt
+    return None
+
+
+def decode_data_url(image_data):
+    """Decode a `data:image/...;base64,` string into bytes, enforcing IMAGE_MAX_BYTES first."""
+    if not image_data.startswith("data:image/"):
+        raise ImageRejected("Invalid image format uploaded.")
+    _, _, payload = image_data.partition(",")
+    if not payload:
+        raise ImageRejected("Invalid image format uploaded.")
+
+    # Base64 encodes 3 bytes in 4 characters, so the decoded size is known up front
+    if len(payload) * 3 // 4 > IMAGE_MAX_BYTES:
+        raise _too_large()
+    try:
+        # Check the magic bytes from the first few characters before decoding everything
+        header = base64.b64decode(payload[:24])
+    except (binascii.Error, ValueError):
+        raise ImageRejected("Image data is not valid base64.")
+    if sniff_format(header) is None:
+        raise ImageRejected("Unsupported image format. Please upload a JPEG, PNG, WEBP, GIF or BMP image.")
+    try:
+        return base64.b64decode(payload)
+    except (binascii.Error, ValueError):
+        raise ImageRejected("Image data is not valid base64.")
+
+
+def _too_large():
+    return ImageRejected(f"Image is too large (max {IMAGE_MAX_BYTES // (1024 * 1024)} MB).")
+
+
+def _as_file(source):
+    """(seekable file, size) for raw bytes or an already-seekable file object."""
+    if hasattr(source, "read"):
+        source.seek(0, os.SEEK_END)
+        size = source.tell()
+        source.seek(0)
+        return source, size
+    # BytesIO shares a bytes object's buffer until it is written to
+    return BytesIO(source), len(source)
+
+
+def spool_upload(stream, content_length=None):
+    """
+    Copy a raw request body into a spooled temp file in fixed-size chunks,
+    rejecting it as soon as it exceeds IMAGE_MAX_BYTES.
+    """
+    if content_length is not None and content_length > IMAGE_MAX_BYTES:
+        raise _too_large()
+    spool = tempfile.SpooledTemporaryFile(max_size=IMAGE_SPOOL_BYTES)
+    buffer = bytearray(READ_CHUNK)
+    view = memoryview(buffer)
+    total = 0
+    while True:
+        n = stream.readinto(buffer)
+        if not n:
+            break
+        total += n
+        if total > IMAGE_MAX_BYTES:
+            spool.close()
+            raise _too_large()
+        spool.write(view[:n])
+    spool.seek(0)
+    return spool
+
+
+def preprocess_image(source):
+    """Validate, downscale, orient and re-encode an image given as bytes or a seekable file."""
+    started = time.perf_counter()
+    fileobj, input_bytes = _as_file(source)
+    if input_bytes > IMAGE_MAX_BYTES:
+        raise _too_large()
+
+    fmt = sniff_format(fileobj.read(16))
+    fileobj.seek(0)
+    if fmt is None:
+        raise ImageRejected("Unsupported image format. Please upload a JPEG, PNG, WEBP, GIF or BMP image.")
+
+    # Image.open only parses the header; pixels are decoded on load()
+    try:
+        image = Image.open(fileobj)
+    except Exception:
+        raise ImageRejected("The uploaded file could not be read as an image.")
+    input_size = image.size
+    if input_size[0] * input_size[1] > IMAGE_MAX_PIXELS:
+        raise ImageRejected("Image resolution is too large.")
+
+    if image.format == "JPEG":
+        # Let the JPEG decoder downscale by 1/2, 1/4 or 1/8 while decoding
+        image.draft("RGB", (IMAGE_MAX_EDGE, IMAGE_MAX_EDGE))
+    image = ImageOps.exif_transpose(image)
+    image.thumbnail((IMAGE_MAX_EDGE, IMAGE_MAX_EDGE))
+
+    if image.mode in ("RGBA", "LA", "P"):
+        image = image.convert("RGBA")
+        background = Image.new("RGB", image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel("A"))
+        image = background
+    elif image.mode != "RGB":
+        image = image.convert("RGB")
+
+    out = BytesIO()
+    image.save(out, format="JPEG", quality=IMAGE_JPEG_QUALITY, optimize=True)
+    data = out.getvalue()
+
+    stats = {
+        "format": fmt,
+        "input_bytes": input_bytes,
+        "output_bytes": len(data),
+        "input_size": input_size,
+        "output_size": image.size,
+        "preprocess_ms": round((time.perf_counter() - started) * 1000, 1),
+    }
+    log_event(
+        "image.preprocessed", "🖼️ Image preprocessed: %s %dx%d %dB -> JPEG %dx%d %dB in %sms",
+        fmt, input_size[0], input_size[1], input_bytes, image.size[0], image.size[1], len(data),
+        stats["preprocess_ms"], **stats,
+    )
+    return PreparedImage(image, data, "image/jpeg", stats)
+
+
+def prepare_data_url(image_data):
+    """Decode and preprocess a base64 data URL from the upload forms."""
+    started = time.perf_counter()
+    with span("decode"):
+        image_bytes = decode_data_url(image_data)
+    decode_ms = round((time.perf_counter() - started) * 1000, 1)
+    with span("preprocess"):
+        prepared = preprocess_image(image_bytes)
+    prepared.stats["decode_ms"] = decode_ms
+    return prepared
+
+
+def prepare_upload(fileobj):
+    """Preprocess a multipart file part or spooled raw body; no base64 decode needed."""
+    with span("preprocess"):
+        prepared = preprocess_image(fileobj)
+    prepared.stats["decode_ms"] = 0.0
+    return prepared
+
+
+def upload_bytes(upload):
+    """
+    The raw image bytes of any supported upload, checked for size and format
+    but not decoded, e.g. to hand the image to a background job.
+    """
+    if isinstance(upload, str):
+        return decode_data_url(upload)
+    fileobj, size = _as_file(upload)
+    if size > IMAGE_MAX_BYTES:
+        raise _too_large()
+    data = fileobj.read()
+    if sniff_format(data[:16]) is None:
+        raise ImageRejected("Unsupported image format. Please upload a JPEG, PNG, WEBP, GIF or BMP image.")
+    return data
+
+
+def prepare_image(upload):
+    """Preprocess any supported upload: a data URL string or a file object."""
+    if isinstance(upload, str):
+        return prepare_data_url(upload)
+    return prepare_upload(upload)
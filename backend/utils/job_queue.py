@@ -0,0 +1,443 @@
+import logging
+import os
+import signal
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+from .gemini_engine import call_deadline
+from .log_utils import log_event
+from .metrics import current_endpoint
+
+
+# ---------------------------
+# Background job queue
+# ---------------------------
+#
+# Image analyses can take tens of seconds (vision call plus retries). With
+# `?async=1` the endpoint only validates the upload, enqueues a job and
+# returns 202 with a job ID; a worker runs the analysis and the client polls
+# (or long-polls) GET /jobs/<id>.
+#
+# Two backends:
+# - memory: jobs live in this process and in-process worker threads run them
+# - sqlite: jobs live in JOB_DB, so every gunicorn worker and any number of
+#   `python worker.py` processes share one queue
+#
+# Use sqlite whenever the app runs in more than one process (gunicorn
+# workers): with memory, GET /jobs/<id> only finds jobs submitted to the
+# same process.
+#
+# The queue is bounded (JOB_QUEUE_MAXSIZE queued + running; beyond that
+# enqueue raises QueueFull and the API answers 429). Each job gets
+# JOB_TIMEOUT seconds once started (its Gemini calls are cancelled at the
+# deadline, so the thread is freed); finished results are kept for
+# JOB_RESULT_TTL seconds and then purged. A SQLite job whose worker died is
+# picked up again once its lease runs out, at most JOB_MAX_ATTEMPTS times.
+
+JOB_BACKEND = os.getenv("JOB_BACKEND", "sqlite")
+JOB_DB = os.getenv("JOB_DB", os.path.join(tempfile.gettempdir(), "medimate_jobs.sqlite3"))
+JOB_QUEUE_MAXSIZE = int(os.getenv("JOB_QUEUE_MAXSIZE", "100"))
+# In-process worker threads; set to 0 when jobs are run by worker.py instead
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_TIMEOUT = float(os.getenv("JOB_TIMEOUT", "60"))
+JOB_RESULT_TTL = int(os.getenv("JOB_RESULT_TTL", "600"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "2"))
+JOB_WAIT_MAX = float(os.getenv("JOB_WAIT_MAX", "25"))
+
+QUEUED, RUNNING, DONE, FAILED, TIMEOUT = "queued", "running", "done", "failed", "timeout"
+FINISHED = (DONE, FAILED, TIMEOUT)
+
+
+class QueueFull(Exception):
+    """Raised when the job queue is at JOB_QUEUE_MAXSIZE."""
+
+
+def _tasks():
+    # Imported lazily: gemini_utils pulls in the whole generation stack
+    from .gemini_utils import analyze_image_with_gemini, analyze_prescription_with_gemini
+
+    return {
+        "packaging_image": analyze_image_with_gemini,
+        "prescription": analyze_prescription_with_gemini,
+    }
+
+
+def public_job(job):
+    """The job as returned by GET /jobs/<id> (no payload)."""
+    data = {key: job.get(key) for key in ("id", "task", "status", "created_at", "started_at", "finished_at", "attempts")}
+    if job.get("status") in FINISHED:
+        data["result"] = job.get("result")
+        if job.get("started_at") and job.get("finished_at"):
+            data["elapsed_ms"] = round((job["finished_at"] - job["started_at"]) * 1000, 1)
+    return data
+
+
+class MemoryJobBackend:
+    """Jobs in a dict plus a FIFO of queued IDs; a condition wakes workers and long-pollers."""
+
+    def __init__(self, maxsize=100, result_ttl=600):
+        self.maxsize = maxsize
+        self.result_ttl = result_ttl
+        self.jobs = {}
+        self.pending = deque()
+        self.active = 0
+        self.rejected = 0
+        self.cond = threading.Condition()
+
+    def enqueue(self, task, payload):
+        with self.cond:
+            self._purge()
+            if len(self.pending) + self.active >= self.maxsize:
+                self.rejected += 1
+                raise QueueFull()
+            job = {"id": uuid.uuid4().hex, "task": task, "payload": payload, "status": QUEUED,
+                   "created_at": time.time(), "started_at": None, "finished_at": None,
+                   "attempts": 0, "result": None}
+            self.jobs[job["id"]] = job
+            self.pending.append(job["id"])
+            self.cond.notify_all()
+            return dict(job)
+
+    def claim(self, timeout=1.0):
+        with self.cond:
+            if not self.pending:
+                self.cond.wait(timeout)
+            if not self.pending:
+                return None
+            job = self.jobs[self.pending.popleft()]
+            job.update(status=RUNNING, started_at=time.time(), attempts=job["attempts"] + 1)
+            self.active += 1
+            return dict(job)
+
+    def finish(self, job_id, status, result):
+        with self.cond:
+            job = self.jobs.get(job_id)
+            if job is None or job["status"] != RUNNING:
+                return
+            job.update(status=status, result=result, finished_at=time.time(), payload=None)
+            self.active -= 1
+            self.cond.notify_all()
+
+    def get(self, job_id, wait=0):
+        deadline = time.monotonic() + wait
+        with self.cond:
+            while True:
+                job = self.jobs.get(job_id)
+                remaining = deadline - time.monotonic()
+                if job is None or job["status"] in FINISHED or remaining <= 0:
+                    return dict(job) if job else None
+                self.cond.wait(remaining)
+
+    def _purge(self):
+        # Caller holds the condition
+        cutoff = time.time() - self.result_ttl
+        expired = [job_id for job_id, job in self.jobs.items()
+                   if job["status"] in FINISHED and job["finished_at"] < cutoff]
+        for job_id in expired:
+            del self.jobs[job_id]
+
+    def stats(self):
+        with self.cond:
+            counts = {}
+            for job in self.jobs.values():
+                counts[job["status"]] = counts.get(job["status"], 0) + 1
+            return {"backend": "memory", "maxsize": self.maxsize, "rejected": self.rejected, "jobs": counts}
+
+
+class SQLiteJobBackend:
+    """Jobs in a SQLite table shared by every process on the host; claims use leases."""
+
+    def __init__(self, path, maxsize=100, result_ttl=600, lease=90, max_attempts=2):
+        self.path = path
+        self.maxsize = maxsize
+        self.result_ttl = result_ttl
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.rejected = 0
+        self._local = threading.local()
+        # Wakes long-pollers in this process early; other processes are seen by polling
+        self.cond = threading.Condition()
+        self._init_db()
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _init_db(self):
+        conn = self._connect()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id TEXT PRIMARY KEY,"
+            " task TEXT NOT NULL,"
+            " payload BLOB,"
+            " status TEXT NOT NULL,"
+            " result TEXT,"
+            " created_at REAL NOT NULL,"
+            " started_at REAL,"
+            " finished_at REAL,"
+            " lease_until REAL,"
+            " attempts INTEGER NOT NULL DEFAULT 0)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+
+    def enqueue(self, task, payload):
+        conn = self._connect()
+        now = time.time()
+        job_id = uuid.uuid4().hex
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM jobs WHERE finished_at < ?", (now - self.result_ttl,))
+            depth = conn.execute("SELECT COUNT(*) FROM jobs WHERE status IN (?, ?)", (QUEUED, RUNNING)).fetchone()[0]
+            full = depth >= self.maxsize
+            if not full:
+                conn.execute(
+                    "INSERT INTO jobs (id, task, payload, status, created_at) VALUES (?, ?, ?, ?, ?)",
+                    (job_id, task, sqlite3.Binary(payload), QUEUED, now),
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        if full:
+            self.rejected += 1
+            raise QueueFull()
+        return {"id": job_id, "task": task, "status": QUEUED, "created_at": now,
+                "started_at": None, "finished_at": None, "attempts": 0}
+
+    def claim(self, timeout=1.0):
+        deadline = time.monotonic() + timeout
+        while True:
+            job = self._claim_one()
+            if job is not None or time.monotonic() >= deadline:
+                return job
+            time.sleep(min(0.2, max(0.0, deadline - time.monotonic())))
+
+    def _claim_one(self):
+        conn = self._connect()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Jobs whose worker died have an expired lease; give up on them after max_attempts
+            conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, finished_at = ?, payload = NULL"
+                " WHERE status = ? AND lease_until < ? AND attempts >= ?",
+                (FAILED, "❌ Job failed: worker stopped.", now, RUNNING, now, self.max_attempts),
+            )
+            row = conn.execute(
+                "SELECT * FROM jobs WHERE status = ? OR (status = ? AND lease_until < ?)"
+                " ORDER BY created_at LIMIT 1",
+                (QUEUED, RUNNING, now),
+            ).fetchone()
+            if row is not None:
+                conn.execute(
+                    "UPDATE jobs SET status = ?, started_at = ?, lease_until = ?, attempts = attempts + 1 WHERE id = ?",
+                    (RUNNING, now, now + self.lease, row["id"]),
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        if row is None:
+            return None
+        job = dict(row)
+        job.update(status=RUNNING, started_at=now, attempts=job["attempts"] + 1)
+        return job
+
+    def finish(self, job_id, status, result):
+        self._connect().execute(
+            "UPDATE jobs SET status = ?, result = ?, finished_at = ?, payload = NULL WHERE id = ? AND status = ?",
+            (status, result, time.time(), job_id, RUNNING),
+        )
+        with self.cond:
+            self.cond.notify_all()
+
+    def _get(self, job_id):
+        row = self._connect().execute(
+            "SELECT id, task, status, result, created_at, started_at, finished_at, attempts FROM jobs WHERE id = ?",
+            (job_id,),
+        ).fetchone()
+        if row is None or (row["finished_at"] and row["finished_at"] < time.time() - self.result_ttl):
+            return None
+        return dict(row)
+
+    def get(self, job_id, wait=0):
+        deadline = time.monotonic() + wait
+        while True:
+            job = self._get(job_id)
+            remaining = deadline - time.monotonic()
+            if job is None or job["status"] in FINISHED or remaining <= 0:
+                return job
+            with self.cond:
+                self.cond.wait(min(0.5, remaining))
+
+    def stats(self):
+        rows = self._connect().execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return {"backend": "sqlite", "path": self.path, "maxsize": self.maxsize,
+                "rejected": self.rejected, "jobs": {status: count for status, count in rows}}
+
+
+class JobWorkerPool:
+    """Threads that claim jobs and run them, each with a per-job timeout."""
+
+    def __init__(self, backend, workers=2, timeout=60):
+        self.backend = backend
+        self.workers = workers
+        self.timeout = timeout
+        self.pid = os.getpid()
+        self.stopping = threading.Event()
+        self.threads = []
+        # Tasks run on their own pool so a job that overruns can be abandoned
+        self.executor = ThreadPoolExecutor(max_workers=workers * 2, thread_name_prefix="job-task")
+        # Timed-out tasks still finishing on the executor
+        self.overrunning = 0
+        self.lock = threading.Lock()
+
+    def start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._loop, name=f"job-worker-{i}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        return self
+
+    def stop(self, wait=True):
+        self.stopping.set()
+        if wait:
+            for thread in self.threads:
+                thread.join()
+        self.executor.shutdown(wait=False)
+
+    def _loop(self):
+        while not self.stopping.is_set():
+            if self.overrunning >= self.workers:
+                # The spare task threads are all held by abandoned jobs; a new
+                # job would only wait behind them and time out
+                self.stopping.wait(0.5)
+                continue
+            try:
+                job = self.backend.claim(timeout=1.0)
+            except Exception as e:
+                log_event("job.error", "❌ Could not claim a job: %s", e, level=logging.ERROR)
+                time.sleep(1)
+                continue
+            if job is not None:
+                self.run(job)
+
+    def run(self, job):
+        task = _tasks().get(job["task"])
+        if task is None:
+            self.backend.finish(job["id"], FAILED, f"❌ Unknown job type: {job['task']}")
+            return
+        log_event("job.start", "Running %s job", job["task"], job_id=job["id"], attempt=job["attempts"])
+        deadline = time.monotonic() + self.timeout
+        timed_out = f"❌ Analysis timed out after {self.timeout:g} seconds."
+        future = self.executor.submit(self._call, task, job, deadline)
+        try:
+            result = future.result(timeout=self.timeout)
+            if time.monotonic() >= deadline:
+                # Its Gemini call was cancelled at the deadline
+                status, result = TIMEOUT, timed_out
+            else:
+                status = FAILED if isinstance(result, str) and result.startswith("❌") else DONE
+        except FutureTimeout:
+            # Its Gemini call is cancelled at the same deadline; anything else
+            # it is doing can't be interrupted, so count it until it returns
+            with self.lock:
+                self.overrunning += 1
+            future.add_done_callback(self._overrun_done)
+            status, result = TIMEOUT, timed_out
+        except Exception as e:
+            log_event("job.error", "❌ %s job failed: %s", job["task"], e, level=logging.ERROR, job_id=job["id"])
+            status, result = FAILED, f"❌ Error during image analysis: {str(e)}"
+        self.backend.finish(job["id"], status, result)
+        log_event("job.finish", "Finished %s job: %s", job["task"], status, job_id=job["id"],
+                  queued_ms=round((job["started_at"] - job["created_at"]) * 1000, 1))
+
+    def _overrun_done(self, future):
+        with self.lock:
+            self.overrunning -= 1
+
+    @staticmethod
+    def _call(task, job, deadline):
+        current_endpoint.set(f"job_{job['task']}")
+        call_deadline.set(deadline)
+        return task(job["payload"])
+
+
+_queue = None
+_pool = None
+_queue_lock = threading.Lock()
+
+
+def get_job_backend():
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            if JOB_BACKEND == "sqlite":
+                try:
+                    _queue = SQLiteJobBackend(JOB_DB, JOB_QUEUE_MAXSIZE, JOB_RESULT_TTL,
+                                              lease=JOB_TIMEOUT + 30, max_attempts=JOB_MAX_ATTEMPTS)
+                except sqlite3.Error as e:
+                    # Read-only filesystems; only correct with a single web process
+                    log_event("job.backend", "⚠️ Job queue unavailable at %s (%s), using memory.", JOB_DB, e,
+                              level=logging.WARNING)
+            if _queue is None:
+                _queue = MemoryJobBackend(JOB_QUEUE_MAXSIZE, JOB_RESULT_TTL)
+        return _queue
+
+
+def _ensure_workers():
+    """Start the in-process workers on first use (and again in a forked worker)."""
+    global _pool
+    if JOB_WORKERS <= 0:
+        return
+    with _queue_lock:
+        if _pool is None or _pool.pid != os.getpid():
+            _pool = JobWorkerPool(_queue, JOB_WORKERS, JOB_TIMEOUT).start()
+
+
+def submit_job(task, payload):
+    """Queue `task` on `payload` (image bytes); returns the public job. Raises QueueFull."""
+    backend = get_job_backend()
+    job = backend.enqueue(task, payload)
+    _ensure_workers()
+    log_event("job.queued", "Queued %s job", task, job_id=job["id"])
+    return public_job(job)
+
+
+def get_job(job_id, wait=0):
+    job = get_job_backend().get(job_id, wait=min(max(wait, 0), JOB_WAIT_MAX))
+    return public_job(job) if job else None
+
+
+def get_job_stats():
+    stats = get_job_backend().stats()
+    stats["workers"] = JOB_WORKERS
+    stats["overrunning"] = _pool.overrunning if _pool else 0
+    return stats
+
+
+def run_worker(workers=None):
+    """Run a standalone worker pool until interrupted (see worker.py)."""
+    if not isinstance(get_job_backend(), SQLiteJobBackend):
+        raise RuntimeError("A standalone worker needs a shared queue: set JOB_BACKEND=sqlite.")
+    pool = JobWorkerPool(get_job_backend(), workers or max(JOB_WORKERS, 1), JOB_TIMEOUT).start()
+    log_event("job.worker", "👷 Job worker started with %s threads on %s", pool.workers, JOB_DB)
+    signal.signal(signal.SIGTERM, lambda *_: pool.stopping.set())
+    try:
+        while not pool.stopping.wait(1):
+            pass
+    except KeyboardInterrupt:
+        pass
+    log_event("job.worker", "👷 Job worker stopping, finishing running jobs...")
+    pool.stop()
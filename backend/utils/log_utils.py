@@ -0,0 +1,195 @@
+import atexit
+import hashlib
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+
+
+# ---------------------------
+# Structured, sampled logging
+# ---------------------------
+#
+# Request threads only put records on a queue; a listener thread formats
+# them and does the I/O, so a slow log sink never adds request latency.
+#
+# `log_event` is the hot-path entry point:
+# - the level check and sampling happen before anything is formatted
+# - messages use %-style args, interpolated only for records that are kept
+# - every record carries an event name plus key=value fields
+# Patient-supplied text and image payloads go through `redact_text` /
+# `describe_payload`, which log sizes and a short hash instead of content.
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_LEVEL_SET = "LOG_LEVEL" in os.environ
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")           # "text" or "json"
+LOG_REDACT = os.getenv("LOG_REDACT", "true").lower() != "false"
+
+# Fraction of INFO/DEBUG records kept per event; warnings and errors are never sampled.
+DEFAULT_SAMPLE_RATES = {
+    "api.call": 0.1,
+    "api.request": 0.1,
+    "cache.hit": 0.05,
+    "gemini.prompt": 0.1,
+    "gemini.response": 0.1,
+    "image.preprocessed": 0.1,
+}
+
+
+def _parse_rates(text):
+    # "api.call=0.5,cache.hit=0" -> {"api.call": 0.5, "cache.hit": 0.0}
+    rates = {}
+    for item in filter(None, (part.strip() for part in (text or "").split(","))):
+        name, _, value = item.partition("=")
+        try:
+            rates[name.strip()] = float(value)
+        except ValueError:
+            continue
+    return rates
+
+
+SAMPLE_RATES = {**DEFAULT_SAMPLE_RATES, **_parse_rates(os.getenv("LOG_SAMPLE_RATES"))}
+
+logger = logging.getLogger("medimate")
+
+
+def sample_rate(event):
+    return SAMPLE_RATES.get(event, 1.0)
+
+
+def log_event(event, msg, *args, level=logging.INFO, exc_info=None, **fields):
+    """Log `msg % args` under `event` with structured fields, subject to level and sampling."""
+    if not logger.isEnabledFor(level):
+        return
+    rate = 1.0
+    if level < logging.WARNING:
+        rate = sample_rate(event)
+        if rate <= 0 or (rate < 1 and random.random() >= rate):
+            return
+        if rate < 1:
+            fields["sample_rate"] = rate
+    logger.log(level, msg, *args, exc_info=exc_info, extra={"event": event, "fields": fields})
+
+
+def redact_text(text):
+    """Patient-supplied text -> its length and a short hash (or a truncated copy when LOG_REDACT=false)."""
+    if text is None:
+        return None
+    text = str(text)
+    if not LOG_REDACT:
+        return text if len(text) <= 200 else text[:200] + "…"
+    digest = hashlib.blake2b(text.encode("utf-8"), digest_size=4).hexdigest()
+    return f"<{len(text)} chars #{digest}>"
+
+
+def describe_payload(data):
+    """Summarize a request body (JSON dict or form) without logging its values."""
+    if not data:
+        return {}
+    summary = {}
+    for key, value in data.items():
+        if isinstance(value, str):
+            summary[key] = f"<{len(value)} chars>"
+        elif isinstance(value, (list, tuple)):
+            summary[key] = f"<{len(value)} items>"
+        else:
+            summary[key] = type(value).__name__
+    return summary
+
+
+# ---------------------------
+# Formatting & queue plumbing
+# ---------------------------
+
+class StructuredFormatter(logging.Formatter):
+    def __init__(self, json_lines=False):
+        super().__init__("%(asctime)s [%(levelname)s] %(message)s")
+        self.json_lines = json_lines
+
+    def format(self, record):
+        fields = getattr(record, "fields", None) or {}
+        event = getattr(record, "event", None)
+        if self.json_lines:
+            data = {
+                "ts": round(record.created, 3),
+                "level": record.levelname,
+                "logger": record.name,
+                "event": event,
+                "message": record.getMessage(),
+                **fields,
+            }
+            if record.exc_info or record.exc_text:
+                data["exc"] = record.exc_text or self.formatException(record.exc_info)
+            return json.dumps(data, default=str, ensure_ascii=False)
+        line = super().format(record)
+        if event:
+            extras = " ".join(f"{key}={value}" for key, value in fields.items())
+            # Fields go on the first line, ahead of any traceback
+            head, sep, tail = line.partition("\n")
+            line = f"{head} | event={event}" + (f" {extras}" if extras else "") + sep + tail
+        return line
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """Enqueue records with minimal work on the calling thread; the listener does the formatting."""
+
+    def prepare(self, record):
+        # Interpolate now (args may be mutated after we return) and capture
+        # the traceback text, but leave timestamps and layout to the listener.
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+_listener = None
+_setup_lock = threading.Lock()
+
+
+def setup_logging(level=None):
+    """Route the root logger through a queue; safe to call more than once."""
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            return _listener
+        root = logging.getLogger()
+        # A root logger someone already configured (gunicorn, tests) keeps its
+        # level unless LOG_LEVEL or the caller asks for another one
+        if level or LOG_LEVEL_SET or not root.handlers:
+            root.setLevel(level or LOG_LEVEL)
+
+        # Keep handlers someone already installed (gunicorn, tests), otherwise log to stderr
+        handlers = [h for h in root.handlers if not isinstance(h, logging.handlers.QueueHandler)]
+        if not handlers:
+            handlers = [logging.StreamHandler(sys.stderr)]
+        formatter = StructuredFormatter(json_lines=LOG_FORMAT == "json")
+        for handler in handlers:
+            handler.setFormatter(formatter)
+
+        queue_handler = NonBlockingQueueHandler(queue.SimpleQueue())
+        root.handlers = [queue_handler]
+        _listener = _start_listener(queue_handler, handlers)
+        atexit.register(lambda: _listener.stop())
+
+        if hasattr(os, "register_at_fork"):
+            # The listener thread doesn't survive a fork (gunicorn --preload); give each worker its own
+            os.register_at_fork(after_in_child=lambda: _restart_listener(queue_handler, handlers))
+        return _listener
+
+
+def _start_listener(queue_handler, handlers):
+    listener = logging.handlers.QueueListener(queue_handler.queue, *handlers, respect_handler_level=True)
+    listener.start()
+    return listener
+
+
+def _restart_listener(queue_handler, handlers):
+    global _listener
+    queue_handler.queue = queue.SimpleQueue()
+    _listener = _start_listener(queue_handler, handlers)
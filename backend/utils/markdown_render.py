@@ -0,0 +1,82 @@
+import hashlib
+import os
+import threading
+
+import markdown
+from cachetools import LRUCache
+
+from .metrics import span
+
+
+# ---------------------------
+# Markdown rendering cache
+# ---------------------------
+#
+# Building a Markdown instance loads the `extra` and `fenced_code` extension
+# pipeline, so each thread keeps one and resets it between documents. The
+# final HTML is cached by a hash of the source text, so cached drug summaries
+# (and repeated AI answers) are rendered once.
+
+MARKDOWN_EXTENSIONS = ['extra', 'fenced_code']
+
+html_cache = LRUCache(maxsize=int(os.getenv("RENDER_CACHE_MAXSIZE", "512")))
+html_cache_lock = threading.Lock()
+render_stats = {"hits": 0, "misses": 0}
+_local = threading.local()
+
+
+def _get_markdown():
+    md = getattr(_local, "md", None)
+    if md is None:
+        md = markdown.Markdown(extensions=MARKDOWN_EXTENSIONS)
+        _local.md = md
+    return md
+
+
+def content_key(text):
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def _render(text):
+    body = _get_markdown().reset().convert(text)
+    # Wrap in a styled div for better presentation
+    return f'<div class="markdown-content">{body}</div>'
+
+
+def render_partial_markdown(text):
+    """
+    Render the completed blocks of a markdown document that is still streaming in.
+    Returns None until at least one block is complete. Not cached: partial
+    documents are never requested twice.
+    """
+    cut = text.rfind("\n\n")
+    if cut == -1:
+        return None
+    prefix = text[:cut]
+    if prefix.count("```") % 2:
+        # Inside an unfinished fenced code block
+        return None
+    with span("render"):
+        return _render(prefix)
+
+
+def render_markdown(text):
+    """Return the wrapped HTML for `text`, rendering it at most once per distinct content."""
+    key = content_key(text)
+    with html_cache_lock:
+        html = html_cache.get(key)
+        if html is not None:
+            render_stats["hits"] += 1
+            return html
+        render_stats["misses"] += 1
+
+    with span("render"):
+        html = _render(text)
+    with html_cache_lock:
+        html_cache[key] = html
+    return html
+
+
+def get_render_stats():
+    with html_cache_lock:
+        return dict(render_stats, size=len(html_cache), maxsize=html_cache.maxsize)
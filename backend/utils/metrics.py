@@ -0,0 +1,181 @@
+import bisect
+import contextvars
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+
+# ---------------------------
+# Metrics & per-stage timing
+# ---------------------------
+#
+# Counters and histograms live in process memory and are served at /metrics
+# in the Prometheus text exposition format. `span(stage)` times one stage of
+# a request (decode, preprocess, prompt build, upstream attempt, render, cache
+# lookup...). The endpoint label comes from a context variable set when the
+# request starts, so helpers deep in gemini_utils don't need to be told who
+# called them; the engine loop inherits it through run_coroutine_threadsafe.
+#
+# A request can also be traced (header `X-Trace: 1`, or a random sample of
+# METRICS_TRACE_SAMPLE): its spans are then collected and sent back in a
+# Server-Timing response header.
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+METRICS_TRACE_SAMPLE = float(os.getenv("METRICS_TRACE_SAMPLE", "0"))
+
+current_endpoint = contextvars.ContextVar("current_endpoint", default="background")
+current_trace = contextvars.ContextVar("current_trace", default=None)
+
+registry = []
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=""):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.label_names = labels
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def collect(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        with self.lock:
+            values = list(self.values.items())
+        for label_values, value in values:
+            yield f"{self.name}{_labels(self.label_names, label_values)} {value}"
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label_names = labels
+        self.buckets = tuple(buckets)
+        # label values -> [per-bucket counts (last one is +Inf), sum, count]
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(label_values)
+            if series is None:
+                series = self.series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def collect(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        with self.lock:
+            series = [(labels, list(counts), total, count) for labels, (counts, total, count) in self.series.items()]
+        for label_values, counts, total, count in series:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += bucket_count
+                le = f'le="{bound}"'
+                yield f"{self.name}_bucket{_labels(self.label_names, label_values, le)} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.label_names, label_values)} {total}"
+            yield f"{self.name}_count{_labels(self.label_names, label_values)} {count}"
+
+
+def counter(name, help, labels=()):
+    metric = Counter(name, help, labels)
+    registry.append(metric)
+    return metric
+
+
+def histogram(name, help, labels=(), buckets=DEFAULT_BUCKETS):
+    metric = Histogram(name, help, labels, buckets)
+    registry.append(metric)
+    return metric
+
+
+REQUESTS = counter("medimate_requests_total", "HTTP requests by endpoint and status code.", ("endpoint", "status"))
+REQUEST_SECONDS = histogram("medimate_request_seconds", "Time until the response is returned.", ("endpoint",))
+STAGE_SECONDS = histogram("medimate_stage_seconds", "Time spent in each stage of a request.", ("endpoint", "stage"))
+UPSTREAM_ATTEMPTS = counter(
+    "medimate_upstream_attempts_total", "Gemini attempts by outcome.", ("endpoint", "outcome")
+)
+CACHE_LOOKUPS = counter("medimate_cache_lookups_total", "Cache lookups by cache and result.", ("endpoint", "cache", "result"))
+ADMISSIONS = counter(
+    "medimate_admission_total", "Admission decisions by feature, priority lane and outcome.", ("feature", "lane", "outcome")
+)
+
+
+@contextmanager
+def span(stage):
+    """Time the enclosed block as `stage` of the current request."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - start)
+
+
+def record_stage(stage, seconds):
+    STAGE_SECONDS.observe(seconds, current_endpoint.get(), stage)
+    trace = current_trace.get()
+    if trace is not None:
+        trace.append((stage, seconds))
+
+
+def count_upstream(outcome):
+    UPSTREAM_ATTEMPTS.inc(current_endpoint.get(), outcome)
+
+
+def count_cache(cache, hit):
+    CACHE_LOOKUPS.inc(current_endpoint.get(), cache, "hit" if hit else "miss")
+
+
+def count_admission(feature, lane, outcome):
+    ADMISSIONS.inc(feature, lane, outcome)
+
+
+def start_request(endpoint, trace_header=None):
+    """Label everything recorded in this context with `endpoint`; returns True if the request is traced."""
+    current_endpoint.set(endpoint)
+    traced = trace_header in ("1", "true") or (METRICS_TRACE_SAMPLE > 0 and random.random() < METRICS_TRACE_SAMPLE)
+    current_trace.set([] if traced else None)
+    return traced
+
+
+def finish_request(endpoint, status, seconds):
+    REQUESTS.inc(endpoint, status)
+    REQUEST_SECONDS.observe(seconds, endpoint)
+
+
+def server_timing(total_seconds):
+    """Server-Timing header value for a traced request, or None."""
+    trace = current_trace.get()
+    if trace is None:
+        return None
+    entries = [f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in trace]
+    entries.append(f"total;dur={total_seconds * 1000:.1f}")
+    return ", ".join(entries)
+
+
+def render_metrics():
+    lines = []
+    for metric in registry:
+        lines.extend(metric.collect())
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,57 @@
+import os
+import threading
+
+
+# ---------------------------
+# Lazy Gemini model registry
+# ---------------------------
+#
+# Importing google.generativeai (grpc, protobuf, google-auth...) is the
+# slowest part of starting the app, and serverless cold starts pay for it on
+# the first request. The SDK is imported, configured and each model built
+# only when a model is first asked for; after that every caller in the
+# process shares the same instance.
+#
+# Long-running servers can set GEMINI_PRELOAD=true to load the default model
+# in a background thread at startup instead.
+
+DEFAULT_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.5-flash")
+GEMINI_PRELOAD = os.getenv("GEMINI_PRELOAD", "false").lower() == "true"
+
+_genai = None
+_models = {}
+_lock = threading.Lock()
+
+
+def _sdk():
+    # Caller holds the lock
+    global _genai
+    if _genai is None:
+        import google.generativeai as genai
+
+        genai.configure(api_key=os.getenv("GEMINI_KEY"))
+        _genai = genai
+    return _genai
+
+
+def get_model(name=DEFAULT_MODEL):
+    """Return the shared GenerativeModel for `name`, creating it on first use."""
+    model = _models.get(name)
+    if model is not None:
+        return model
+    with _lock:
+        model = _models.get(name)
+        if model is None:
+            model = _models[name] = _sdk().GenerativeModel(name)
+        return model
+
+
+def loaded_models():
+    return sorted(_models)
+
+
+def preload(name=DEFAULT_MODEL):
+    """Build `name` in a background thread so the first request doesn't wait for the SDK import."""
+    thread = threading.Thread(target=get_model, args=(name,), name="gemini-preload", daemon=True)
+    thread.start()
+    return thread
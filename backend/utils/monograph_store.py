@@ -0,0 +1,146 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from .drug_sections import missing_sections, parse_drug_sections
+from .metrics import count_cache, span
+
+
+# ---------------------------
+# Precomputed drug monographs
+# ---------------------------
+#
+# The most requested drugs are generated offline (`flask monographs build`),
+# validated section by section and written to a small SQLite file. At
+# request time the whole file is held in a dict, so a lookup is O(1) and
+# only long-tail drugs go to Gemini.
+#
+# Builds write to a temporary file and atomically replace the live one; the
+# request path notices the new file and reloads it, so content can be
+# rebuilt without downtime. Every build carries a version stamp.
+
+DEFAULT_MONOGRAPH_DB = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "monographs.sqlite3")
+MONOGRAPH_DB = os.getenv("MONOGRAPH_DB", DEFAULT_MONOGRAPH_DB)
+# How often (seconds) the request path checks whether the file was rebuilt
+MONOGRAPH_RELOAD_INTERVAL = float(os.getenv("MONOGRAPH_RELOAD_INTERVAL", "30"))
+
+
+class MonographStore:
+    def __init__(self, path):
+        self.path = path
+        self.monographs = {}
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self._file_id = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def _stat(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def _maybe_reload(self):
+        now = time.monotonic()
+        if now - self._checked_at < MONOGRAPH_RELOAD_INTERVAL and self._checked_at:
+            return
+        self._checked_at = now
+        file_id = self._stat()
+        if file_id == self._file_id:
+            return
+        monographs, version = {}, None
+        if file_id is not None:
+            try:
+                monographs, version = read_monographs(self.path)
+                logging.info(f"📚 Loaded {len(monographs)} drug monographs (version {version})")
+            except sqlite3.Error as e:
+                logging.error(f"❌ Could not load monographs from {self.path}: {e}")
+                return
+        self.monographs, self.version, self._file_id = monographs, version, file_id
+
+    def get(self, drug_id):
+        """Return {"name", "sections"} for a canonical drug ID, or None."""
+        with span("cache_lookup"), self._lock:
+            self._maybe_reload()
+            monograph = self.monographs.get(drug_id)
+            if monograph is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        count_cache("monograph", monograph is not None)
+        return monograph
+
+    def stats(self):
+        with self._lock:
+            return {
+                "path": self.path,
+                "version": self.version,
+                "size": len(self.monographs),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+def read_monographs(path):
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        rows = conn.execute("SELECT drug_id, name, sections FROM monographs").fetchall()
+        version = conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+    finally:
+        conn.close()
+    monographs = {drug_id: {"name": name, "sections": json.loads(sections)} for drug_id, name, sections in rows}
+    return monographs, version[0] if version else None
+
+
+def validate_monograph(text):
+    """Parse a generated drug summary; returns (sections, list of problems)."""
+    sections = parse_drug_sections(text or "")
+    problems = [f"missing section: {key}" for key in missing_sections(sections)]
+    return sections, problems
+
+
+def write_monographs(path, monographs, version):
+    """
+    Atomically replace the store at `path`.
+    `monographs` is a list of (drug_id, name, sections) tuples.
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    conn = sqlite3.connect(tmp_path)
+    try:
+        conn.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        conn.execute(
+            "CREATE TABLE monographs ("
+            " drug_id TEXT PRIMARY KEY,"
+            " name TEXT NOT NULL,"
+            " sections TEXT NOT NULL,"
+            " built_at REAL NOT NULL)"
+        )
+        now = time.time()
+        conn.executemany(
+            "INSERT OR REPLACE INTO monographs VALUES (?, ?, ?, ?)",
+            [(drug_id, name, json.dumps(sections), now) for drug_id, name, sections in monographs],
+        )
+        conn.executemany(
+            "INSERT INTO meta VALUES (?, ?)",
+            [("version", version), ("built_at", str(now)), ("count", str(len(monographs)))],
+        )
+        conn.commit()
+    finally:
+        conn.close()
+    os.replace(tmp_path, path)
+
+
+monograph_store = MonographStore(MONOGRAPH_DB)
+
+
+def get_monograph(drug_id):
+    return monograph_store.get(drug_id)
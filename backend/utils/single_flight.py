@@ -0,0 +1,82 @@
+import functools
+import threading
+from concurrent.futures import Future
+
+
+# ---------------------------
+# Request coalescing
+# ---------------------------
+#
+# When many requests ask for the same thing at once, only the first one
+# (the "leader") calls Gemini. Everyone else waits on the leader's future
+# and gets the same result.
+
+class SingleFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self.calls = 0
+        self.deduplicated = 0
+
+    def do(self, key, fn, *args, **kwargs):
+        with self._lock:
+            self.calls += 1
+            future = self._inflight.get(key)
+            if future is not None:
+                self.deduplicated += 1
+                leader = False
+            else:
+                future = Future()
+                self._inflight[key] = future
+                leader = True
+
+        if not leader:
+            return future.result()
+
+        try:
+            result = fn(*args, **kwargs)
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "deduplicated": self.deduplicated,
+                "inflight": len(self._inflight),
+            }
+
+
+gemini_flight = SingleFlight()
+
+
+def normalize_arg(value):
+    """Normalize free-text arguments so trivially different inputs share a key."""
+    if isinstance(value, str):
+        return " ".join(value.lower().split())
+    if isinstance(value, (list, tuple)):
+        return tuple(normalize_arg(v) for v in value)
+    return value
+
+
+def coalesce(fn):
+    """Decorator: concurrent calls with the same (function, normalized args) share one upstream call."""
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        key = (
+            fn.__name__,
+            tuple(normalize_arg(a) for a in args),
+            tuple(sorted((k, normalize_arg(v)) for k, v in kwargs.items())),
+        )
+        return gemini_flight.do(key, fn, *args, **kwargs)
+    return wrapper
+
+
+def get_single_flight_stats():
+    return gemini_flight.stats()
@@ -0,0 +1,310 @@
+import os
+import re
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+from .metrics import count_cache, span
+
+
+# ---------------------------
+# Semantic symptom cache
+# ---------------------------
+#
+# "headache and fever", "fever, headache" and "I have a fever + headache" are
+# the same question. Symptom text is canonicalized into a sorted set of
+# normalized symptoms (separators, filler words, plurals and a few synonyms),
+# which is the cache key.
+#
+# Misspellings ("vomitting", "diarhea", "headach") are matched one symptom
+# at a time against a vocabulary of symptoms already seen: each symptom is
+# embedded with a hashing vectorizer (character trigrams hashed into
+# SYMPTOM_CACHE_DIM signed buckets) and mapped to its nearest known symptom
+# when the cosine similarity is at least SYMPTOM_CACHE_THRESHOLD. Matching
+# per symptom rather than on the whole query keeps different symptoms apart
+# no matter how many other symptoms the two queries share. A doubled letter
+# ("vomitting") scores ~0.85; a dropped letter in a short word can score
+# ~0.8 and is left to Gemini rather than risk a wrong match.
+#
+# Only purely alphabetic symptom terms are matched this way. Trigrams see
+# "fever for 2 days" and "fever for 20 days", or "chest pain" and "no chest
+# pain", as near-identical, so symptoms with digits, negations or durations
+# must match exactly and are never added to the vocabulary. The same goes
+# for terms with an opposite-meaning prefix: hypo-/hyperglycemia score
+# ~0.72 but hypo-/hypernatremia ~0.80, and brady-/tachy-, micro-/macro-
+# pairs differ in one short prefix too.
+#
+# The vocabulary is one float32 matrix allocated on the first add, so its
+# memory is fixed; every unknown symptom in a lookup is resolved with a single
+# matrix product, and the least recently used row is overwritten when it is
+# full. NumPy is only imported on first use to keep it out of cold starts.
+
+SYMPTOM_CACHE_MAXSIZE = int(os.getenv("SYMPTOM_CACHE_MAXSIZE", "5000"))
+SYMPTOM_VOCAB_MAXSIZE = int(os.getenv("SYMPTOM_VOCAB_MAXSIZE", "5000"))
+SYMPTOM_CACHE_DIM = int(os.getenv("SYMPTOM_CACHE_DIM", "512"))
+SYMPTOM_CACHE_THRESHOLD = float(os.getenv("SYMPTOM_CACHE_THRESHOLD", "0.85"))
+SYMPTOM_CACHE_TTL = int(os.getenv("SYMPTOM_CACHE_TTL", "86400"))
+
+SEPARATORS = re.compile(r"\s*(?:[,;+&/\n]|\band\b|\bwith\b|\bplus\b|\balso\b)\s*")
+FILLER = re.compile(
+    r"^(?:i\s+(?:have|had|am|feel|get|got)|i've\s+got|i've|i'm|ive|im|feeling|having|experiencing|"
+    r"suffering\s+from|got|some|a\s+bit\s+of|a|an|the|my)\s+"
+)
+SYNONYMS = {
+    "temperature": "fever",
+    "high temperature": "fever",
+    "pyrexia": "fever",
+    "head ache": "headache",
+    "head pain": "headache",
+    "tummy ache": "stomach ache",
+    "stomachache": "stomach ache",
+    "belly ache": "stomach ache",
+    "throwing up": "vomiting",
+    "vomit": "vomiting",
+    "runny nose": "rhinorrhea",
+    "running nose": "rhinorrhea",
+    "loose motion": "diarrhea",
+    "diarrhoea": "diarrhea",
+    "coughing": "cough",
+    "tiredness": "fatigue",
+    "tired": "fatigue",
+}
+
+
+# Words whose presence changes the meaning more than the spelling similarity shows
+EXACT_WORDS = re.compile(
+    r"\b(?:no|not|non|without|never|denie[sd]|deny|negative|absent|free|"
+    r"for|since|ago|past|last|over|"
+    r"seconds?|minutes?|mins?|hours?|hrs?|days?|nights?|weeks?|wks?|months?|years?|yrs?|"
+    r"once|twice|daily|weekly|"
+    r"one|two|three|four|five|six|seven|eight|nine|ten|twelve|twenty|thirty|several|few)\b"
+    # Prefixes with an opposite: "hypernatremia" is one letter away from "hyponatremia"
+    r"|\b(?:hypo|hyper|brady|tachy|micro|macro|oligo|poly)"
+)
+
+
+def fuzzy_matchable(symptom):
+    """True for purely alphabetic symptom terms; digits, negations, durations and hypo-/hyper- style prefixes must match exactly."""
+    return symptom.replace(" ", "").isalpha() and not EXACT_WORDS.search(symptom)
+
+
+def _singular(word):
+    if len(word) > 4 and word.endswith("s") and not word.endswith(("ss", "us", "is")):
+        return word[:-1]
+    return word
+
+
+def canonical_symptoms(text):
+    """'I have a fever + headaches' -> ('fever', 'headache')."""
+    symptoms = set()
+    for part in SEPARATORS.split((text or "").lower()):
+        part = re.sub(r"[^a-z0-9' ]+", " ", part)
+        previous = None
+        while part != previous:
+            previous, part = part, FILLER.sub("", part.strip())
+        part = " ".join(_singular(word) for word in part.split())
+        part = SYNONYMS.get(part, part)
+        if part:
+            symptoms.add(part)
+    return tuple(sorted(symptoms))
+
+
+def embed(symptoms, dim=SYMPTOM_CACHE_DIM):
+    """One unit row per symptom: signed hashing of its character trigrams."""
+    import numpy as np
+
+    vectors = np.zeros((len(symptoms), dim), dtype=np.float32)
+    for row, symptom in enumerate(symptoms):
+        padded = f" {symptom} "
+        hashes = np.fromiter(
+            (zlib.crc32(padded[i:i + 3].encode("utf-8")) for i in range(len(padded) - 2)),
+            dtype=np.uint32,
+        )
+        signs = np.where(hashes & 0x80000000, -1.0, 1.0).astype(np.float32)
+        np.add.at(vectors[row], hashes % dim, signs)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+class SymptomVocabulary:
+    """Bounded LRU matrix of known symptoms for nearest-neighbour spelling matches."""
+
+    def __init__(self, maxsize=5000, dim=512, threshold=0.85):
+        self.maxsize = maxsize
+        self.dim = dim
+        self.threshold = threshold
+        self.vectors = None  # allocated on first add()
+        self.used = None
+        self.names = [None] * maxsize
+        self.rows = {}
+        self.size = 0
+        self.tick = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def resolve(self, symptoms):
+        """Map each symptom to itself if known, else its nearest known symptom above the threshold."""
+        with self.lock:
+            unknown = []
+            for symptom in set(symptoms):
+                row = self.rows.get(symptom)
+                if row is None:
+                    if fuzzy_matchable(symptom):
+                        unknown.append(symptom)
+                else:
+                    self.tick += 1
+                    self.used[row] = self.tick
+            size = self.size
+        if not unknown or not size:
+            return {s: s for s in symptoms}
+        queries = embed(unknown, self.dim)
+        with self.lock:
+            # Rows may have been overwritten while the lock was released
+            size = self.size
+            scores = queries @ self.vectors[:size].T
+            best = scores.argmax(axis=1)
+            mapping = {}
+            for n, (symptom, row) in enumerate(zip(unknown, best)):
+                if scores[n, row] >= self.threshold:
+                    self.tick += 1
+                    self.used[row] = self.tick
+                    mapping[symptom] = self.names[row]
+        return {s: mapping.get(s, s) for s in symptoms}
+
+    def add(self, symptoms):
+        new = [s for s in symptoms if s not in self.rows and fuzzy_matchable(s)]
+        vectors = embed(new, self.dim) if new else []
+        with self.lock:
+            if self.vectors is None and new:
+                import numpy as np
+
+                self.vectors = np.zeros((self.maxsize, self.dim), dtype=np.float32)
+                self.used = np.zeros(self.maxsize, dtype=np.int64)
+            for symptom, vector in zip(new, vectors):
+                if symptom in self.rows:
+                    continue
+                if self.size < self.maxsize:
+                    row = self.size
+                    self.size += 1
+                else:
+                    row = int(self.used[:self.size].argmin())
+                    del self.rows[self.names[row]]
+                    self.evictions += 1
+                self.rows[symptom] = row
+                self.names[row] = symptom
+                self.vectors[row] = vector
+            for symptom in symptoms:
+                row = self.rows.get(symptom)
+                if row is not None:
+                    self.tick += 1
+                    self.used[row] = self.tick
+
+    def clear(self):
+        with self.lock:
+            if self.vectors is not None:
+                self.vectors[:] = 0
+                self.used[:] = 0
+            self.names = [None] * self.maxsize
+            self.rows.clear()
+            self.size = 0
+
+
+class SemanticCache:
+    """Bounded LRU cache keyed by canonical symptom set, tolerant of misspelt symptoms."""
+
+    def __init__(self, name, maxsize=5000, ttl=86400, vocabulary=None):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.vocabulary = vocabulary or SymptomVocabulary()
+        self.entries = OrderedDict()
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def _lookup(self, key):
+        # Caller holds the lock
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        value, created = entry
+        if time.time() - created > self.ttl:
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return value
+
+    def get(self, text):
+        return self.get_many([text])[0]
+
+    def get_many(self, texts):
+        """Look up several queries, resolving all their unknown symptoms in one batch."""
+        with span("cache_lookup"):
+            keys = [canonical_symptoms(text) for text in texts]
+            results = [None] * len(keys)
+            with self.lock:
+                pending = []
+                for i, key in enumerate(keys):
+                    results[i] = self._lookup(key) if key else None
+                    if results[i] is not None:
+                        self.exact_hits += 1
+                    elif key:
+                        pending.append(i)
+            if pending:
+                mapping = self.vocabulary.resolve({s for i in pending for s in keys[i]})
+                with self.lock:
+                    for i in pending:
+                        resolved = tuple(sorted({mapping[s] for s in keys[i]}))
+                        if resolved != keys[i]:
+                            results[i] = self._lookup(resolved)
+                            if results[i] is not None:
+                                self.semantic_hits += 1
+            with self.lock:
+                self.misses += sum(result is None for result in results)
+        for result in results:
+            count_cache(f"symptom_{self.name}", result is not None)
+        return results
+
+    def set(self, text, value):
+        key = canonical_symptoms(text)
+        if not key:
+            return
+        # Store under the spellings already in the vocabulary so variants converge on one entry
+        mapping = self.vocabulary.resolve(key)
+        key = tuple(sorted({mapping[s] for s in key}))
+        self.vocabulary.add(key)
+        with self.lock:
+            self.entries[key] = (value, time.time())
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+        self.vocabulary.clear()
+
+    def stats(self):
+        with self.lock:
+            return {
+                "name": self.name,
+                "size": len(self.entries),
+                "maxsize": self.maxsize,
+                "vocabulary": self.vocabulary.size,
+                "vocabulary_evictions": self.vocabulary.evictions,
+                "threshold": self.vocabulary.threshold,
+                "hits": self.exact_hits + self.semantic_hits,
+                "exact_hits": self.exact_hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+            }
+
+
+symptom_cache = SemanticCache(
+    "recommendation",
+    SYMPTOM_CACHE_MAXSIZE,
+    SYMPTOM_CACHE_TTL,
+    SymptomVocabulary(SYMPTOM_VOCAB_MAXSIZE, SYMPTOM_CACHE_DIM, SYMPTOM_CACHE_THRESHOLD),
+)
@@ -0,0 +1,315 @@
+"""
+Offline load test for the /api endpoints.
+
+Gemini is replaced by benchmarks/mock_gemini.py, so runs need no network or
+API key and are repeatable. Each (endpoint, concurrency) pair is driven with
+the Flask test client from a thread pool; results are printed and can be
+written as JSON and compared against an earlier run:
+
+    python benchmarks/bench_api.py --output before.json
+    python benchmarks/bench_api.py --compare before.json --output after.json
+"""
+import argparse
+import base64
+import io
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks import mock_gemini  # noqa: E402
+
+ENDPOINTS = ["drug_info", "symptoms", "compare", "allergy", "image", "prescription"]
+
+SYMPTOMS = [
+    "headache and fever",
+    "dry cough, sore throat",
+    "stomach ache after meals",
+    "runny nose and sneezing",
+    "back pain",
+    "fatigue, dizziness",
+    "skin rash and itching",
+    "nausea and vomiting",
+]
+
+ALLERGIES = ["penicillin", "sulfa", "aspirin", "ibuprofen", "codeine", "latex"]
+
+
+# ---------------------------
+# Workload
+# ---------------------------
+
+class Workload:
+    """Request payloads with a Zipf-like skew, so popular drugs repeat like in real traffic."""
+
+    def __init__(self, seed, skew=1.1, images=8):
+        self.random = random.Random(seed)
+        with open(os.path.join(ROOT, "backend", "static", "data", "drug_names.json"), encoding="utf-8") as f:
+            self.drugs = json.load(f)
+        self.weights = [1 / (rank + 1) ** skew for rank in range(len(self.drugs))]
+        self.images = [synthetic_image(i) for i in range(images)]
+        self.lock = threading.Lock()
+
+    def drug(self):
+        return self.random.choices(self.drugs, self.weights)[0]
+
+    def payload(self, endpoint):
+        with self.lock:
+            if endpoint == "drug_info":
+                return "/get_drug_info", {"json": {"drug_name": self.drug()}}
+            if endpoint == "symptoms":
+                return "/symptom_checker", {"json": {"symptoms": self.random.choice(SYMPTOMS)}}
+            if endpoint == "compare":
+                return "/compare_drugs_summary", {"json": {"drug1": self.drug(), "drug2": self.drug()}}
+            if endpoint == "allergy":
+                medicines = ", ".join(self.drug() for _ in range(self.random.randint(1, 3)))
+                return "/allergy_checker", {"json": {"allergies": self.random.choice(ALLERGIES), "medicines": medicines}}
+            image = self.random.choice(self.images)
+            path = "/process-upload" if endpoint == "image" else "/validate-prescription"
+            return path, {"data": {"image_data": image}}
+
+
+def synthetic_image(seed, size=(1200, 900)):
+    """A JPEG data URL with a distinct pattern per seed (so dedupe sees different images)."""
+    from PIL import Image, ImageDraw
+
+    rng = random.Random(seed)
+    image = Image.new("RGB", size, (255, 255, 255))
+    draw = ImageDraw.Draw(image)
+    for _ in range(40):
+        x, y = rng.randrange(size[0]), rng.randrange(size[1])
+        color = tuple(rng.randrange(256) for _ in range(3))
+        draw.rectangle([x, y, x + rng.randrange(50, 300), y + rng.randrange(20, 120)], fill=color)
+    buf = io.BytesIO()
+    image.save(buf, format="JPEG", quality=90)
+    return "data:image/jpeg;base64," + base64.b64encode(buf.getvalue()).decode("ascii")
+
+
+# ---------------------------
+# Measurement
+# ---------------------------
+
+def percentile(samples, pct):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def is_error(response):
+    if response.status_code >= 400:
+        return True
+    body = response.get_json(silent=True) or {}
+    text = body.get("response") or body.get("result") or body.get("summary") or ""
+    return isinstance(text, str) and text.lstrip().startswith(("❌", "<p>❌"))
+
+
+def cache_counters(status):
+    """Flatten the cumulative hit/miss and upstream counters from /status/gemini."""
+    counters = {}
+    for name in ("drug_cache", "pair_cache"):
+        cache = status.get(name, {})
+        counters[f"{name}.hits"] = cache.get("l1_hits", 0) + cache.get("l2", {}).get("hits", 0)
+        counters[f"{name}.misses"] = cache.get("misses", 0)
+    for name in ("render_cache", "monographs", "symptom_cache"):
+        for key in ("hits", "misses"):
+            counters[f"{name}.{key}"] = status.get(name, {}).get(key, 0)
+    for cache in status.get("image_caches", []):
+        for key in ("hits", "misses"):
+            counters[f"image_{cache['name']}.{key}"] = cache.get(key, 0)
+    budget = status.get("retry_budget", {})
+    counters["upstream.calls"] = budget.get("total_calls", 0)
+    counters["upstream.retries"] = budget.get("total_retries", 0)
+    counters["upstream.retry_budget_exhausted"] = budget.get("exhausted", 0)
+    counters["breaker.rejected_calls"] = status.get("breaker", {}).get("rejected_calls", 0)
+    counters["single_flight.deduplicated"] = status.get("single_flight", {}).get("deduplicated", 0)
+    return counters
+
+
+def hit_rates(delta):
+    rates = {}
+    for key, hits in delta.items():
+        if key.endswith(".hits"):
+            prefix = key[:-len(".hits")]
+            total = hits + delta.get(f"{prefix}.misses", 0)
+            if total:
+                rates[prefix] = round(hits / total, 4)
+    return rates
+
+
+def run_level(client, workload, endpoint, concurrency, requests):
+    status_before = client.get("/status/gemini").get_json()
+    mock_before = mock_gemini.stats.snapshot()
+    latencies, errors = [], 0
+    lock = threading.Lock()
+
+    def one(_):
+        nonlocal errors
+        path, kwargs = workload.payload(endpoint)
+        start = time.perf_counter()
+        response = client.post(path, **kwargs)
+        elapsed = (time.perf_counter() - start) * 1000
+        failed = is_error(response)
+        with lock:
+            latencies.append(elapsed)
+            errors += failed
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(one, range(requests)))
+    wall = time.perf_counter() - start
+
+    before = cache_counters(status_before)
+    after = cache_counters(client.get("/status/gemini").get_json())
+    delta = {key: after[key] - before.get(key, 0) for key in after}
+    mock_after = mock_gemini.stats.snapshot()
+
+    return {
+        "endpoint": endpoint,
+        "concurrency": concurrency,
+        "requests": requests,
+        "errors": errors,
+        "wall_s": round(wall, 3),
+        "throughput_rps": round(requests / wall, 2),
+        "latency_ms": {
+            "mean": round(sum(latencies) / len(latencies), 2),
+            "p50": round(percentile(latencies, 50), 2),
+            "p95": round(percentile(latencies, 95), 2),
+            "p99": round(percentile(latencies, 99), 2),
+            "max": round(max(latencies), 2),
+        },
+        "upstream": {
+            "calls": delta["upstream.calls"],
+            "retries": delta["upstream.retries"],
+            "retry_budget_exhausted": delta["upstream.retry_budget_exhausted"],
+            "breaker_rejected": delta["breaker.rejected_calls"],
+            "coalesced": delta["single_flight.deduplicated"],
+            "mock": {key: mock_after[key] - mock_before[key] for key in mock_after},
+        },
+        "cache_hit_rates": hit_rates(delta),
+    }
+
+
+# ---------------------------
+# Reporting
+# ---------------------------
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_header():
+    print(f"{'endpoint':<14}{'conc':>5}{'req':>6}{'err':>5}{'rps':>9}{'p50':>9}{'p95':>9}{'p99':>9}"
+          f"{'calls':>7}{'retry':>7}  hit rates")
+
+
+def print_row(r):
+    lat = r["latency_ms"]
+    rates = ", ".join(f"{k}={v:.0%}" for k, v in r["cache_hit_rates"].items())
+    print(f"{r['endpoint']:<14}{r['concurrency']:>5}{r['requests']:>6}{r['errors']:>5}"
+          f"{r['throughput_rps']:>9.1f}{lat['p50']:>9.1f}{lat['p95']:>9.1f}{lat['p99']:>9.1f}"
+          f"{r['upstream']['calls']:>7}{r['upstream']['retries']:>7}  {rates}")
+
+
+def print_comparison(baseline, results):
+    previous = {(r["endpoint"], r["concurrency"]): r for r in baseline["results"]}
+    print(f"\nCompared with {baseline.get('commit') or 'baseline'}:")
+    print(f"{'endpoint':<14}{'conc':>5}{'rps':>10}{'p50':>10}{'p95':>10}{'p99':>10}")
+
+    def change(new, old):
+        return f"{(new - old) / old:+.1%}" if old else "n/a"
+
+    for r in results:
+        old = previous.get((r["endpoint"], r["concurrency"]))
+        if not old:
+            continue
+        lat, old_lat = r["latency_ms"], old["latency_ms"]
+        print(f"{r['endpoint']:<14}{r['concurrency']:>5}"
+              f"{change(r['throughput_rps'], old['throughput_rps']):>10}"
+              f"{change(lat['p50'], old_lat['p50']):>10}"
+              f"{change(lat['p95'], old_lat['p95']):>10}"
+              f"{change(lat['p99'], old_lat['p99']):>10}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--endpoints", default=",".join(ENDPOINTS), help=f"Comma-separated subset of {ENDPOINTS}.")
+    parser.add_argument("--concurrency", default="1,8,32", help="Comma-separated concurrency levels.")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per endpoint and level.")
+    parser.add_argument("--latency", type=float, default=0.3, help="Mock Gemini latency in seconds.")
+    parser.add_argument("--jitter", type=float, default=0.1, help="Uniform +/- jitter on the latency.")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--timeout-rate", type=float, default=0.0, help="Fraction of calls that hang.")
+    parser.add_argument("--empty-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--warm", action="store_true", help="Keep caches between levels (default: cold per level).")
+    parser.add_argument("--output", help="Write results as JSON to this file.")
+    parser.add_argument("--compare", help="Earlier JSON output to compare against.")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    workdir = tempfile.mkdtemp(prefix="medimate-bench-")
+    os.environ.setdefault("GEMINI_KEY", "benchmark")
+    os.environ["CACHE_DB_PATH"] = os.path.join(workdir, "cache.sqlite3")
+    os.environ["MONOGRAPH_DB"] = os.path.join(workdir, "monographs.sqlite3")
+    # Every simulated request comes from one client; measure the pipeline, not the rate limiter
+    os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+    mock_gemini.config = mock_gemini.MockConfig(
+        latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+        timeout_rate=args.timeout_rate, empty_rate=args.empty_rate, seed=args.seed,
+    )
+    mock_gemini.install()
+
+    from backend import create_app
+    from backend.utils import gemini_utils
+
+    client = create_app().test_client()
+    workload = Workload(args.seed)
+
+    results = []
+    print_header()
+    for endpoint in args.endpoints.split(","):
+        for concurrency in (int(c) for c in args.concurrency.split(",")):
+            if not args.warm:
+                for cache in (gemini_utils.drug_cache, gemini_utils.pair_cache, gemini_utils.drug_extra_cache,
+                              gemini_utils.allergy_cache,
+                              gemini_utils.packaging_image_cache, gemini_utils.prescription_image_cache,
+                              gemini_utils.symptom_cache):
+                    cache.clear()
+            results.append(run_level(client, workload, endpoint, concurrency, args.requests))
+            print_row(results[-1])
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "config": vars(args),
+        "results": results,
+    }
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            print_comparison(json.load(f), results)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nWrote {args.output}")
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""
+Cold-start benchmark: how long a fresh process takes to import and build the
+app, to serve a first page, and to serve its first Gemini-backed request.
+
+Every run is a new interpreter (like a serverless cold start). Gemini is
+replaced by benchmarks/mock_gemini.py, installed as an import hook so the
+SDK is still imported whenever the app itself first imports it.
+
+    python benchmarks/bench_startup.py --runs 10 --output before.json
+    python benchmarks/bench_startup.py --runs 10 --compare before.json
+
+`--root` measures another checkout (e.g. a `git worktree` of an older
+commit) with this script and mock.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+
+
+def child(root):
+    """Runs inside the measured interpreter; prints one JSON line of timings."""
+    sys.path.insert(0, BENCH_DIR)
+    import mock_gemini
+
+    mock_gemini.config = mock_gemini.MockConfig(latency=0, jitter=0)
+    mock_gemini.install(lazy=True)
+
+    started = time.perf_counter()
+    sys.path.insert(0, root)
+    from backend import create_app
+
+    app = create_app()
+    imported = time.perf_counter()
+    sdk_loaded = "google.generativeai" in sys.modules
+
+    client = app.test_client()
+    client.get("/")
+    page = time.perf_counter()
+    client.post("/get_drug_info", json={"drug_name": "Ibuprofen"})
+    first = time.perf_counter()
+    client.post("/get_drug_info", json={"drug_name": "Metformin"})
+    second = time.perf_counter()
+
+    print(json.dumps({
+        "import_ms": round((imported - started) * 1000, 1),
+        "first_page_ms": round((page - imported) * 1000, 1),
+        "first_gemini_request_ms": round((first - page) * 1000, 1),
+        "second_gemini_request_ms": round((second - first) * 1000, 1),
+        "sdk_loaded_at_startup": sdk_loaded,
+    }))
+
+
+def run_once(root):
+    workdir = tempfile.mkdtemp(prefix="medimate-startup-")
+    env = dict(
+        os.environ,
+        GEMINI_KEY="benchmark",
+        CACHE_DB_PATH=os.path.join(workdir, "cache.sqlite3"),
+        MONOGRAPH_DB=os.path.join(workdir, "monographs.sqlite3"),
+        LOG_LEVEL="WARNING",
+        PYTHONWARNINGS="ignore",
+    )
+    started = time.perf_counter()
+    out = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--child", "--root", root],
+        cwd=root, env=env, capture_output=True, text=True, check=True,
+    )
+    timings = json.loads(out.stdout.strip().splitlines()[-1])
+    timings["process_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    return timings
+
+
+def summarize(runs):
+    keys = ["import_ms", "first_page_ms", "first_gemini_request_ms", "second_gemini_request_ms", "process_ms"]
+    return {
+        key: {
+            "median": round(statistics.median(r[key] for r in runs), 1),
+            "min": min(r[key] for r in runs),
+            "max": max(r[key] for r in runs),
+        }
+        for key in keys
+    }
+
+
+def git_commit(root):
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=root, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--root", default=ROOT, help="Checkout to measure (default: this one).")
+    parser.add_argument("--output", help="Write results as JSON to this file.")
+    parser.add_argument("--compare", help="Earlier JSON output to compare against.")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        child(args.root)
+        return None
+
+    root = os.path.abspath(args.root)
+    runs = [run_once(root) for _ in range(args.runs)]
+    summary = summarize(runs)
+    print(f"{'metric':<26}{'median':>10}{'min':>10}{'max':>10}")
+    for key, values in summary.items():
+        print(f"{key:<26}{values['median']:>10.1f}{values['min']:>10.1f}{values['max']:>10.1f}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        print(f"\nCompared with {baseline.get('commit') or 'baseline'} (median):")
+        for key, values in summary.items():
+            old = baseline["summary"][key]["median"]
+            change = f"{(values['median'] - old) / old:+.1%}" if old else "n/a"
+            print(f"{key:<26}{old:>10.1f} -> {values['median']:>8.1f}  {change}")
+
+    print(f"SDK imported at startup: {any(r['sdk_loaded_at_startup'] for r in runs)}")
+    report = {"commit": git_commit(root), "runs": runs, "summary": summary}
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nWrote {args.output}")
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+import asyncio
+import hashlib
+import importlib.abc
+import importlib.util
+import random
+import re
+import sys
+import threading
+import time
+
+
+# ---------------------------
+# Local stand-in for genai.GenerativeModel
+# ---------------------------
+#
+# Used by the benchmarks so they run offline and deterministically. Latency,
+# error rate, timeouts (calls that hang) and empty responses are injectable.
+
+MOCK_SECTIONS = [
+    "Therapeutic Uses",
+    "Standard Dosage",
+    "Common Side Effects",
+    "Serious Side Effects",
+    "Contraindications",
+    "Important Drug Interactions",
+]
+
+
+class MockConfig:
+    def __init__(self, latency=0.3, jitter=0.1, error_rate=0.0, timeout_rate=0.0, empty_rate=0.0,
+                 hang_seconds=30.0, chunks=6, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.timeout_rate = timeout_rate
+        self.empty_rate = empty_rate
+        self.hang_seconds = hang_seconds
+        self.chunks = chunks
+        self.random = random.Random(seed)
+
+
+class MockResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class _MockStream:
+    def __init__(self, parts, gap):
+        self.parts = list(parts)
+        self.gap = gap
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not self.parts:
+            raise StopAsyncIteration
+        await asyncio.sleep(self.gap)
+        return MockResponse(self.parts.pop(0))
+
+
+class MockStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.empty = 0
+
+    def count(self, field):
+        with self.lock:
+            setattr(self, field, getattr(self, field) + 1)
+
+    def snapshot(self):
+        with self.lock:
+            return {"calls": self.calls, "errors": self.errors, "timeouts": self.timeouts, "empty": self.empty}
+
+
+config = MockConfig()
+stats = MockStats()
+
+
+def mock_text(prompt):
+    """A markdown answer shaped like the real one, varied by prompt."""
+    prompt_text = prompt if isinstance(prompt, str) else str(prompt[0])
+    tag = hashlib.md5(prompt_text.encode("utf-8")).hexdigest()[:8]
+    if "side by side in a Markdown table" in prompt_text:
+        rows = "\n".join(f"| {aspect} | value {tag} | value {tag} |" for aspect in MOCK_SECTIONS)
+        return f"| Aspect | A | B |\n|---|---|---|\n{rows}\n\n**Interaction severity:** Minor - mock {tag}"
+    if prompt_text.startswith("Do the drugs"):
+        return f"**Interaction severity:** Moderate - mock {tag}"
+    if "under each of these Markdown headings" in prompt_text:
+        # Per-drug comparison cells: answer exactly the headings asked for
+        headings = re.findall(r"^## (.+)$", prompt_text, re.MULTILINE)
+        return "\n\n".join(f"## {heading}\n- Mock point {tag}-{i}" for i, heading in enumerate(headings))
+    return "\n\n".join(f"## {heading}\n- Mock point {tag}-{i}" for i, heading in enumerate(MOCK_SECTIONS))
+
+
+class MockGenerativeModel:
+    def __init__(self, model_name="mock", **kwargs):
+        self.model_name = model_name
+
+    def _outcome(self):
+        r = config.random.random()
+        if r < config.error_rate:
+            return "error"
+        r -= config.error_rate
+        if r < config.timeout_rate:
+            return "timeout"
+        r -= config.timeout_rate
+        if r < config.empty_rate:
+            return "empty"
+        return "ok"
+
+    def _latency(self):
+        return max(0.0, config.latency + config.random.uniform(-config.jitter, config.jitter))
+
+    def generate_content(self, prompt, stream=False, **kwargs):
+        stats.count("calls")
+        outcome = self._outcome()
+        if outcome == "timeout":
+            stats.count("timeouts")
+            time.sleep(config.hang_seconds)
+        time.sleep(self._latency())
+        if outcome == "error":
+            stats.count("errors")
+            raise RuntimeError("Mock Gemini error")
+        if outcome == "empty":
+            stats.count("empty")
+            return MockResponse("")
+        return MockResponse(mock_text(prompt))
+
+    async def generate_content_async(self, prompt, stream=False, **kwargs):
+        stats.count("calls")
+        outcome = self._outcome()
+        if outcome == "timeout":
+            stats.count("timeouts")
+            await asyncio.sleep(config.hang_seconds)
+        latency = self._latency()
+        if outcome == "error":
+            await asyncio.sleep(latency)
+            stats.count("errors")
+            raise RuntimeError("Mock Gemini error")
+        if outcome == "empty":
+            await asyncio.sleep(latency)
+            stats.count("empty")
+            return MockResponse("")
+        text = mock_text(prompt)
+        if stream:
+            size = max(1, len(text) // config.chunks)
+            parts = [text[i:i + size] for i in range(0, len(text), size)]
+            return _MockStream(parts, latency / len(parts))
+        await asyncio.sleep(latency)
+        return MockResponse(text)
+
+
+def _patch(genai):
+    genai.GenerativeModel = MockGenerativeModel
+    genai.configure = lambda **kwargs: None
+
+
+class _PatchOnImport(importlib.abc.MetaPathFinder):
+    """Patch google.generativeai right after whoever imports it first, without importing it ourselves."""
+
+    def find_spec(self, name, path, target=None):
+        if name != "google.generativeai":
+            return None
+        sys.meta_path.remove(self)
+        try:
+            spec = importlib.util.find_spec(name)
+        finally:
+            sys.meta_path.insert(0, self)
+        if spec is None:
+            return None
+        exec_module = spec.loader.exec_module
+
+        def exec_and_patch(module):
+            exec_module(module)
+            _patch(module)
+
+        spec.loader.exec_module = exec_and_patch
+        return spec
+
+
+def install(lazy=False):
+    """
+    Replace genai.GenerativeModel (and genai.configure) before the app is imported.
+    With lazy=True the SDK is patched when the app first imports it, so
+    startup measurements aren't skewed by the mock importing it early.
+    """
+    if "google.generativeai" in sys.modules or not lazy:
+        import google.generativeai as genai
+
+        _patch(genai)
+        return
+    sys.meta_path.insert(0, _PatchOnImport())
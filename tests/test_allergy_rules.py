@@ -0,0 +1,21 @@
+from backend.utils.allergy_rules import CAUTION, UNSAFE, load_rules, render_screen, screen_allergies
+
+
+def test_beta_lactam_allergy_covers_all_beta_lactam_classes():
+    rules = load_rules()
+    for medicine in ("amoxicillin", "ceftriaxone", "meropenem"):
+        verdict, _ = rules.check_pair("beta-lactam", medicine)
+        assert verdict == UNSAFE, medicine
+
+
+def test_beta_lactam_allergy_screen_says_not_safe():
+    results, _ = screen_allergies(["beta lactam"], ["ceftriaxone", "meropenem"])
+    assert results["ceftriaxone"]["verdict"] == UNSAFE
+    assert results["meropenem"]["verdict"] == UNSAFE
+    assert render_screen(results).count("Not safe") == 2
+
+
+def test_penicillin_allergy_is_only_caution_for_other_beta_lactams():
+    rules = load_rules()
+    assert rules.check_pair("penicillin", "ceftriaxone")[0] == CAUTION
+    assert rules.check_pair("penicillin", "meropenem")[0] == CAUTION
@@ -0,0 +1,22 @@
+from backend.utils.symptom_cache import SemanticCache, fuzzy_matchable
+
+
+def test_opposite_prefix_terms_never_share_an_entry():
+    cache = SemanticCache("test")
+    cache.set("hyponatremia", "low sodium")
+    assert cache.get("hypernatremia") is None
+    assert cache.get("hyponatremia") == "low sodium"
+    assert not fuzzy_matchable("hypernatremia")
+    assert not fuzzy_matchable("tachycardia")
+
+
+def test_misspelt_symptom_still_matches():
+    cache = SemanticCache("test")
+    cache.set("vomiting", "answer")
+    assert cache.get("vomitting") == "answer"
+
+
+def test_negated_symptom_must_match_exactly():
+    cache = SemanticCache("test")
+    cache.set("chest pain", "answer")
+    assert cache.get("no chest pain") is None
@@ -0,0 +1,20 @@
+"""
+Standalone job worker for background image analyses.
+
+Run next to the web app with a shared SQLite queue:
+    JOB_WORKERS=0 gunicorn app:app       # web: only enqueues
+    python worker.py --workers 4         # runs the jobs
+"""
+import argparse
+
+from backend import create_app
+from backend.utils.job_queue import run_worker
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run background image analysis jobs.")
+    parser.add_argument("--workers", type=int, default=None, help="Worker threads (default JOB_WORKERS or 1).")
+    args = parser.parse_args()
+    # Loads .env, sets up logging and checks GEMINI_KEY like the web app
+    create_app()
+    run_worker(args.workers)